@@ -0,0 +1,6 @@
+"""Load-testing and micro-benchmark tools for the license server.
+
+    python -m benchmarks seed --db /tmp/bench.db --licenses 10000 --devices 3
+    python -m benchmarks run --db /tmp/bench.db --duration 30 --threads 16 --output before.json
+    python -m benchmarks compare before.json after.json
+"""
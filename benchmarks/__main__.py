@@ -0,0 +1,48 @@
+"""Command line for the benchmark suite (python -m benchmarks --help)"""
+import argparse
+import sys
+
+from benchmarks import compare, replay, seed
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='License server benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    seed_parser = commands.add_parser('seed', help='Fill a database with licenses and devices')
+    seed_parser.add_argument('--db', required=True, help='SQLite database file to create or extend')
+    seed_parser.add_argument('--licenses', type=int, default=10000)
+    seed_parser.add_argument('--devices', type=int, default=3, help='Average devices per license')
+    seed_parser.add_argument('--blocked-ratio', type=float, default=0.05)
+    seed_parser.add_argument('--seed', type=int, default=None, help='Random seed for reproducible data')
+    seed_parser.add_argument('--reset', action='store_true', help='Delete the database first')
+    seed_parser.set_defaults(handler=seed.main)
+
+    run_parser = commands.add_parser('run', help='Replay traffic and report latency percentiles as JSON')
+    run_parser.add_argument('--db', required=True, help='Seeded SQLite database')
+    run_parser.add_argument('--duration', type=float, default=30, help='Seconds to run')
+    run_parser.add_argument('--requests', type=int, default=None, help='Stop after this many requests instead')
+    run_parser.add_argument('--threads', type=int, default=8, help='Concurrent clients')
+    run_parser.add_argument('--mix', default=None,
+                            help=f"Request weights, e.g. heartbeat=60,poll_status=40 (endpoints: {', '.join(replay.DEFAULT_MIX)})")
+    run_parser.add_argument('--seed', type=int, default=None)
+    run_parser.add_argument('--url', default=None, help='Target an already running server instead of in-process')
+    run_parser.add_argument('--gunicorn', action='store_true', help='Start a local gunicorn against --db and target it')
+    run_parser.add_argument('--port', type=int, default=8765)
+    run_parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    run_parser.add_argument('--gunicorn-threads', type=int, default=16, help='Threads per gunicorn worker')
+    run_parser.add_argument('--output', default=None, help='Write the JSON report here instead of stdout')
+    run_parser.set_defaults(handler=replay.main)
+
+    compare_parser = commands.add_parser('compare', help='Compare two JSON reports')
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+    compare_parser.add_argument('--threshold', type=float, default=10.0, help='Percent change counted as a regression')
+    compare_parser.set_defaults(handler=compare.main)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.handler(args) or 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,44 @@
+"""Compare two benchmark reports and flag regressions"""
+import json
+
+METRICS = (('p50_ms', 'lower'), ('p95_ms', 'lower'), ('p99_ms', 'lower'), ('throughput_rps', 'higher'))
+
+def compare_reports(before, after, threshold):
+    """Return (rows, regressions) comparing per-endpoint metrics of two reports"""
+    rows = []
+    regressions = []
+    for name in sorted(set(before['endpoints']) & set(after['endpoints'])):
+        for metric, better in METRICS:
+            old = before['endpoints'][name].get(metric)
+            new = after['endpoints'][name].get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100
+            worse = change > threshold if better == 'lower' else change < -threshold
+            rows.append((name, metric, old, new, change, worse))
+            if worse:
+                regressions.append(f'{name} {metric}: {old} -> {new} ({change:+.1f}%)')
+    return rows, regressions
+
+def main(args):
+    """Entry point for `python -m benchmarks compare`; exits non-zero on regressions"""
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    rows, regressions = compare_reports(before, after, args.threshold)
+    print(f"{'endpoint':<14} {'metric':<15} {'before':>10} {'after':>10} {'change':>9}")
+    for name, metric, old, new, change, worse in rows:
+        marker = '  <-- regression' if worse else ''
+        print(f"{name:<14} {metric:<15} {old:>10} {new:>10} {change:>+8.1f}%{marker}")
+
+    lock_before = before.get('sqlite_lock', {}).get('lock_waits')
+    lock_after = after.get('sqlite_lock', {}).get('lock_waits')
+    if lock_before is not None and lock_after is not None:
+        print(f"{'sqlite':<14} {'lock_waits':<15} {lock_before:>10} {lock_after:>10}")
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond {args.threshold}%")
+        return 1
+    return 0
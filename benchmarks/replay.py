@@ -0,0 +1,365 @@
+"""Replay a realistic request mix against the license server and report latency percentiles"""
+import os
+import sys
+import glob
+import json
+import time
+import random
+import sqlite3
+import platform
+import tempfile
+import threading
+import subprocess
+import http.client
+from urllib.parse import urlsplit, quote
+
+from benchmarks.seed import REPO_ROOT, load_server
+
+# Request mix, as relative weights
+DEFAULT_MIX = {
+    'poll_status': 30,   # script-with-license.js polling GET /api/licenses/<key>/status
+    'poll_search': 10,   # older clients polling GET /api/licenses?search=<key>
+    'heartbeat': 50,     # POST /api/devices/register from running clients
+    'admin_search': 7,   # dashboard search, first page
+    'admin_write': 3,    # dashboard block/unblock/edit
+}
+NEW_DEVICE_RATIO = 0.05  # Share of heartbeats that come from a device the server has not seen
+SAMPLE_SIZE = 10000
+LOCK_WAIT_BUCKET = '0.001'  # BEGIN IMMEDIATE slower than this (seconds) waited for another writer
+GUNICORN_METRICS_FLUSH = 1  # METRICS_FLUSH_INTERVAL for the benchmark's own gunicorn
+
+def parse_mix(text):
+    """Parse 'heartbeat=60,poll_status=40' into a weight dict"""
+    if not text:
+        return dict(DEFAULT_MIX)
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in DEFAULT_MIX:
+            raise ValueError(f"Unknown endpoint '{name}'. Use: {', '.join(DEFAULT_MIX)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+def load_sample(db_path, size=SAMPLE_SIZE):
+    """Pick the licenses and devices the replay will use"""
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    try:
+        licenses = conn.execute(
+            'SELECT id, license_key, username FROM licenses ORDER BY RANDOM() LIMIT ?', (size,)
+        ).fetchall()
+    finally:
+        conn.close()
+    # Devices live in the primary database, or in its device shards with DEVICE_SHARDS
+    base, ext = os.path.splitext(db_path)
+    devices = []
+    for path in [db_path] + sorted(glob.glob(f'{glob.escape(base)}.devices-*{ext}')):
+        conn = sqlite3.connect(path)
+        conn.row_factory = sqlite3.Row
+        try:
+            devices.extend(conn.execute(
+                'SELECT license_key, device_fingerprint FROM device_registrations ORDER BY RANDOM() LIMIT ?', (size,)
+            ).fetchall())
+        finally:
+            conn.close()
+    devices = random.sample(devices, min(size, len(devices)))
+    if not licenses:
+        raise RuntimeError(f'{db_path} has no licenses - run `python -m benchmarks seed` first')
+    return {
+        'licenses': [(row['id'], row['license_key'], row['username']) for row in licenses],
+        'devices': [(row['license_key'], row['device_fingerprint']) for row in devices],
+    }
+
+def build_request(name, sample, rng):
+    """Return (method, path, json body) for one request of the given kind"""
+    license_id, license_key, username = rng.choice(sample['licenses'])
+    if name == 'poll_status':
+        return 'GET', f'/api/licenses/{license_key}/status', None
+    if name == 'poll_search':
+        return 'GET', f'/api/licenses?search={license_key}', None
+    if name == 'heartbeat':
+        if sample['devices'] and rng.random() >= NEW_DEVICE_RATIO:
+            license_key, fingerprint = rng.choice(sample['devices'])
+        else:
+            fingerprint = f'bench-new-{rng.getrandbits(64):016x}'
+        return 'POST', '/api/devices/register', {'license_key': license_key, 'device_fingerprint': fingerprint}
+    if name == 'admin_search':
+        term = username[:rng.randint(3, 6)]
+        return 'GET', f'/api/licenses?search={quote(term)}&limit=50', None
+    action = rng.choice(('block', 'unblock', 'update'))
+    if action == 'update':
+        return 'PUT', f'/api/licenses/{license_id}', {'amount': round(rng.uniform(0, 500), 2)}
+    return 'POST', f'/api/licenses/{license_id}/{action}', None
+
+class InProcessClient:
+    """Sends requests through Flask's test client"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body):
+        response = self.client.open(path, method=method, json=body)
+        response.close()
+        return response.status_code
+
+    def close(self):
+        pass
+
+class HttpClient:
+    """Sends requests over one persistent HTTP connection"""
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.conn = None
+
+    def request(self, method, path, body):
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        headers = {}
+        data = None
+        if body is not None:
+            data = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        try:
+            self.conn.request(method, path, body=data, headers=headers)
+            response = self.conn.getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException):
+            self.close()
+            return 0  # Connection error
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+def read_lock_metrics(text):
+    """BEGIN IMMEDIATE latency histogram and 'database is locked' count from /metrics output.
+
+    Every write path takes the write lock with BEGIN IMMEDIATE (on the primary and on each
+    device shard), so its latency is the server's own measure of lock wait.
+    """
+    stats = {'buckets': {}, 'sum': 0.0, 'locked': 0.0}
+    begin = 'statement="BEGIN IMMEDIATE"'
+    for line in text.splitlines():
+        if line.startswith('#') or ' ' not in line:
+            continue
+        name, value = line.rsplit(' ', 1)
+        if name.startswith('license_db_statement_duration_seconds_bucket{') and begin in name:
+            stats['buckets'][name.split('le="')[1].split('"')[0]] = float(value)
+        elif name.startswith('license_db_statement_duration_seconds_sum{') and begin in name:
+            stats['sum'] = float(value)
+        elif name.startswith('license_db_locked_errors_total'):
+            stats['locked'] += float(value)
+    return stats
+
+def lock_report(before, after):
+    """Lock waits during the run: the difference between two read_lock_metrics() snapshots"""
+    buckets = {le: count - before['buckets'].get(le, 0) for le, count in after['buckets'].items()}
+    total = buckets.get('+Inf', 0)
+
+    def quantile(pct):
+        # Upper bound of the histogram bucket holding the percentile
+        if not total:
+            return None
+        bounds = sorted((float(le), count) for le, count in buckets.items() if le != '+Inf')
+        for bound, count in bounds:
+            if count >= total * pct / 100:
+                return round(bound * 1000, 3)
+        return None  # Beyond the largest bucket
+
+    return {
+        'source': 'server metrics (BEGIN IMMEDIATE latency)',
+        'write_transactions': int(total),
+        'lock_waits': int(total - buckets.get(LOCK_WAIT_BUCKET, 0)),
+        'lock_timeouts': int(after['locked'] - before['locked']),
+        'wait_mean_ms': round((after['sum'] - before['sum']) / total * 1000, 3) if total else None,
+        'wait_p50_ms': quantile(50),
+        'wait_p99_ms': quantile(99),
+    }
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return round(sorted_values[int(rank) - 1], 3)
+
+def run_workload(make_client, sample, mix, threads, duration, max_requests=None, seed=None):
+    """Run the mix from `threads` workers for `duration` seconds (or max_requests in total).
+
+    Returns (elapsed seconds, {endpoint: [(latency ms, status), ...]}).
+    """
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    results = {name: [] for name in names}
+    results_lock = threading.Lock()
+    remaining = [max_requests]
+    deadline = time.perf_counter() + duration
+
+    def take_request():
+        if remaining[0] is None:
+            return time.perf_counter() < deadline
+        with results_lock:
+            if remaining[0] <= 0:
+                return False
+            remaining[0] -= 1
+            return True
+
+    def worker(worker_number):
+        rng = random.Random(None if seed is None else seed + worker_number)
+        client = make_client()
+        local = {name: [] for name in names}
+        try:
+            while take_request():
+                name = rng.choices(names, weights)[0]
+                method, path, body = build_request(name, sample, rng)
+                started = time.perf_counter()
+                status = client.request(method, path, body)
+                local[name].append(((time.perf_counter() - started) * 1000, status))
+        finally:
+            client.close()
+        with results_lock:
+            for name in names:
+                results[name].extend(local[name])
+
+    workers = [threading.Thread(target=worker, args=(number,)) for number in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return time.perf_counter() - started, results
+
+def summarize(elapsed, results):
+    """Per-endpoint throughput, latency percentiles and status counts"""
+    endpoints = {}
+    for name, samples in results.items():
+        latencies = sorted(latency for latency, _ in samples)
+        statuses = {}
+        for _, status in samples:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        endpoints[name] = {
+            'requests': len(samples),
+            'throughput_rps': round(len(samples) / elapsed, 1) if elapsed else None,
+            'mean_ms': round(sum(latencies) / len(latencies), 3) if latencies else None,
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99),
+            'max_ms': round(latencies[-1], 3) if latencies else None,
+            'errors': sum(1 for _, status in samples if status == 0 or status >= 500),
+            'status': statuses,
+        }
+    total = sum(endpoint['requests'] for endpoint in endpoints.values())
+    return {
+        'duration_s': round(elapsed, 3),
+        'total_requests': total,
+        'throughput_rps': round(total / elapsed, 1) if elapsed else None,
+        'endpoints': endpoints,
+    }
+
+def fetch_metrics(base_url):
+    """GET /metrics from a running server"""
+    parts = urlsplit(base_url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+    try:
+        conn.request('GET', '/metrics')
+        return conn.getresponse().read().decode()
+    finally:
+        conn.close()
+
+def start_gunicorn(db_path, port, workers, threads):
+    """Start gunicorn on 127.0.0.1:port and wait until it answers"""
+    # Own metrics directory, and frequent flushes so /metrics covers every worker right after the run
+    env = dict(os.environ, DATABASE_PATH=os.path.abspath(db_path),
+               METRICS_DIR=tempfile.mkdtemp(prefix='bench-metrics-'),
+               METRICS_FLUSH_INTERVAL=str(GUNICORN_METRICS_FLUSH))
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'server:app',
+         '--bind', f'127.0.0.1:{port}',
+         '--workers', str(workers),
+         '--worker-class', 'gthread', '--threads', str(threads),
+         '--log-level', 'warning'],
+        cwd=REPO_ROOT, env=env,
+        stdout=sys.stderr  # Server logs must not mix with the JSON report on stdout
+    )
+    client = HttpClient(f'http://127.0.0.1:{port}')
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'gunicorn exited with status {process.returncode}')
+        if client.request('GET', '/api/licenses?limit=1', None) == 200:
+            client.close()
+            return process
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('gunicorn did not start within 30 seconds')
+
+def main(args):
+    """Entry point for `python -m benchmarks run`"""
+    mix = parse_mix(args.mix)
+    gunicorn = None
+    # Seconds for every worker to have written its metrics after the run
+    settle = 0
+    if args.gunicorn:
+        gunicorn = start_gunicorn(args.db, args.port, args.workers, args.gunicorn_threads)
+        base_url = f'http://127.0.0.1:{args.port}'
+        make_client = lambda: HttpClient(base_url)
+        get_metrics = lambda: fetch_metrics(base_url)
+        settle = GUNICORN_METRICS_FLUSH * 1.5
+        target = f'gunicorn ({args.workers} workers x {args.gunicorn_threads} threads)'
+    elif args.url:
+        make_client = lambda: HttpClient(args.url)
+        get_metrics = lambda: fetch_metrics(args.url)
+        settle = 5.5  # The server's default METRICS_FLUSH_INTERVAL, plus margin
+        target = args.url
+    else:
+        server = load_server(args.db)
+        make_client = lambda: InProcessClient(server.app)
+        get_metrics = lambda: server.app.test_client().get('/metrics').get_data(as_text=True)
+        target = 'in-process'
+
+    try:
+        sample = load_sample(args.db)
+        time.sleep(settle)
+        lock_before = read_lock_metrics(get_metrics())
+        elapsed, results = run_workload(
+            make_client, sample, mix, args.threads, args.duration,
+            max_requests=args.requests, seed=args.seed
+        )
+        time.sleep(settle)
+        lock_after = read_lock_metrics(get_metrics())
+    finally:
+        if gunicorn is not None:
+            gunicorn.terminate()
+            gunicorn.wait()
+
+    report = summarize(elapsed, results)
+    report['sqlite_lock'] = lock_report(lock_before, lock_after)
+    report['config'] = {
+        'target': target,
+        'db': os.path.abspath(args.db),
+        'threads': args.threads,
+        'duration_s': args.duration,
+        'max_requests': args.requests,
+        'mix': mix,
+        'seed': args.seed,
+        'device_shards': int(os.environ.get('DEVICE_SHARDS') or 0),
+    }
+    report['environment'] = {
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        print(f"Wrote {args.output}: {report['total_requests']} requests, {report['throughput_rps']} req/s")
+    else:
+        print(output)
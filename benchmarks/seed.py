@@ -0,0 +1,106 @@
+"""Seed a SQLite database with licenses and devices for benchmarking"""
+import os
+import sys
+import contextlib
+import random
+import time
+from datetime import datetime, timedelta
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+USERNAMES = (
+    'alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel',
+    'india', 'juliet', 'kilo', 'lima', 'mike', 'november', 'oscar', 'papa',
+)
+
+def load_server(db_path):
+    """Import server.py against db_path and apply its migrations.
+
+    server.py reads DATABASE_PATH at import time, so this must run before anything
+    else imports it.
+    """
+    os.environ['DATABASE_PATH'] = os.path.abspath(db_path)
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    # Keep the server's startup messages off stdout, where `run` may print its JSON report
+    with contextlib.redirect_stdout(sys.stderr):
+        import server
+        if server.DATABASE != os.environ['DATABASE_PATH']:
+            raise RuntimeError(f'server.py is already loaded against {server.DATABASE}')
+        server.init_db()
+    return server
+
+def seed_database(server, licenses, devices_per_license, blocked_ratio=0.05, batch_size=5000, seed=None):
+    """Insert licenses (with on average devices_per_license devices each) in batches.
+
+    Returns (licenses created, devices created).
+    """
+    rng = random.Random(seed)
+    now = datetime.now()
+    conn = server.open_db_connection()
+    created_licenses = created_devices = 0
+    try:
+        while created_licenses < licenses:
+            count = min(batch_size, licenses - created_licenses)
+            conn.execute('BEGIN IMMEDIATE')
+            keys = server.license_key_allocator.reserve(conn, count)
+            license_rows = []
+            device_rows = []
+            for number, license_key in enumerate(keys, created_licenses + 1):
+                created_at = now - timedelta(seconds=rng.randint(0, 365 * 86400))
+                license_rows.append((
+                    f'{rng.choice(USERNAMES)}{number}',
+                    round(rng.uniform(0, 500), 2),
+                    license_key,
+                    1 if rng.random() < blocked_ratio else 0,
+                    created_at.strftime('%Y-%m-%d %H:%M:%S'),
+                ))
+                for device_number in range(rng.randint(0, 2 * devices_per_license)):
+                    registered_at = created_at + timedelta(seconds=rng.randint(0, 86400))
+                    last_seen = max(registered_at, now - timedelta(seconds=rng.randint(0, 30 * 86400)))
+                    device_rows.append((
+                        license_key,
+                        f'bench-{license_key}-{device_number}',
+                        registered_at.strftime('%Y-%m-%d %H:%M:%S'),
+                        last_seen.strftime('%Y-%m-%d %H:%M:%S'),
+                    ))
+            conn.executemany(
+                'INSERT INTO licenses (username, amount, license_key, devices, is_blocked, created_at, created_epoch) '
+                f"VALUES (?1, ?2, ?3, 0, ?4, ?5, {server.epoch_sql('?5')})",
+                license_rows
+            )
+            # The device count and activity triggers fill in licenses.devices and the rollups
+            # (with DEVICE_SHARDS, counts are reconciled once at the end instead)
+            device_sql = (
+                'INSERT INTO device_registrations '
+                '(license_key, device_fingerprint, registered_at, last_seen, registered_epoch, last_seen_epoch) '
+                f"VALUES (?1, ?2, ?3, ?4, {server.epoch_sql('?3')}, {server.epoch_sql('?4')})"
+            )
+            for rows in server.group_by_device_shard(device_rows, lambda row: row[0]).values():
+                devices_conn = server.get_device_connection(conn, rows[0][0])
+                devices_conn.executemany(device_sql, rows)
+                if devices_conn is not conn:
+                    devices_conn.commit()
+            conn.commit()
+            created_licenses += count
+            created_devices += len(device_rows)
+        if server.DEVICE_SHARDS:
+            server.reconcile_device_counts(conn)
+        for db in [conn] + (server.device_shards(conn) if server.DEVICE_SHARDS else []):
+            db.execute('PRAGMA optimize')
+    finally:
+        conn.close()
+    return created_licenses, created_devices
+
+def main(args):
+    """Entry point for `python -m benchmarks seed`"""
+    if args.reset and os.path.exists(args.db):
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+    server = load_server(args.db)
+    started = time.perf_counter()
+    licenses, devices = seed_database(
+        server, args.licenses, args.devices, blocked_ratio=args.blocked_ratio, seed=args.seed
+    )
+    print(f"Seeded {licenses} licenses and {devices} devices into {args.db} in {time.perf_counter() - started:.1f}s")
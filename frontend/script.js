@@ -86,8 +86,8 @@ document.getElementById('createLicenseForm').addEventListener('submit', async (e
             document.getElementById('amount').value = '0';
             document.getElementById('licenseKey').value = '';
             
-            // Reload licenses
-            loadLicenses();
+            // Pick up the new row from the change feed
+            syncChanges();
             
             // Show success message
             showNotification(`License created successfully! Key: ${license.license_key}`, 'success');
@@ -159,30 +159,97 @@ function generateRandomKey() {
     return key;
 }
 
-// Load licenses
+// Pagination state for the license table
+const PAGE_SIZE = 50;
+let currentSearchTerm = '';
+let nextCursor = null;
+let loadedLicenses = new Map(); // id -> license, for rows currently in the table
+let selectedIds = new Set(); // ids checked for bulk actions
+
+// Load licenses (first page, replacing the table)
 async function loadLicenses(searchTerm = '') {
+    currentSearchTerm = searchTerm;
+    nextCursor = null;
+    await startChangeFeed();
+    await fetchLicensePage(false);
+}
+
+// Load the next page and append it to the table
+async function loadMoreLicenses() {
+    if (!nextCursor) {
+        return;
+    }
+    const loadMoreBtn = document.getElementById('loadMoreBtn');
+    loadMoreBtn.disabled = true;
     try {
-        const url = searchTerm 
-            ? `${API_BASE_URL}/licenses?search=${encodeURIComponent(searchTerm)}`
-            : `${API_BASE_URL}/licenses`;
+        await fetchLicensePage(true);
+    } finally {
+        loadMoreBtn.disabled = false;
+    }
+}
+
+// Last JSON response per URL, revalidated with If-None-Match so unchanged data comes back as an empty 304
+const ETAG_CACHE_MAX = 50;
+const etagCache = new Map(); // url -> { etag, data }
+
+async function fetchJsonWithEtag(url) {
+    const cached = etagCache.get(url);
+    const headers = {};
+    if (cached) {
+        headers['If-None-Match'] = cached.etag;
+    }
+    
+    const response = await fetch(url, {
+        method: 'GET',
+        headers: headers,
+        mode: 'cors',
+        credentials: 'omit',
+        cache: 'no-store'
+    });
+    
+    if (response.status === 304 && cached) {
+        return { ok: true, status: 304, data: cached.data, response: response };
+    }
+    if (!response.ok) {
+        return { ok: false, status: response.status, data: null, response: response };
+    }
+    
+    const data = await response.json();
+    const etag = response.headers.get('ETag');
+    if (etag) {
+        etagCache.delete(url);
+        etagCache.set(url, { etag: etag, data: data });
+        if (etagCache.size > ETAG_CACHE_MAX) {
+            etagCache.delete(etagCache.keys().next().value);
+        }
+    }
+    return { ok: true, status: response.status, data: data, response: response };
+}
+
+async function fetchLicensePage(append) {
+    try {
+        const params = new URLSearchParams({ limit: PAGE_SIZE });
+        if (currentSearchTerm) {
+            params.set('search', currentSearchTerm);
+            params.set('sort', 'relevance');
+        }
+        if (append && nextCursor) {
+            params.set('cursor', nextCursor);
+        }
+        const url = `${API_BASE_URL}/licenses?${params.toString()}`;
         
         console.log('[Admin Panel] Loading licenses from:', url);
         
-        const response = await fetch(url, {
-            method: 'GET',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            mode: 'cors',
-            credentials: 'omit'
-        });
+        const result = await fetchJsonWithEtag(url);
+        const response = result.response;
         
         console.log('[Admin Panel] Load licenses response:', response.status, response.statusText);
         
-        if (response.ok) {
-            const licenses = await response.json();
-            console.log('[Admin Panel] Licenses loaded:', licenses.length);
-            displayLicenses(licenses);
+        if (result.ok) {
+            const page = result.data;
+            console.log('[Admin Panel] Licenses loaded:', page.licenses.length);
+            nextCursor = page.next_cursor;
+            displayLicenses(page.licenses, append);
         } else {
             console.error('[Admin Panel] Failed to load licenses:', response.status, response.statusText);
             let errorMsg = 'Failed to load licenses';
@@ -193,39 +260,65 @@ async function loadLicenses(searchTerm = '') {
                 errorMsg = `Server error: ${response.status} ${response.statusText}`;
             }
             showNotification(errorMsg, 'error');
-            const tableBody = document.getElementById('licenseTableBody');
-            tableBody.innerHTML = '<tr><td colspan="8" class="empty-state">Error loading licenses. Make sure the server is running.</td></tr>';
+            if (!append) {
+                const tableBody = document.getElementById('licenseTableBody');
+                tableBody.innerHTML = '<tr><td colspan="9" class="empty-state">Error loading licenses. Make sure the server is running.</td></tr>';
+            }
         }
     } catch (error) {
         console.error('[Admin Panel] Error loading licenses:', error);
         console.error('[Admin Panel] Error details:', error.message, error.stack);
-        const tableBody = document.getElementById('licenseTableBody');
         let errorMsg = 'Error loading licenses. ';
         if (error.message.includes('Failed to fetch') || error.message.includes('NetworkError')) {
             errorMsg += 'Cannot connect to server. Please check your connection.';
         } else {
             errorMsg += error.message || 'Make sure the server is running.';
         }
-        tableBody.innerHTML = `<tr><td colspan="8" class="empty-state">${errorMsg}</td></tr>`;
+        if (append) {
+            showNotification(errorMsg, 'error');
+        } else {
+            const tableBody = document.getElementById('licenseTableBody');
+            tableBody.innerHTML = `<tr><td colspan="9" class="empty-state">${errorMsg}</td></tr>`;
+        }
     }
+    
+    document.getElementById('loadMoreBtn').style.display = nextCursor ? 'inline-flex' : 'none';
 }
 
-// Display licenses in table
-function displayLicenses(licenses) {
+// Display licenses in table (append adds the rows below the ones already shown)
+function displayLicenses(licenses, append = false) {
     const tableBody = document.getElementById('licenseTableBody');
     
-    if (licenses.length === 0) {
-        tableBody.innerHTML = '<tr><td colspan="8" class="empty-state">No licenses found.</td></tr>';
+    if (!append) {
+        loadedLicenses = new Map();
+        clearSelection();
+    }
+    licenses.forEach(license => loadedLicenses.set(license.id, license));
+    
+    if (!append && licenses.length === 0) {
+        tableBody.innerHTML = '<tr><td colspan="9" class="empty-state">No licenses found.</td></tr>';
         return;
     }
 
-    tableBody.innerHTML = licenses.map(license => {
-        const isBlocked = license.is_blocked === 1 || license.is_blocked === true;
-        const statusClass = isBlocked ? 'status-blocked' : 'status-active';
-        const statusText = isBlocked ? 'Blocked' : 'Active';
-        
-        return `
-        <tr>
+    const rowsHtml = licenses.map(license => renderLicenseRow(license)).join('');
+    
+    if (append) {
+        tableBody.insertAdjacentHTML('beforeend', rowsHtml);
+    } else {
+        tableBody.innerHTML = rowsHtml;
+    }
+    updateBulkActions();
+}
+
+function renderLicenseRow(license) {
+    const isBlocked = license.is_blocked === 1 || license.is_blocked === true;
+    const statusClass = isBlocked ? 'status-blocked' : 'status-active';
+    const statusText = isBlocked ? 'Blocked' : 'Active';
+    const checked = selectedIds.has(license.id) ? ' checked' : '';
+    
+    return `
+        <tr data-id="${license.id}">
+            <td class="select-cell"><input type="checkbox" class="row-select" data-id="${license.id}" onchange="toggleSelection(${license.id}, this.checked)"${checked}></td>
             <td>${license.id}</td>
             <td>${escapeHtml(license.username)}</td>
             <td>${parseFloat(license.amount).toFixed(2)}</td>
@@ -243,7 +336,199 @@ function displayLicenses(licenses) {
             </td>
         </tr>
         `;
-    }).join('');
+}
+
+// Change feed - instead of reloading the table after every change, fetch the licenses
+// created, updated or deleted since the last seen sequence number and patch the rows
+// in place. Polling keeps several admin sessions in sync.
+const CHANGE_POLL_INTERVAL = 5000;
+let changeSeq = null; // Last change applied; null until the feed has been started
+let changeSync = null; // Sync in progress
+let changeSyncAgain = false; // Another sync was requested while one was running
+
+async function startChangeFeed() {
+    try {
+        const response = await fetch(`${API_BASE_URL}/changes`, { cache: 'no-store' });
+        changeSeq = response.ok ? (await response.json()).seq : null;
+    } catch (error) {
+        console.error('[Admin Panel] Error starting change feed:', error);
+        changeSeq = null;
+    }
+}
+
+function syncChanges() {
+    if (changeSync) {
+        changeSyncAgain = true;
+        return changeSync;
+    }
+    changeSync = (async () => {
+        do {
+            changeSyncAgain = false;
+            await applyPendingChanges();
+        } while (changeSyncAgain);
+    })().finally(() => {
+        changeSync = null;
+    });
+    return changeSync;
+}
+
+async function applyPendingChanges() {
+    if (changeSeq === null) {
+        // The feed could not be started, fall back to a full reload
+        await loadLicenses(currentSearchTerm);
+        return;
+    }
+    try {
+        let more = true;
+        while (more) {
+            const response = await fetch(`${API_BASE_URL}/changes?since=${changeSeq}`, { cache: 'no-store' });
+            if (!response.ok) {
+                console.error('[Admin Panel] Failed to load changes:', response.status, response.statusText);
+                return;
+            }
+            const feed = await response.json();
+            if (feed.reset) {
+                // Changes this old have been pruned
+                await loadLicenses(currentSearchTerm);
+                return;
+            }
+            feed.changes.forEach(applyLicenseChange);
+            changeSeq = feed.seq;
+            more = feed.more;
+        }
+    } catch (error) {
+        console.error('[Admin Panel] Error loading changes:', error);
+    }
+    updateBulkActions();
+}
+
+function applyLicenseChange(change) {
+    const tableBody = document.getElementById('licenseTableBody');
+    const row = tableBody.querySelector(`tr[data-id="${change.id}"]`);
+    
+    if (change.op === 'delete') {
+        if (row) {
+            row.remove();
+        }
+        loadedLicenses.delete(change.id);
+        selectedIds.delete(change.id);
+        if (loadedLicenses.size === 0 && !nextCursor) {
+            tableBody.innerHTML = '<tr><td colspan="9" class="empty-state">No licenses found.</td></tr>';
+        }
+        return;
+    }
+    
+    const license = change.license;
+    if (loadedLicenses.has(license.id)) {
+        loadedLicenses.set(license.id, license);
+        if (row) {
+            row.outerHTML = renderLicenseRow(license);
+        }
+    } else if (!currentSearchTerm && Array.from(loadedLicenses.keys()).every(id => id < license.id)) {
+        // A new license belongs at the top of the default newest-first listing. With a
+        // search active we cannot tell whether it matches, so it shows up on reload.
+        if (loadedLicenses.size === 0) {
+            tableBody.innerHTML = '';
+        }
+        loadedLicenses.set(license.id, license);
+        tableBody.insertAdjacentHTML('afterbegin', renderLicenseRow(license));
+    }
+}
+
+setInterval(() => {
+    if (!document.hidden && changeSeq !== null) {
+        syncChanges();
+    }
+}, CHANGE_POLL_INTERVAL);
+
+document.addEventListener('visibilitychange', () => {
+    if (!document.hidden && changeSeq !== null) {
+        syncChanges();
+    }
+});
+
+// Multi-select for bulk actions
+function toggleSelection(id, checked) {
+    if (checked) {
+        selectedIds.add(id);
+    } else {
+        selectedIds.delete(id);
+    }
+    updateBulkActions();
+}
+
+function toggleSelectAll(checked) {
+    document.querySelectorAll('.row-select').forEach(checkbox => {
+        checkbox.checked = checked;
+        toggleSelection(parseInt(checkbox.dataset.id), checked);
+    });
+}
+
+function clearSelection() {
+    selectedIds.clear();
+    document.querySelectorAll('.row-select').forEach(checkbox => {
+        checkbox.checked = false;
+    });
+    updateBulkActions();
+}
+
+function updateBulkActions() {
+    const count = selectedIds.size;
+    document.getElementById('bulkActions').style.display = count > 0 ? 'flex' : 'none';
+    document.getElementById('bulkSelectedCount').textContent = `${count} selected`;
+    
+    const selectAll = document.getElementById('selectAll');
+    selectAll.checked = count > 0 && count === loadedLicenses.size;
+    selectAll.indeterminate = count > 0 && count < loadedLicenses.size;
+}
+
+// Block, unblock or delete every selected license in one request
+async function bulkAction(op) {
+    const ids = Array.from(selectedIds);
+    if (ids.length === 0) {
+        return;
+    }
+    
+    const confirmMessage = op === 'delete'
+        ? `Are you sure you want to delete ${ids.length} license(s)? This action cannot be undone.`
+        : `Are you sure you want to ${op} ${ids.length} license(s)?`;
+    if (!confirm(confirmMessage)) {
+        return;
+    }
+    
+    const buttons = document.querySelectorAll('#bulkActions button');
+    buttons.forEach(button => button.disabled = true);
+    
+    try {
+        const response = await fetch(`${API_BASE_URL}/licenses/bulk`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({
+                operations: ids.map(id => ({ op: op, id: id }))
+            })
+        });
+        
+        const result = await response.json();
+        if (response.ok) {
+            clearSelection();
+            syncChanges();
+            if (result.failed > 0) {
+                const firstError = result.results.find(item => item.status === 'error');
+                showNotification(`${result.applied} license(s) updated, ${result.failed} failed: ${firstError.error}`, 'error');
+            } else {
+                showNotification(`${result.applied} license(s) ${op === 'delete' ? 'deleted' : op + 'ed'} successfully!`, 'success');
+            }
+        } else {
+            showNotification(result.error || `Failed to ${op} licenses`, 'error');
+        }
+    } catch (error) {
+        console.error(`Error applying bulk ${op}:`, error);
+        showNotification(`Error applying bulk ${op}`, 'error');
+    } finally {
+        buttons.forEach(button => button.disabled = false);
+    }
 }
 
 // Block license
@@ -258,7 +543,7 @@ async function blockLicense(id) {
         });
 
         if (response.ok) {
-            loadLicenses();
+            syncChanges();
             showNotification('License blocked successfully!', 'success');
         } else {
             const error = await response.json();
@@ -282,7 +567,7 @@ async function unblockLicense(id) {
         });
 
         if (response.ok) {
-            loadLicenses();
+            syncChanges();
             showNotification('License unblocked successfully!', 'success');
         } else {
             const error = await response.json();
@@ -306,7 +591,7 @@ async function deleteLicense(id) {
         });
 
         if (response.ok) {
-            loadLicenses();
+            syncChanges();
             showNotification('License deleted successfully!', 'success');
         } else {
             const error = await response.json();
@@ -321,14 +606,8 @@ async function deleteLicense(id) {
 // Open edit modal
 async function openEditModal(id) {
     try {
-        const response = await fetch(`${API_BASE_URL}/licenses`);
-        if (!response.ok) {
-            showNotification('Failed to load license data', 'error');
-            return;
-        }
-        
-        const licenses = await response.json();
-        const license = licenses.find(l => l.id === id);
+        // Every row in the table was loaded with the page it came from
+        const license = loadedLicenses.get(id);
         
         if (!license) {
             showNotification('License not found', 'error');
@@ -340,7 +619,6 @@ async function openEditModal(id) {
         document.getElementById('editUsername').value = license.username;
         document.getElementById('editAmount').value = license.amount;
         document.getElementById('editLicenseKey').value = license.license_key;
-        document.getElementById('editDevices').value = license.devices || 0;
         
         // Show modal
         document.getElementById('editModal').classList.add('show');
@@ -364,7 +642,6 @@ document.getElementById('editLicenseForm').addEventListener('submit', async (e)
     const username = document.getElementById('editUsername').value.trim();
     const amount = parseFloat(document.getElementById('editAmount').value) || 0;
     let licenseKey = document.getElementById('editLicenseKey').value.trim().toUpperCase();
-    const devices = parseInt(document.getElementById('editDevices').value) || 0;
     
     // Validation
     if (!username) {
@@ -385,8 +662,7 @@ document.getElementById('editLicenseForm').addEventListener('submit', async (e)
     const formData = {
         username: username,
         amount: amount,
-        license_key: licenseKey,
-        devices: devices
+        license_key: licenseKey
     };
     
     const saveBtn = document.querySelector('.btn-save');
@@ -405,7 +681,7 @@ document.getElementById('editLicenseForm').addEventListener('submit', async (e)
         
         if (response.ok) {
             closeEditModal();
-            loadLicenses();
+            syncChanges();
             showNotification('License updated successfully!', 'success');
         } else {
             const error = await response.json();
@@ -0,0 +1,15 @@
+"""gunicorn settings, read automatically when gunicorn is started from this directory"""
+import glob
+import os
+import tempfile
+
+def on_starting(arbiter):
+    # The master must not import server.py (workers are forked from it), so this repeats
+    # its METRICS_DIR default. Files left by a previous run would otherwise be added to
+    # /metrics forever.
+    directory = os.environ.get('METRICS_DIR') or os.path.join(tempfile.gettempdir(), 'license-server-metrics')
+    for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -3,6 +3,7 @@
  * License Key: OSUBRP
  * Script will only work when license is active
  * Device tracking enabled
+ * Block/unblock is pushed instantly over Server-Sent Events (polling is the fallback)
  * Server: https://niloyxdiv.onrender.com
  */
 
@@ -12,14 +13,58 @@
     // ========== CONFIGURATION ==========
     const LICENSE_KEY = 'OSUBRP';
     const API_BASE_URL = 'https://niloyxdiv.onrender.com/api';
-    const CHECK_INTERVAL = 30000; // Check license every 30 seconds
+    const CHECK_INTERVAL = 30000; // Default check interval when the server sends no next_check_in hint
+    const MIN_CHECK_INTERVAL = 5000; // Bounds for server-provided hints
+    const MAX_CHECK_INTERVAL = 3600000;
+    const LEASE_RENEW_AT = 0.8; // Renew a lease after this share of its lifetime
+    const STREAM_CHECK_INTERVAL = 300000; // Safety-net check every 5 minutes while the event stream is up
+    const STREAM_RETRY_DELAY = 600000; // Wait before re-opening a stream the server refused, doubled on each refusal
+    const STREAM_MAX_REFUSALS = 3; // After this many refusals in a row, stay on leases/polling for this page
     // ====================================
     
     // State variables
     let isLicenseActive = false;
     let observer = null;
-    let checkInterval = null;
+    let checkTimeout = null;
+    let serverCheckIn = null; // Seconds until the next check, as last suggested by the server
+    let lease = null; // Signed lease from the server: license state for this device until it expires
+    let leaseRenewAt = 0; // Time (ms) to renew the lease
+    let eventSource = null; // Server-Sent Events stream with status changes
+    let streamConnected = false;
+    let streamRetryTimeout = null;
+    let streamRefusals = 0; // Streams refused in a row (server busy or license not found)
     let deviceFingerprint = null;
+    let statusEtag = null; // ETag of the last status response
+    let lastKnownActive = false; // Status that statusEtag refers to
+
+    /**
+     * Remember the server's next_check_in hint (X-Next-Check-In header or JSON field)
+     */
+    const readCheckInHint = (response, data) => {
+        const hint = Number(response.headers.get('X-Next-Check-In') || (data && data.next_check_in));
+        if (hint > 0) {
+            serverCheckIn = hint;
+        }
+    };
+
+    /**
+     * Store a lease from the server (JSON field or X-License-Lease header).
+     * The payload is readable JSON, so its lifetime is known without another request.
+     */
+    const readLease = (response, data) => {
+        const token = (data && data.lease) || response.headers.get('X-License-Lease');
+        if (!token) {
+            return;
+        }
+        try {
+            const payload = token.split('.')[0].replace(/-/g, '+').replace(/_/g, '/');
+            const claims = JSON.parse(atob(payload));
+            lease = token;
+            leaseRenewAt = Date.now() + (claims.exp - claims.iat) * 1000 * LEASE_RENEW_AT;
+        } catch (e) {
+            lease = null; // Unreadable lease - fall back to regular checks
+        }
+    };
 
     /**
      * Generate Device Fingerprint
@@ -94,6 +139,8 @@
 
             if (response.ok) {
                 const data = await response.json();
+                readCheckInHint(response, data);
+                readLease(response, data);
                 console.log(`[License] Device registered. Total devices: ${data.device_count}`);
                 return true;
             } else {
@@ -132,19 +179,42 @@
 
     /**
      * Check License Status from Server
+     * Uses the lightweight status endpoint and sends the last ETag back,
+     * so an unchanged license costs the server a single lookup and an empty 304
      */
     const checkLicenseStatus = async () => {
         try {
-            const response = await fetch(`${API_BASE_URL}/licenses?search=${encodeURIComponent(LICENSE_KEY)}`, {
+            const headers = {};
+            if (statusEtag) {
+                headers['If-None-Match'] = statusEtag;
+            }
+
+            const statusUrl = `${API_BASE_URL}/licenses/${encodeURIComponent(LICENSE_KEY)}/status` +
+                (deviceFingerprint ? `?device=${encodeURIComponent(deviceFingerprint)}` : '');
+            const response = await fetch(statusUrl, {
                 method: 'GET',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
+                headers: headers,
                 mode: 'cors',
-                credentials: 'omit'
+                credentials: 'omit',
+                cache: 'no-store'
             });
 
-            // Handle 500 errors gracefully - server returns empty array on error
+            // Nothing changed since the last check
+            if (response.status === 304) {
+                readCheckInHint(response, null);
+                readLease(response, null);
+                return lastKnownActive;
+            }
+
+            if (response.status === 404) {
+                console.warn(`[License] License key "${LICENSE_KEY}" not found`);
+                statusEtag = null;
+                lastKnownActive = false;
+                lease = null;
+                return false; // License not found = inactive
+            }
+
+            // Handle 500 errors gracefully
             if (response.status === 500) {
                 console.warn(`[License] Server error (500). Server may be initializing. Keeping current state.`);
                 return isLicenseActive; // Keep current state on server error
@@ -157,44 +227,32 @@
                     const errorData = await response.json();
                     errorMsg = errorData.error || errorMsg;
                 } catch (e) {
-                    // Response is not JSON - that's okay, server returns empty array on error
+                    // Response is not JSON
                 }
                 console.warn(`[License] HTTP error (${response.status}): ${errorMsg}. Keeping current state.`);
                 return isLicenseActive; // Keep current state on error
             }
 
-            const licenses = await response.json();
+            const status = await response.json();
             
             // Check if response is an error object
-            if (licenses && licenses.error) {
-                console.warn(`[License] API error: ${licenses.error}. Keeping current state.`);
+            if (!status || status.error) {
+                console.warn(`[License] API error: ${status ? status.error : 'empty response'}. Keeping current state.`);
                 return isLicenseActive;
             }
-            
-            // Handle empty array (server returned empty on error - this is expected behavior)
-            if (!licenses || !Array.isArray(licenses) || licenses.length === 0) {
-                console.warn(`[License] No licenses found or server returned empty array. Keeping current state.`);
-                return isLicenseActive; // Keep current state
-            }
-            
-            const license = licenses.find(l => l.license_key === LICENSE_KEY);
-
-            if (!license) {
-                console.warn(`[License] License key "${LICENSE_KEY}" not found in response`);
-                return false; // License not found = inactive
-            }
 
-            // Check if license is blocked
-            const isBlocked = license.is_blocked === 1 || license.is_blocked === true;
-            const isActive = !isBlocked;
+            statusEtag = response.headers.get('ETag');
+            readCheckInHint(response, status);
+            readLease(response, status);
+            lastKnownActive = status.active === true;
             
-            if (isActive) {
+            if (lastKnownActive) {
                 console.log(`[License] ✓ License "${LICENSE_KEY}" is ACTIVE`);
             } else {
                 console.log(`[License] ✗ License "${LICENSE_KEY}" is BLOCKED`);
             }
             
-            return isActive; // Return true if active, false if blocked
+            return lastKnownActive; // Return true if active, false if blocked
 
         } catch (error) {
             console.warn('[License] Error checking license (network/server issue):', error.message);
@@ -206,6 +264,41 @@
         }
     };
 
+    /**
+     * Renew the lease. Also records the device heartbeat, so no separate register call is needed.
+     * Returns the license status, or null if the lease was rejected or the server is unreachable
+     * (the caller then falls back to a full status check).
+     */
+    const renewLease = async () => {
+        try {
+            const response = await fetch(`${API_BASE_URL}/leases/renew`, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({ lease: lease }),
+                mode: 'cors',
+                credentials: 'omit'
+            });
+
+            if (!response.ok) {
+                console.warn(`[License] Lease renewal failed (HTTP ${response.status}). Checking full status.`);
+                lease = null;
+                return null;
+            }
+
+            const data = await response.json();
+            readCheckInHint(response, data);
+            readLease(response, data);
+            lastKnownActive = data.active === true;
+            return lastKnownActive;
+        } catch (error) {
+            console.warn('[License] Error renewing lease:', error.message);
+            leaseRenewAt = Date.now() + CHECK_INTERVAL; // Retry later instead of at the minimum interval
+            return null;
+        }
+    };
+
     /**
      * Start Your Script
      */
@@ -244,33 +337,149 @@
         }
     };
 
+    /**
+     * Apply a license status to the running script
+     */
+    const applyLicenseStatus = async (active, registered = false) => {
+        if (active && !isLicenseActive) {
+            // License became active - register device
+            isLicenseActive = true;
+            if (!registered) {
+                await registerDevice(); // Register device when license becomes active
+            }
+            startScript();
+        } else if (!active && isLicenseActive) {
+            // License became blocked
+            isLicenseActive = false;
+            stopScript();
+        } else if (active && isLicenseActive && !registered) {
+            // License is still active - update device last_seen (don't block on error)
+            registerDevice().catch(err => {
+                console.warn('[License] Device registration update failed (non-critical):', err);
+            });
+        }
+        // If status didn't change, do nothing
+    };
+
     /**
      * Main License Check and Control Function
      */
     const updateLicenseStatus = async () => {
         try {
-            const active = await checkLicenseStatus();
-            
-            if (active && !isLicenseActive) {
-                // License became active - register device
-                isLicenseActive = true;
-                await registerDevice(); // Register device when license becomes active
-                startScript();
-            } else if (!active && isLicenseActive) {
-                // License became blocked
-                isLicenseActive = false;
-                stopScript();
-            } else if (active && isLicenseActive) {
-                // License is still active - update device last_seen (don't block on error)
-                registerDevice().catch(err => {
-                    console.warn('[License] Device registration update failed (non-critical):', err);
-                });
+            // While a lease is held, renewing it is the whole check
+            const renewed = lease ? await renewLease() : null;
+            if (renewed !== null) {
+                await applyLicenseStatus(renewed, true);
+            } else {
+                const active = await checkLicenseStatus();
+                await applyLicenseStatus(active);
             }
-            // If status didn't change, do nothing
         } catch (error) {
             console.error('[License] Error in updateLicenseStatus:', error);
             // Don't change state on unexpected errors
         }
+        scheduleNextCheck();
+    };
+
+    /**
+     * Schedule the next check, replacing any pending one.
+     * With a lease, that is shortly before the lease expires. Otherwise it
+     * follows the server's next_check_in hint so it can slow clients down under load;
+     * without a hint, CHECK_INTERVAL with some jitter so clients don't poll in lockstep.
+     */
+    const scheduleNextCheck = () => {
+        clearTimeout(checkTimeout);
+        let delay;
+        if (lease) {
+            delay = leaseRenewAt - Date.now(); // Nothing to ask the server until the lease runs low
+        } else if (streamConnected) {
+            delay = STREAM_CHECK_INTERVAL;
+        } else if (serverCheckIn) {
+            delay = serverCheckIn * 1000;
+        } else {
+            delay = CHECK_INTERVAL * (0.8 + Math.random() * 0.4);
+        }
+        delay = Math.min(Math.max(delay, MIN_CHECK_INTERVAL), MAX_CHECK_INTERVAL);
+        checkTimeout = setTimeout(updateLicenseStatus, delay);
+    };
+
+    /**
+     * Check now unless a lease still covers the current state
+     */
+    const checkIfDue = () => {
+        if (!lease || Date.now() >= leaseRenewAt) {
+            updateLicenseStatus();
+        }
+    };
+
+    /**
+     * Subscribe to status changes pushed by the server.
+     * While connected, a block takes effect immediately and polling slows down;
+     * if the stream drops we poll at the server's suggested interval until it is back.
+     */
+    const connectEventStream = () => {
+        if (typeof EventSource === 'undefined' || eventSource || streamRetryTimeout ||
+                streamRefusals >= STREAM_MAX_REFUSALS) {
+            return;
+        }
+
+        eventSource = new EventSource(`${API_BASE_URL}/licenses/${encodeURIComponent(LICENSE_KEY)}/events`);
+
+        eventSource.onopen = () => {
+            streamConnected = true;
+            streamRefusals = 0;
+            scheduleNextCheck();
+            console.log('[License] Event stream connected');
+        };
+
+        eventSource.addEventListener('status', (event) => {
+            let status;
+            try {
+                status = JSON.parse(event.data);
+            } catch (e) {
+                return;
+            }
+
+            if (typeof status.active === 'boolean') {
+                statusEtag = null; // Next poll fetches the full status again
+                lease = null; // The pushed status supersedes the lease
+                lastKnownActive = status.active;
+                applyLicenseStatus(status.active).catch(err => {
+                    console.warn('[License] Error applying pushed status:', err);
+                });
+            } else {
+                // License was edited - re-check the full status
+                updateLicenseStatus();
+            }
+        });
+
+        eventSource.onerror = () => {
+            if (streamConnected) {
+                console.warn('[License] Event stream dropped. Falling back to polling.');
+            }
+            const wasConnected = streamConnected;
+            streamConnected = false;
+            if (wasConnected) {
+                scheduleNextCheck();
+            }
+
+            if (eventSource.readyState === EventSource.CLOSED) {
+                // Server refused the stream (busy or license not found). Leases/polling carry
+                // on meanwhile; back off rather than add load to a server that is full
+                eventSource = null;
+                streamRefusals++;
+                if (streamRefusals >= STREAM_MAX_REFUSALS) {
+                    console.warn('[License] Event stream unavailable. Using lease renewal/polling only.');
+                    return;
+                }
+                const delay = STREAM_RETRY_DELAY * Math.pow(2, streamRefusals - 1) * (1 + Math.random() * 0.5);
+                streamRetryTimeout = setTimeout(() => {
+                    streamRetryTimeout = null;
+                    connectEventStream();
+                }, delay);
+            }
+            // Otherwise the browser reconnects on its own
+        };
     };
 
     /**
@@ -284,37 +493,40 @@
         deviceFingerprint = generateDeviceFingerprint();
         console.log(`[License] Device fingerprint: ${deviceFingerprint}`);
         
-        // Initial license check (will register device if active)
+        // Initial license check (will register device if active); each check schedules the next
         updateLicenseStatus();
 
-        // Set up periodic checking
-        checkInterval = setInterval(() => {
-            updateLicenseStatus();
-        }, CHECK_INTERVAL);
+        // Switch to push updates when the stream connects
+        connectEventStream();
 
         // Check when page becomes visible (user switches tabs back)
         document.addEventListener('visibilitychange', () => {
             if (!document.hidden) {
-                updateLicenseStatus();
+                checkIfDue();
+                connectEventStream();
             }
         });
 
         // Check when window gains focus
         window.addEventListener('focus', () => {
-            updateLicenseStatus();
+            checkIfDue();
         });
 
-        console.log(`[License] License validator initialized. Checking every ${CHECK_INTERVAL/1000} seconds.`);
+        console.log('[License] License validator initialized. Checking at the server-suggested interval until the event stream connects.');
     };
 
     /**
      * Cleanup on page unload
      */
     const cleanup = () => {
-        if (checkInterval) {
-            clearInterval(checkInterval);
-            checkInterval = null;
+        clearTimeout(checkTimeout);
+        checkTimeout = null;
+        if (eventSource) {
+            eventSource.close();
+            eventSource = null;
         }
+        clearTimeout(streamRetryTimeout);
+        streamRetryTimeout = null;
         stopScript();
     };
 
@@ -1,18 +1,41 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, g, has_app_context, has_request_context
 from flask_cors import CORS
-from datetime import datetime
+import click
+from datetime import datetime, timedelta
 import sqlite3
 import secrets
 import os
 import string
 import random
+import hashlib
+import hmac
+import json
+import base64
+import threading
+import time
+import atexit
+import queue
+import csv
+import io
+import gzip
+import zlib
+import re
+import math
+import tempfile
+import glob
+import fcntl
+import logging
+import logging.handlers
+import sys
+from collections import OrderedDict
 
 app = Flask(__name__, static_folder='frontend', static_url_path='')
 app.secret_key = secrets.token_hex(32)  # For session management
 CORS(app, 
      supports_credentials=True,
      resources={r"/api/*": {"origins": "*"}},
-     allow_headers=["Content-Type", "Authorization"],
+     allow_headers=["Content-Type", "Authorization", "If-None-Match", "X-Request-ID"],
+     expose_headers=["ETag", "X-Next-Check-In", "X-License-Lease", "X-Request-ID"],
      methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"])
 
 # Add CORS headers to all responses
@@ -20,22 +43,672 @@ CORS(app,
 def after_request(response):
     response.headers.add('Access-Control-Allow-Origin', '*')
     response.headers.add('Access-Control-Allow-Methods', 'GET, POST, PUT, DELETE, OPTIONS')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type, Authorization')
+    response.headers.add('Access-Control-Allow-Headers', 'Content-Type, Authorization, If-None-Match, X-Request-ID')
+    response.headers.add('Access-Control-Expose-Headers', 'ETag, X-Next-Check-In, X-License-Lease, X-Request-ID')
     return response
 
-# Database setup - use absolute path for Render.com deployment
-DATABASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'licenses.db')
+# Logging - request paths and background threads only put records on a bounded queue;
+# one listener thread per worker formats them (tracebacks included) and writes them to
+# stdout, so a burst of errors never blocks a request on a slow stream. Each call site
+# passes at most LOG_RATE_BURST records per LOG_RATE_WINDOW seconds (the next one that
+# gets through reports how many were suppressed), and a full queue drops records.
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json').lower()  # json, or text for local runs
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+LOG_RATE_WINDOW = float(os.environ.get('LOG_RATE_WINDOW', 10))
+LOG_RATE_BURST = int(os.environ.get('LOG_RATE_BURST', 5))  # 0 turns rate limiting off
 
-def init_db():
-    """Initialize the database with licenses table"""
-    try:
-        # Ensure directory exists
-        db_dir = os.path.dirname(DATABASE)
-        if db_dir and not os.path.exists(db_dir):
-            os.makedirs(db_dir, exist_ok=True)
+log = logging.getLogger('license_server')
+
+class LogRateLimiter(logging.Filter):
+    """Lets through `burst` records per call site and message template per window"""
+    
+    def __init__(self, window, burst):
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._sites = {}  # (pathname, lineno, msg) -> [window start, passed, suppressed]
+    
+    def filter(self, record):
+        if self.burst <= 0:
+            return True
+        key = (record.pathname, record.lineno, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None or now - site[0] >= self.window:
+                if site is not None and site[2]:
+                    record.suppressed = site[2]
+                elif len(self._sites) >= 10000:
+                    self._sites.clear()
+                site = self._sites[key] = [now, 0, 0]
+            if site[1] >= self.burst:
+                site[2] += 1
+                suppressed = True
+            else:
+                site[1] += 1
+                suppressed = False
+        if suppressed:
+            metrics.inc('license_log_records_suppressed_total')
+        return not suppressed
+
+class LogContextFilter(logging.Filter):
+    """Tags records logged while handling a request with its ID, route and elapsed time"""
+    
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = g.get('request_id')
+            record.method = request.method
+            record.route = request.url_rule.rule if request.url_rule else request.path
+            started = g.get('request_started')
+            if started is not None:
+                record.elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+        return True
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records when the queue is full instead of blocking or raising"""
+    
+    def prepare(self, record):
+        # Only merge the arguments now (they may change later); formatting the record and
+        # its traceback is left to the listener thread
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+    
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.inc('license_log_records_dropped_total')
+
+class JsonLogFormatter(logging.Formatter):
+    """One JSON object per line"""
+    
+    CONTEXT = ('request_id', 'method', 'route', 'elapsed_ms', 'suppressed')
+    
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'msg': record.getMessage(),
+            'pid': record.process,
+        }
+        for name in self.CONTEXT:
+            value = getattr(record, name, None)
+            if value is not None:
+                entry[name] = value
+        entry.update(getattr(record, 'fields', None) or {})  # log.info(..., extra={'fields': {...}})
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class TextLogFormatter(logging.Formatter):
+    """Plain lines for running the server in a terminal"""
+    
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(message)s')
+    
+    def formatMessage(self, record):
+        line = super().formatMessage(record)
+        if getattr(record, 'request_id', None):
+            line += f' [{record.method} {record.route} {record.request_id}]'
+        if getattr(record, 'fields', None):
+            line += ' ' + json.dumps(record.fields, default=str)
+        if getattr(record, 'suppressed', None):
+            line += f' ({record.suppressed} similar suppressed)'
+        return line
+
+class LogPipeline:
+    """The queue and listener thread of this worker process"""
+    
+    def __init__(self, handler):
+        self.handler = handler
+        self._listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+    
+    def ensure_started(self):
+        # Threads do not survive a fork: each worker starts its own listener, on a fresh
+        # queue so it does not write out records its parent still had queued
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self.handler.queue = queue.Queue(LOG_QUEUE_SIZE)
+            stream = logging.StreamHandler(sys.stdout)
+            stream.setFormatter(JsonLogFormatter() if LOG_FORMAT == 'json' else TextLogFormatter())
+            self._listener = logging.handlers.QueueListener(self.handler.queue, stream)
+            self._listener.start()
+            self._pid = os.getpid()
+    
+    def stop(self):
+        """Write out the queued records (at exit); safe to call more than once"""
+        with self._lock:
+            if self._listener is None or self._pid != os.getpid():
+                return
+            listener, self._listener, self._pid = self._listener, None, None
+        listener.stop()
+
+_log_handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+_log_handler.addFilter(LogRateLimiter(LOG_RATE_WINDOW, LOG_RATE_BURST))
+_log_handler.addFilter(LogContextFilter())
+log.addHandler(_log_handler)
+log.setLevel(LOG_LEVEL)
+log.propagate = False
+log_pipeline = LogPipeline(_log_handler)
+log_pipeline.ensure_started()
+atexit.register(log_pipeline.stop)
+
+_REQUEST_ID_RE = re.compile(r'[\w.-]{1,64}')
+
+@app.before_request
+def assign_request_id():
+    # Keep a caller's (e.g. a proxy's) request ID if it looks sane
+    request_id = request.headers.get('X-Request-ID', '')
+    g.request_id = request_id if _REQUEST_ID_RE.fullmatch(request_id) else secrets.token_hex(8)
+    log_pipeline.ensure_started()
+
+@app.after_request
+def send_request_id(response):
+    request_id = g.get('request_id')
+    if request_id:
+        response.headers['X-Request-ID'] = request_id
+    return response
+
+# Metrics - each worker process keeps its own counters and histograms in memory and
+# writes them to METRICS_DIR; /metrics sums the files of every worker
+METRICS_DIR = os.environ.get('METRICS_DIR') or os.path.join(tempfile.gettempdir(), 'license-server-metrics')
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRIC_HELP = {
+    'license_http_requests_total': ('counter', 'HTTP requests by route, method and status'),
+    'license_http_request_duration_seconds': ('histogram', 'HTTP request latency by route and method'),
+    'license_http_requests_in_flight': ('gauge', 'HTTP requests currently being handled'),
+    'license_db_connections_opened_total': ('counter', 'SQLite connections opened'),
+    'license_db_connection_open_seconds': ('histogram', 'Time to open a SQLite connection and apply its pragmas'),
+    'license_db_statement_duration_seconds': ('histogram', 'SQLite statement execution time by statement kind and table'),
+    'license_db_locked_errors_total': ('counter', 'Statements that failed with "database is locked" after the busy timeout'),
+    'license_cache_hits_total': ('counter', 'License status cache hits'),
+    'license_cache_misses_total': ('counter', 'License status cache misses'),
+    'license_cache_hit_ratio': ('gauge', 'License status cache hit ratio across all workers'),
+    'license_cache_entries': ('gauge', 'License status cache entries'),
+    'license_event_streams': ('gauge', 'Open license event streams'),
+    'license_log_records_suppressed_total': ('counter', 'Log records dropped by the per-call-site rate limit'),
+    'license_log_records_dropped_total': ('counter', 'Log records dropped because the log queue was full'),
+}
+
+class Metrics:
+    """Per-process Prometheus counters, gauges and histograms, aggregated across workers through METRICS_DIR"""
+    
+    def __init__(self, directory, flush_interval):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._counters = {}  # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [per-bucket counts..., +Inf count, sum]
+        self._gauges = {}  # (name, labels) -> value
+        self._collectors = []  # Callables returning (name, labels, value) samples at snapshot time
+        self._flusher = None
+        self._flusher_pid = None
+    
+    def inc(self, name, labels=(), value=1):
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+    
+    def add(self, name, labels=(), delta=1):
+        """Move a gauge up or down"""
+        key = (name, labels)
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0) + delta
+    
+    def observe(self, name, labels, seconds):
+        key = (name, labels)
+        with self._lock:
+            buckets = self._histograms.get(key)
+            if buckets is None:
+                buckets = self._histograms[key] = [0] * (len(LATENCY_BUCKETS) + 2)
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    break
+            else:
+                index = len(LATENCY_BUCKETS)
+            buckets[index] += 1
+            buckets[-1] += seconds
+    
+    def add_collector(self, collector):
+        """Register a callable returning (name, labels, value) samples read at flush time"""
+        self._collectors.append(collector)
+    
+    def snapshot(self):
+        with self._lock:
+            counters = [[name, list(labels), value] for (name, labels), value in self._counters.items()]
+            histograms = [[name, list(labels), list(buckets)] for (name, labels), buckets in self._histograms.items()]
+            samples = [[name, list(labels), value] for (name, labels), value in self._gauges.items()]
+        for collector in self._collectors:
+            try:
+                samples.extend([name, list(labels), value] for name, labels, value in collector())
+            except Exception as e:
+                log.warning('Metrics collector failed: %s', e)
+        return {'pid': os.getpid(), 'counters': counters, 'histograms': histograms, 'samples': samples}
+    
+    def flush(self):
+        """Write this worker's snapshot to METRICS_DIR (atomically, so readers never see half a file)"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'metrics-{os.getpid()}.json')
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+    
+    def flush_at_exit(self):
+        """Final flush of a worker that recorded metrics, so its last counts are not lost"""
+        if self._flusher_pid != os.getpid():
+            return
+        try:
+            self.flush()
+        except Exception as e:
+            log.warning('Metrics flush failed: %s', e)
+    
+    def clear(self):
+        """Remove the files of a previous run; call once at startup, before any worker flushes"""
+        for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    
+    def ensure_flusher(self):
+        # Started lazily in each worker process; threads do not survive a fork
+        if self._flusher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher = threading.Thread(target=self._run, name='metrics-flusher', daemon=True)
+            self._flusher.start()
+            self._flusher_pid = os.getpid()
+    
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                log.warning('Metrics flush failed: %s', e)
+    
+    def fold_exited(self):
+        """Merge the files of workers that have exited into a single metrics-exited.json"""
+        exited_path = os.path.join(self.directory, 'metrics-exited.json')
+        with open(os.path.join(self.directory, '.lock'), 'a') as lock_file:
+            # Another worker may be folding the same files
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                with open(exited_path) as f:
+                    exited = json.load(f)
+            except (OSError, ValueError):
+                exited = {'pid': None, 'counters': [], 'histograms': [], 'samples': []}
+            counters = {(name, tuple(map(tuple, labels))): value for name, labels, value in exited['counters']}
+            histograms = {(name, tuple(map(tuple, labels))): buckets for name, labels, buckets in exited['histograms']}
+            
+            folded = []
+            for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+                match = re.fullmatch(r'metrics-(\d+)\.json', os.path.basename(path))
+                if not match or _pid_alive(int(match.group(1))):
+                    continue
+                try:
+                    with open(path) as f:
+                        snapshot = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                for name, labels, value in snapshot['counters'] + [
+                    sample for sample in snapshot['samples'] if METRIC_HELP.get(sample[0], ('gauge',))[0] == 'counter'
+                ]:
+                    key = (name, tuple(map(tuple, labels)))
+                    counters[key] = counters.get(key, 0) + value
+                for name, labels, buckets in snapshot['histograms']:
+                    key = (name, tuple(map(tuple, labels)))
+                    total = histograms.setdefault(key, [0] * len(buckets))
+                    for index, value in enumerate(buckets):
+                        total[index] += value
+                folded.append(path)
+            if not folded:
+                return 0
+            
+            exited = {
+                'pid': None,
+                'counters': [[name, list(labels), value] for (name, labels), value in counters.items()],
+                'histograms': [[name, list(labels), buckets] for (name, labels), buckets in histograms.items()],
+                'samples': [],
+            }
+            with open(exited_path + '.tmp', 'w') as f:
+                json.dump(exited, f)
+            os.replace(exited_path + '.tmp', exited_path)
+            for path in folded:
+                os.remove(path)
+            return len(folded)
+    
+    def collect(self):
+        """Sum every worker's snapshot and render the Prometheus text format"""
+        self.flush()
+        try:
+            self.fold_exited()
+        except OSError as e:
+            log.warning('Folding metrics of exited workers failed: %s', e)
+        counters, histograms, gauges = {}, {}, {}
+        for filename in os.listdir(self.directory):
+            if not (filename.startswith('metrics-') and filename.endswith('.json')):
+                continue
+            try:
+                with open(os.path.join(self.directory, filename)) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, buckets in snapshot['histograms']:
+                key = (name, tuple(map(tuple, labels)))
+                total = histograms.setdefault(key, [0] * len(buckets))
+                for index, value in enumerate(buckets):
+                    total[index] += value
+            # Counters of exited workers still count; their gauges do not
+            alive = snapshot['pid'] is not None and _pid_alive(snapshot['pid'])
+            for name, labels, value in snapshot['samples']:
+                key = (name, tuple(map(tuple, labels)))
+                if METRIC_HELP.get(name, ('gauge',))[0] == 'counter':
+                    counters[key] = counters.get(key, 0) + value
+                elif alive:
+                    gauges[key] = gauges.get(key, 0) + value
         
-        conn = sqlite3.connect(DATABASE, timeout=10.0)
-        cursor = conn.cursor()
+        hits = counters.get(('license_cache_hits_total', ()), 0)
+        misses = counters.get(('license_cache_misses_total', ()), 0)
+        if hits + misses:
+            gauges[('license_cache_hit_ratio', ())] = hits / (hits + misses)
+        
+        lines = []
+        for name in sorted({key[0] for key in counters} | {key[0] for key in histograms} | {key[0] for key in gauges}):
+            kind, help_text = METRIC_HELP.get(name, ('untyped', name))
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for values in (counters, gauges):
+                for (metric, labels), value in sorted(values.items()):
+                    if metric == name:
+                        lines.append(f'{name}{_format_labels(labels)} {value}')
+            for (metric, labels), buckets in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), buckets[:-1]):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_format_labels(labels + (("le", str(bound)),))} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {buckets[-1]}')
+                lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+metrics = Metrics(METRICS_DIR, METRICS_FLUSH_INTERVAL)
+atexit.register(metrics.flush_at_exit)
+
+class LoadMonitor:
+    """This worker's current load: in-flight requests and a decaying average of write-lock waits"""
+    
+    def __init__(self, decay_seconds=10.0):
+        self.decay_seconds = decay_seconds
+        self._lock = threading.Lock()
+        self._lock_wait = 0.0
+        self._updated = time.monotonic()
+        self.in_flight = 0
+    
+    def _decayed(self, now):
+        return self._lock_wait * math.exp(-(now - self._updated) / self.decay_seconds)
+    
+    def record_lock_wait(self, seconds):
+        now = time.monotonic()
+        with self._lock:
+            self._lock_wait = self._decayed(now) * 0.9 + seconds * 0.1
+            self._updated = now
+    
+    def lock_wait(self):
+        with self._lock:
+            return self._decayed(time.monotonic())
+    
+    def pressure(self):
+        """0 when idle, 1 when either signal reaches its 'busy' level"""
+        return max(self.in_flight / CHECK_IN_BUSY_REQUESTS, self.lock_wait() / CHECK_IN_BUSY_LOCK_WAIT)
+
+load_monitor = LoadMonitor()
+
+# Statement labels are "<VERB> <table>" so the statement histogram stays low-cardinality
+_STATEMENT_TABLE_RE = re.compile(r'\b(?:FROM|INTO|UPDATE|TABLE)\s+(\w+)', re.IGNORECASE)
+_statement_labels = {}
+
+def statement_label(sql):
+    label = _statement_labels.get(sql)
+    if label is None:
+        words = sql.split()
+        verb = words[0].upper() if words else ''
+        if verb in ('BEGIN', 'PRAGMA'):
+            label = ' '.join(words[:2]).upper()
+        else:
+            match = _STATEMENT_TABLE_RE.search(sql)
+            label = f'{verb} {match.group(1)}' if match else verb
+        if len(_statement_labels) < 10000:
+            _statement_labels[sql] = label
+    return label
+
+def _record_statement(sql, started, error=None):
+    elapsed = time.perf_counter() - started
+    name = statement_label(sql)
+    label = (('statement', name),)
+    metrics.observe('license_db_statement_duration_seconds', label, elapsed)
+    if name == 'BEGIN IMMEDIATE':
+        load_monitor.record_lock_wait(elapsed)  # BEGIN IMMEDIATE returns once it holds the write lock
+    if error is not None and 'locked' in str(error):
+        metrics.inc('license_db_locked_errors_total', label)
+    if SQL_PROFILE and has_app_context():
+        profile = g.get('sql_profile')
+        if profile is not None:
+            profile.record(sql, elapsed)
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that records statement execution time"""
+    
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            result = super().execute(sql, parameters)
+        except sqlite3.OperationalError as e:
+            _record_statement(sql, started, e)
+            raise
+        _record_statement(sql, started)
+        return result
+    
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            result = super().executemany(sql, seq_of_parameters)
+        except sqlite3.OperationalError as e:
+            _record_statement(sql, started, e)
+            raise
+        _record_statement(sql, started)
+        return result
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection that records statement and commit execution time"""
+    
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+    
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+    
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+    
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            super().commit()
+        except sqlite3.OperationalError as e:
+            _record_statement('COMMIT', started, e)
+            raise
+        _record_statement('COMMIT', started)
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    metrics.ensure_flusher()
+    maintenance_scheduler.ensure_started()
+    metrics.add('license_http_requests_in_flight')
+    with load_monitor._lock:
+        load_monitor.in_flight += 1
+    if SQL_PROFILE == 'all' or (SQL_PROFILE == 'header' and request.headers.get('X-SQL-Profile') == '1'):
+        g.sql_profile = SqlProfile()
+
+@app.teardown_request
+def finish_request_metrics(exception):
+    metrics.add('license_http_requests_in_flight', delta=-1)
+    with load_monitor._lock:
+        load_monitor.in_flight -= 1
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.inc('license_http_requests_total', (
+            ('route', route), ('method', request.method), ('status', str(response.status_code))
+        ))
+        metrics.observe('license_http_request_duration_seconds', (
+            ('route', route), ('method', request.method)
+        ), time.perf_counter() - started)
+    return response
+
+# SQL profiling - opt-in per-request statement tracing for development and review.
+# SQL_PROFILE=all profiles every request, SQL_PROFILE=header only requests sent with
+# "X-SQL-Profile: 1". Profiled responses carry an X-SQL-Profile summary header, and
+# slow or repetitive requests are logged (sampled).
+SQL_PROFILE = os.environ.get('SQL_PROFILE', '').lower()
+if SQL_PROFILE in ('1', 'true', 'yes'):
+    SQL_PROFILE = 'all'
+SQL_PROFILE_REPEAT = int(os.environ.get('SQL_PROFILE_REPEAT', 5))  # Same statement this often in one request is flagged
+SQL_PROFILE_SLOW_MS = float(os.environ.get('SQL_PROFILE_SLOW_MS', 250))
+SQL_PROFILE_LOG_SAMPLE = float(os.environ.get('SQL_PROFILE_LOG_SAMPLE', 0.1))  # Share of slow/repetitive requests logged
+
+class SqlProfile:
+    """Statements, timings and commits of one request.
+    
+    Queries are the execute()/executemany() calls made by our code, timed by the
+    instrumented cursor. Statements are what SQLite actually ran, reported by its trace
+    callback: every executemany row, implicit BEGINs, COMMITs and trigger bodies.
+    """
+    
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.statements = 0
+        self.commits = 0
+        self.triggers = 0
+        self.db_time = 0.0
+        self.shapes = {}  # normalized SQL -> [count, seconds]
+        self._last_statement = None
+    
+    def trace(self, statement):
+        self.statements += 1
+        # SQLite reports a trigger run as "-- TRIGGER name". Python 3.11+ expands that to the
+        # SQL of the statement that fired it, so there it shows up as that statement again.
+        if statement.startswith('-- TRIGGER ') or statement == self._last_statement:
+            self.triggers += 1
+            return
+        self._last_statement = statement
+        if statement[:6].upper() == 'COMMIT':
+            self.commits += 1
+    
+    def record(self, sql, elapsed):
+        self._last_statement = None  # The next execute() may legitimately repeat this statement
+        self.queries += 1
+        self.db_time += elapsed
+        shape = self.shapes.setdefault(' '.join(sql.split()), [0, 0.0])
+        shape[0] += 1
+        shape[1] += elapsed
+    
+    def repeated(self):
+        """(shape, count) for statements run at least SQL_PROFILE_REPEAT times, most frequent first"""
+        return sorted(
+            ((shape, count) for shape, (count, _) in self.shapes.items()
+             if count >= SQL_PROFILE_REPEAT and shape not in ('COMMIT', 'BEGIN IMMEDIATE')),
+            key=lambda item: -item[1]
+        )
+    
+    def summary(self):
+        return {
+            'queries': self.queries,
+            'statements': self.statements,
+            'commits': self.commits,
+            'triggers': self.triggers,
+            'db_ms': round(self.db_time * 1000, 2),
+            'total_ms': round((time.perf_counter() - self.started) * 1000, 2),
+            'repeated': len(self.repeated()),
+        }
+
+def _header_safe(text, limit=200):
+    return text[:limit].encode('ascii', 'replace').decode('ascii')
+
+@app.after_request
+def report_sql_profile(response):
+    profile = g.get('sql_profile')
+    if profile is None:
+        return response
+    summary = profile.summary()
+    response.headers['X-SQL-Profile'] = '; '.join(f'{name}={value}' for name, value in summary.items())
+    repeated = profile.repeated()
+    if repeated:
+        shape, count = repeated[0]
+        response.headers['X-SQL-Profile-Repeated'] = _header_safe(f'{count}x {shape}')
+    if (summary['total_ms'] >= SQL_PROFILE_SLOW_MS or repeated) and random.random() < SQL_PROFILE_LOG_SAMPLE:
+        slowest = sorted(profile.shapes.items(), key=lambda item: -item[1][1])[:5]
+        log.info('SQL profile', extra={'fields': dict(
+            summary,
+            status=response.status_code,
+            repeated_statements=[{'sql': shape[:200], 'count': count} for shape, count in repeated[:5]],
+            slowest_statements=[
+                {'sql': shape[:200], 'count': count, 'ms': round(seconds * 1000, 2)}
+                for shape, (count, seconds) in slowest
+            ],
+        )})
+    return response
+
+# Database setup - use absolute path for Render.com deployment (DATABASE_PATH overrides it)
+DATABASE = os.environ.get('DATABASE_PATH') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'licenses.db')
+
+# SQLite tuning, applied once to every pooled connection
+DB_TIMEOUT = 10.0
+DB_CACHE_SIZE_KB = int(os.environ.get('DB_CACHE_SIZE_KB', 16384))
+DB_MMAP_SIZE = int(os.environ.get('DB_MMAP_SIZE', 64 * 1024 * 1024))
+
+# One connection per worker thread, opened on first use and reused across requests
+_db_pool = threading.local()
+_db_state = {'initialized': False, 'fts': False}
+
+def _migration_base_tables(cursor):
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS licenses (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -58,92 +731,1255 @@ def init_db():
             UNIQUE(license_key, device_fingerprint)
         )
     ''')
-    # Add is_blocked column to existing tables if it doesn't exist
-    try:
-        cursor.execute('ALTER TABLE licenses ADD COLUMN is_blocked INTEGER DEFAULT 0')
-    except sqlite3.OperationalError:
-        pass  # Column already exists
-    conn.commit()
-    conn.close()
+    # Databases created before is_blocked existed
+    columns = [row[1] for row in cursor.execute('PRAGMA table_info(licenses)')]
+    if 'is_blocked' not in columns:
+        cursor.execute('ALTER TABLE licenses ADD COLUMN is_blocked INTEGER DEFAULT 0')
+
+def _migration_device_foreign_key(cursor):
+    # SQLite cannot add a constraint in place, so rebuild the table.
+    # Rows orphaned by earlier license deletes are dropped on the way.
+    cursor.execute('''
+        CREATE TABLE device_registrations_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            license_key TEXT NOT NULL
+                REFERENCES licenses(license_key) ON DELETE CASCADE ON UPDATE CASCADE,
+            device_fingerprint TEXT NOT NULL,
+            registered_at TEXT NOT NULL,
+            last_seen TEXT NOT NULL,
+            UNIQUE(license_key, device_fingerprint)
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO device_registrations_new (id, license_key, device_fingerprint, registered_at, last_seen)
+        SELECT id, license_key, device_fingerprint, registered_at, last_seen
+        FROM device_registrations
+        WHERE license_key IN (SELECT license_key FROM licenses)
+    ''')
+    cursor.execute('DROP TABLE device_registrations')
+    cursor.execute('ALTER TABLE device_registrations_new RENAME TO device_registrations')
+
+def _migration_lookup_indexes(cursor):
+    # Covers get_license_devices() entirely from the index
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_device_registrations_license_last_seen
+        ON device_registrations (license_key, last_seen DESC, device_fingerprint, registered_at)
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_licenses_created_at ON licenses (created_at, id)')
+
+def _migration_license_search_index(cursor):
+    # Trigram FTS5 shadow table over licenses, kept in sync by triggers.
+    # Builds without FTS5/trigram support (SQLite < 3.34) skip it and search falls back to LIKE.
+    try:
+        cursor.execute('''
+            CREATE VIRTUAL TABLE licenses_fts USING fts5(
+                username, license_key,
+                content='licenses', content_rowid='id', tokenize='trigram'
+            )
+        ''')
+    except sqlite3.OperationalError as e:
+        log.warning('License search index not available, using LIKE search: %s', e)
+        return
+    cursor.execute('''
+        CREATE TRIGGER licenses_fts_insert AFTER INSERT ON licenses BEGIN
+            INSERT INTO licenses_fts (rowid, username, license_key)
+            VALUES (new.id, new.username, new.license_key);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER licenses_fts_delete AFTER DELETE ON licenses BEGIN
+            INSERT INTO licenses_fts (licenses_fts, rowid, username, license_key)
+            VALUES ('delete', old.id, old.username, old.license_key);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER licenses_fts_update AFTER UPDATE OF username, license_key ON licenses BEGIN
+            INSERT INTO licenses_fts (licenses_fts, rowid, username, license_key)
+            VALUES ('delete', old.id, old.username, old.license_key);
+            INSERT INTO licenses_fts (rowid, username, license_key)
+            VALUES (new.id, new.username, new.license_key);
+        END
+    ''')
+    cursor.execute("INSERT INTO licenses_fts (licenses_fts) VALUES ('rebuild')")
+
+def _migration_device_count_triggers(cursor):
+    # UNIQUE(license_key, device_fingerprint) makes every row a distinct device,
+    # so the count moves by exactly one per inserted or deleted row
+    cursor.execute('''
+        CREATE TRIGGER device_registrations_count_insert AFTER INSERT ON device_registrations BEGIN
+            UPDATE licenses SET devices = COALESCE(devices, 0) + 1 WHERE license_key = new.license_key;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER device_registrations_count_delete AFTER DELETE ON device_registrations BEGIN
+            UPDATE licenses SET devices = MAX(COALESCE(devices, 0) - 1, 0) WHERE license_key = old.license_key;
+        END
+    ''')
+    # Start from exact counts
+    cursor.execute('''
+        UPDATE licenses SET devices = (
+            SELECT COUNT(*) FROM device_registrations
+            WHERE device_registrations.license_key = licenses.license_key
+        )
+    ''')
+
+def _migration_change_versions(cursor):
+    # Counters bumped inside write transactions, read by every worker to notice
+    # changes made by the others (e.g. to invalidate the license status cache)
+    cursor.execute('''
+        CREATE TABLE change_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute("INSERT INTO change_versions (name, version) VALUES ('license_status', 0)")
+
+def _migration_table_change_versions(cursor):
+    # Triggers bump a per-table version on every write, whatever code path makes it.
+    # The list endpoints build their ETags from these.
+    for table in ('licenses', 'device_registrations'):
+        cursor.execute('INSERT INTO change_versions (name, version) VALUES (?, 0)', (table,))
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            cursor.execute(f'''
+                CREATE TRIGGER {table}_version_{event.lower()} AFTER {event} ON {table} BEGIN
+                    UPDATE change_versions SET version = version + 1 WHERE name = '{table}';
+                END
+            ''')
+
+def _migration_license_events(cursor):
+    # Status changes for the SSE channel; every worker tails this table
+    cursor.execute('''
+        CREATE TABLE license_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            license_key TEXT NOT NULL,
+            event TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )
+    ''')
+
+def _migration_key_allocator(cursor):
+    # Counter into a keyed permutation of the license keyspace; the permutation key is
+    # generated once per database so every worker draws from the same sequence
+    cursor.execute('''
+        CREATE TABLE app_secrets (
+            name TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    ''')
+    cursor.execute(
+        "INSERT INTO app_secrets (name, value) VALUES ('license_key_permutation', ?)",
+        (secrets.token_hex(32),)
+    )
+    cursor.execute('''
+        CREATE TABLE key_allocator (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            next_index INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('INSERT INTO key_allocator (id, next_index) VALUES (1, 0)')
+
+def _migration_device_retention(cursor):
+    # NULL retention_days means DEVICE_RETENTION_DAYS, 0 keeps a license's devices forever
+    cursor.execute('ALTER TABLE licenses ADD COLUMN retention_days INTEGER')
+    # Pruning walks devices oldest-first by last_seen
+    cursor.execute('CREATE INDEX idx_device_registrations_last_seen ON device_registrations (last_seen)')
+    cursor.execute('''
+        CREATE TABLE device_registrations_archive (
+            id INTEGER PRIMARY KEY,
+            license_key TEXT NOT NULL,
+            device_fingerprint TEXT NOT NULL,
+            registered_at TEXT NOT NULL,
+            last_seen TEXT NOT NULL,
+            archived_at TEXT NOT NULL
+        )
+    ''')
+    # Lets one worker at a time run a maintenance job
+    cursor.execute('''
+        CREATE TABLE maintenance_leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    ''')
+
+ACTIVITY_BUCKET_SECONDS = 3600  # Rollup resolution; baked into the rollup triggers
+
+def epoch_sql(text_expression):
+    """SQL for the UTC epoch of one of our local-time 'YYYY-MM-DD HH:MM:SS' TEXT timestamps"""
+    return f"CAST(strftime('%s', {text_expression}, 'utc') AS INTEGER)"
+
+def _create_activity_rollups(cursor):
+    # Devices active per license per hour. A device is counted once per bucket: when it
+    # is inserted, and when its last_seen moves into a later bucket.
+    cursor.execute('''
+        CREATE TABLE device_activity_rollups (
+            license_key TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            active_devices INTEGER NOT NULL,
+            PRIMARY KEY (license_key, bucket)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX idx_device_activity_rollups_bucket ON device_activity_rollups (bucket)')
+    bucket = f'new.last_seen_epoch / {ACTIVITY_BUCKET_SECONDS} * {ACTIVITY_BUCKET_SECONDS}'
+    upsert = f'''
+        INSERT INTO device_activity_rollups (license_key, bucket, active_devices)
+        VALUES (new.license_key, {bucket}, 1)
+        ON CONFLICT (license_key, bucket) DO UPDATE SET active_devices = active_devices + 1;
+    '''
+    cursor.execute(f'''
+        CREATE TRIGGER device_registrations_activity_insert AFTER INSERT ON device_registrations
+        WHEN new.last_seen_epoch IS NOT NULL BEGIN
+            {upsert}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER device_registrations_activity_update AFTER UPDATE OF last_seen_epoch ON device_registrations
+        WHEN new.last_seen_epoch / {ACTIVITY_BUCKET_SECONDS} > COALESCE(old.last_seen_epoch, 0) / {ACTIVITY_BUCKET_SECONDS} BEGIN
+            {upsert}
+        END
+    ''')
+
+def _migration_epoch_columns(cursor):
+    # Integer UTC epochs beside the TEXT timestamps (which the API keeps returning).
+    # Writers set both, deriving the epoch from the same text value.
+    cursor.execute('ALTER TABLE licenses ADD COLUMN created_epoch INTEGER')
+    cursor.execute('ALTER TABLE device_registrations ADD COLUMN registered_epoch INTEGER')
+    cursor.execute('ALTER TABLE device_registrations ADD COLUMN last_seen_epoch INTEGER')
+    cursor.execute('ALTER TABLE device_registrations_archive ADD COLUMN registered_epoch INTEGER')
+    cursor.execute('ALTER TABLE device_registrations_archive ADD COLUMN last_seen_epoch INTEGER')
+    cursor.execute(f"UPDATE licenses SET created_epoch = {epoch_sql('created_at')}")
+    cursor.execute(f'''
+        UPDATE device_registrations
+        SET registered_epoch = {epoch_sql('registered_at')}, last_seen_epoch = {epoch_sql('last_seen')}
+    ''')
+    cursor.execute(f'''
+        UPDATE device_registrations_archive
+        SET registered_epoch = {epoch_sql('registered_at')}, last_seen_epoch = {epoch_sql('last_seen')}
+    ''')
+    cursor.execute('CREATE INDEX idx_licenses_created_epoch ON licenses (created_epoch)')
+    _create_activity_rollups(cursor)
+    # Seed each device's latest bucket; earlier history was never recorded
+    cursor.execute(f'''
+        INSERT INTO device_activity_rollups (license_key, bucket, active_devices)
+        SELECT license_key, last_seen_epoch / {ACTIVITY_BUCKET_SECONDS} * {ACTIVITY_BUCKET_SECONDS}, COUNT(*)
+        FROM device_registrations WHERE last_seen_epoch IS NOT NULL
+        GROUP BY 1, 2
+    ''')
+
+def _migration_status_changed(cursor):
+    # When is_blocked last changed; NULL means never since the license was created
+    cursor.execute('ALTER TABLE licenses ADD COLUMN status_changed_epoch INTEGER')
+    cursor.execute('''
+        CREATE TRIGGER licenses_status_changed AFTER UPDATE OF is_blocked ON licenses
+        WHEN old.is_blocked IS NOT new.is_blocked BEGIN
+            UPDATE licenses SET status_changed_epoch = CAST(strftime('%s', 'now') AS INTEGER) WHERE id = new.id;
+        END
+    ''')
+
+def _migration_license_lease_secret(cursor):
+    cursor.execute(
+        "INSERT OR IGNORE INTO app_secrets (name, value) VALUES ('license_lease', ?)",
+        (secrets.token_hex(32),)
+    )
+
+def _create_device_removal_version(cursor):
+    # Bumped whenever a device row is deleted (removed, pruned, its license deleted) or
+    # moves to another license key; workers then stop treating cached devices as known
+    cursor.execute("INSERT INTO change_versions (name, version) VALUES ('device_removals', 0)")
+    for name, event in (('delete', 'DELETE'), ('rekey', 'UPDATE OF license_key')):
+        cursor.execute(f'''
+            CREATE TRIGGER device_registrations_removal_{name} AFTER {event} ON device_registrations BEGIN
+                UPDATE change_versions SET version = version + 1 WHERE name = 'device_removals';
+            END
+        ''')
+
+def _migration_license_change_log(cursor):
+    # Change feed for the dashboard, written by triggers in the same transaction as the
+    # license write. Each license keeps only its latest entry; seq never goes backwards.
+    cursor.execute('''
+        CREATE TABLE license_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            license_id INTEGER NOT NULL,
+            op TEXT NOT NULL,
+            changed_epoch INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('CREATE INDEX idx_license_changes_license ON license_changes (license_id)')
+    # Highest seq dropped by pruning; clients that have not seen it must reload
+    cursor.execute("INSERT INTO change_versions (name, version) VALUES ('license_changes_pruned', 0)")
+    log_change_sql = '''
+        DELETE FROM license_changes WHERE license_id = {row}.id;
+        INSERT INTO license_changes (license_id, op, changed_epoch)
+        VALUES ({row}.id, '{op}', CAST(strftime('%s', 'now') AS INTEGER));
+    '''
+    columns = ('username', 'amount', 'license_key', 'devices', 'is_blocked', 'retention_days')
+    cursor.execute(f'''
+        CREATE TRIGGER licenses_change_log_insert AFTER INSERT ON licenses BEGIN
+            {log_change_sql.format(row='new', op='upsert')}
+        END
+    ''')
+    # Only the columns the API returns, and only real changes
+    cursor.execute(f'''
+        CREATE TRIGGER licenses_change_log_update AFTER UPDATE OF {', '.join(columns)} ON licenses
+        WHEN {' OR '.join(f'old.{column} IS NOT new.{column}' for column in columns)} BEGIN
+            {log_change_sql.format(row='new', op='upsert')}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER licenses_change_log_delete AFTER DELETE ON licenses BEGIN
+            {log_change_sql.format(row='old', op='delete')}
+        END
+    ''')
+
+# Numbered schema migrations, applied in order at startup and recorded in schema_version.
+# Never edit a migration that has shipped - append a new one instead.
+SCHEMA_MIGRATIONS = [
+    (1, 'Create licenses and device_registrations tables', _migration_base_tables),
+    (2, 'Add ON DELETE CASCADE foreign key from device_registrations to licenses', _migration_device_foreign_key),
+    (3, 'Add indexes for device lookups and license listing', _migration_lookup_indexes),
+    (4, 'Add trigram full-text index for license search', _migration_license_search_index),
+    (5, 'Maintain licenses.devices incrementally with triggers', _migration_device_count_triggers),
+    (6, 'Add change_versions counters for cross-worker invalidation', _migration_change_versions),
+    (7, 'Track licenses and device_registrations change versions with triggers', _migration_table_change_versions),
+    (8, 'Add license_events table for the status event stream', _migration_license_events),
+    (9, 'Add app_secrets and key_allocator for permuted license key allocation', _migration_key_allocator),
+    (10, 'Add per-license device retention, device archive and maintenance leases', _migration_device_retention),
+    (11, 'Add integer epoch timestamp columns and hourly device activity rollups', _migration_epoch_columns),
+    (12, 'Track when each license was last blocked or unblocked', _migration_status_changed),
+    (13, 'Add the signing secret for license leases', _migration_license_lease_secret),
+    (14, 'Add the license_changes log for the dashboard change feed', _migration_license_change_log),
+    (15, 'Count device removals so workers can drop stale known devices', _create_device_removal_version),
+]
+
+def run_migrations(conn, migrations=SCHEMA_MIGRATIONS):
+    """Apply every migration newer than the recorded schema version"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TEXT NOT NULL
+        )
+    ''')
+    applied = []
+    for version, description, migrate in migrations:
+        # BEGIN IMMEDIATE takes the write lock up front, so when several gunicorn
+        # workers start together only one of them applies each migration
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if conn.execute('SELECT 1 FROM schema_version WHERE version = ?', (version,)).fetchone():
+                conn.execute('COMMIT')
+                continue
+            cursor = conn.cursor()
+            migrate(cursor)
+            cursor.execute(
+                'INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)',
+                (version, description, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+            )
+            conn.execute('COMMIT')
+            applied.append(version)
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+    return applied
+
+def init_db():
+    """Initialize the database and apply pending migrations (runs once at startup)"""
+    try:
+        # Ensure directory exists
+        db_dir = os.path.dirname(DATABASE)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir, exist_ok=True)
+        
+        # Autocommit mode - run_migrations() manages its own transactions.
+        # Foreign keys stay off here so migrations can rebuild tables.
+        conn = sqlite3.connect(DATABASE, timeout=DB_TIMEOUT, isolation_level=None)
+        try:
+            # WAL is persistent in the database file, so readers stop blocking behind writers
+            conn.execute('PRAGMA journal_mode = WAL')
+            applied = run_migrations(conn)
+            if applied:
+                log.info('Applied schema migrations: %s', ', '.join(str(v) for v in applied))
+            _db_state['fts'] = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'licenses_fts'"
+            ).fetchone() is not None
+            if DEVICE_SHARDS and conn.execute('SELECT 1 FROM device_registrations LIMIT 1').fetchone():
+                log.warning('DEVICE_SHARDS is set but the primary database still holds devices; '
+                            'run `flask --app server rebalance-devices` to move them into their shards')
+        finally:
+            conn.close()
+        init_device_shards()
+        _db_state['initialized'] = True
+    except Exception as e:
+        log.error('Error initializing database: %s', e)
+        raise
+
+def get_device_count(license_key, conn=None):
+    """Get the stored device count for a license (kept current by triggers)"""
+    if conn is None:
+        conn = get_db_connection()
+    row = conn.execute('SELECT devices FROM licenses WHERE license_key = ?', (license_key,)).fetchone()
+    return (row[0] or 0) if row else 0
+
+def reconcile_device_counts(conn):
+    """Recompute every license's device count with one GROUP BY, returning how many were corrected"""
+    if DEVICE_SHARDS:
+        return _reconcile_sharded_device_counts(conn)
+    cursor = conn.execute('''
+        UPDATE licenses SET devices = counts.device_count
+        FROM (
+            SELECT licenses.id AS license_id, COUNT(device_registrations.id) AS device_count
+            FROM licenses
+            LEFT JOIN device_registrations ON device_registrations.license_key = licenses.license_key
+            GROUP BY licenses.id
+        ) AS counts
+        WHERE licenses.id = counts.license_id AND licenses.devices IS NOT counts.device_count
+    ''')
+    corrected = cursor.rowcount
+    conn.commit()
+    return corrected
+
+def _reconcile_sharded_device_counts(conn):
+    # Count per shard, drop devices whose license no longer exists (e.g. a cascade that
+    # failed after the license delete committed), then correct the primary's counts
+    stored = dict(conn.execute('SELECT license_key, devices FROM licenses').fetchall())
+    counts = {}
+    for index in range(DEVICE_SHARDS):
+        shard = get_device_shard(index)
+        orphans = []
+        for license_key, device_count in shard.execute(
+            'SELECT license_key, COUNT(*) FROM device_registrations GROUP BY license_key'
+        ):
+            if license_key in stored and device_shard_index(license_key) == index:
+                counts[license_key] = device_count
+            elif license_key not in stored:
+                orphans.append((license_key,))
+        if orphans:
+            shard.executemany('DELETE FROM device_registrations WHERE license_key = ?', orphans)
+            shard.commit()
+            log.info('Removed devices of %d deleted license(s) from device shard %d', len(orphans), index)
+    corrections = [
+        (counts.get(license_key, 0), license_key) for license_key, devices in stored.items()
+        if devices != counts.get(license_key, 0)
+    ]
+    conn.executemany('UPDATE licenses SET devices = ? WHERE license_key = ?', corrections)
+    conn.commit()
+    return len(corrections)
+
+def open_db_connection(path=None):
+    """Open a new SQLite connection (to the primary database by default) with the per-connection pragmas applied"""
+    started = time.perf_counter()
+    conn = sqlite3.connect(path or DATABASE, timeout=DB_TIMEOUT, factory=InstrumentedConnection)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA synchronous = NORMAL')  # Safe with WAL, no fsync per commit
+    conn.execute(f'PRAGMA cache_size = -{DB_CACHE_SIZE_KB}')
+    conn.execute(f'PRAGMA mmap_size = {DB_MMAP_SIZE}')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    conn.execute('PRAGMA foreign_keys = ON')  # Deleting a license cascades to its devices
+    metrics.inc('license_db_connections_opened_total')
+    metrics.observe('license_db_connection_open_seconds', (), time.perf_counter() - started)
+    return conn
+
+def get_db_connection():
+    """Check out this thread's pooled database connection for the current request.
+    
+    Each gunicorn worker thread opens its connection once and reuses it; the
+    teardown hook releases it (rolling back anything left uncommitted) when
+    the request ends, so handlers must not close it.
+    """
+    if not _db_state['initialized']:
+        # Startup initialization failed, retry it once before serving
+        init_db()
+    
+    conn = getattr(_db_pool, 'conn', None)
+    if conn is None or _db_pool.pid != os.getpid():
+        # First use in this thread, or we are in a freshly forked worker
+        try:
+            conn = open_db_connection()
+        except Exception as e:
+            log.critical('Database connection error: %s', e, exc_info=True)
+            # Try to reconnect once
+            try:
+                # Ensure directory exists
+                db_dir = os.path.dirname(DATABASE)
+                if db_dir and not os.path.exists(db_dir):
+                    os.makedirs(db_dir, exist_ok=True)
+                conn = open_db_connection()
+            except Exception as retry_error:
+                log.critical('Database reconnection failed: %s', retry_error)
+                raise
+        _db_pool.conn = conn
+        _db_pool.pid = os.getpid()
+    
+    if has_app_context():
+        g.db_conn = conn
+        trace_sql_profile(conn)
+    return conn
+
+def discard_db_connection():
+    """Drop this thread's pooled connection so the next checkout reopens it"""
+    conn = getattr(_db_pool, 'conn', None)
+    _db_pool.conn = None
+    if conn is not None and _db_pool.pid == os.getpid():
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+def trace_sql_profile(conn):
+    """Report the statements conn runs to the request's SQL profile, if it has one"""
+    profile = g.get('sql_profile')
+    if profile is not None:
+        conn.set_trace_callback(profile.trace)
+
+@app.teardown_appcontext
+def release_db_connection(exception):
+    """Return the request's connections to the pool"""
+    profiled = g.pop('sql_profile', None) is not None
+    for index in g.pop('shard_conns', ()):
+        shard = _db_pool.shards.get(index)
+        try:
+            if shard is not None and profiled:
+                shard.set_trace_callback(None)
+            if shard is not None and shard.in_transaction:
+                shard.rollback()
+        except sqlite3.Error as e:
+            log.warning('Discarding broken device shard connection: %s', e)
+            _db_pool.shards.pop(index, None)
+    conn = g.pop('db_conn', None)
+    if conn is None:
+        return
+    try:
+        if profiled:
+            conn.set_trace_callback(None)
+        if conn.in_transaction:
+            conn.rollback()
+    except sqlite3.Error as e:
+        log.warning('Discarding broken database connection: %s', e)
+        discard_db_connection()
+
+# Device shards - with DEVICE_SHARDS=N, device_registrations (with its archive and
+# activity rollups) lives in N extra SQLite files chosen by a hash of license_key, so
+# heartbeats and registrations for different shards take different write locks.
+# License metadata, including licenses.devices, stays in the primary database; code
+# outside this section reaches devices only through the routing helpers below, which
+# return the primary connection when sharding is off.
+DEVICE_SHARDS = int(os.environ.get('DEVICE_SHARDS', 0))
+
+def _shard_migration_devices(cursor):
+    # The primary schema's device tables as of migration 11, minus the cross-database
+    # foreign key and count triggers (counts are kept in the primary by the callers)
+    cursor.execute('''
+        CREATE TABLE device_registrations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            license_key TEXT NOT NULL,
+            device_fingerprint TEXT NOT NULL,
+            registered_at TEXT NOT NULL,
+            last_seen TEXT NOT NULL,
+            registered_epoch INTEGER,
+            last_seen_epoch INTEGER,
+            UNIQUE(license_key, device_fingerprint)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX idx_device_registrations_license_last_seen
+        ON device_registrations (license_key, last_seen DESC, device_fingerprint, registered_at)
+    ''')
+    cursor.execute('CREATE INDEX idx_device_registrations_last_seen ON device_registrations (last_seen)')
+    cursor.execute('''
+        CREATE TABLE device_registrations_archive (
+            id INTEGER PRIMARY KEY,
+            license_key TEXT NOT NULL,
+            device_fingerprint TEXT NOT NULL,
+            registered_at TEXT NOT NULL,
+            last_seen TEXT NOT NULL,
+            archived_at TEXT NOT NULL,
+            registered_epoch INTEGER,
+            last_seen_epoch INTEGER
+        )
+    ''')
+    _create_activity_rollups(cursor)
+    cursor.execute('''
+        CREATE TABLE change_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute("INSERT INTO change_versions (name, version) VALUES ('device_registrations', 0)")
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        cursor.execute(f'''
+            CREATE TRIGGER device_registrations_version_{event.lower()} AFTER {event} ON device_registrations BEGIN
+                UPDATE change_versions SET version = version + 1 WHERE name = 'device_registrations';
+            END
+        ''')
+
+DEVICE_SHARD_MIGRATIONS = [
+    (1, 'Create device_registrations, its archive and activity rollups', _shard_migration_devices),
+    (2, 'Count device removals so workers can drop stale known devices', _create_device_removal_version),
+]
+
+def device_shard_path(index, database=None):
+    """File of one device shard, next to the primary database"""
+    base, ext = os.path.splitext(database or DATABASE)
+    return f'{base}.devices-{index}{ext or ".db"}'
+
+def device_shard_index(license_key):
+    """Shard holding a license's devices (stable across processes, unlike hash())"""
+    return zlib.crc32(license_key.encode('utf-8')) % DEVICE_SHARDS if DEVICE_SHARDS else 0
 
-def update_device_count(license_key, conn=None):
-    """Update device count for a license"""
-    should_close = False
+def device_database_paths():
+    """Every database file holding device registrations"""
+    if not DEVICE_SHARDS:
+        return [DATABASE]
+    return [device_shard_path(index) for index in range(DEVICE_SHARDS)]
+
+def init_device_shards():
+    """Create or migrate each device shard (runs from init_db)"""
+    for index in range(DEVICE_SHARDS):
+        path = device_shard_path(index)
+        conn = sqlite3.connect(path, timeout=DB_TIMEOUT, isolation_level=None)
+        try:
+            conn.execute('PRAGMA journal_mode = WAL')
+            applied = run_migrations(conn, DEVICE_SHARD_MIGRATIONS)
+            if applied:
+                log.info('Applied device shard migrations to %s: %s', os.path.basename(path), ', '.join(str(v) for v in applied))
+        finally:
+            conn.close()
+
+def get_device_shard(index):
+    """Check out this thread's pooled connection to one device shard"""
+    shards = getattr(_db_pool, 'shards', None)
+    if shards is None or _db_pool.shards_pid != os.getpid():
+        shards = _db_pool.shards = {}
+        _db_pool.shards_pid = os.getpid()
+    conn = shards.get(index)
     if conn is None:
-        conn = get_db_connection()
-        should_close = True
+        conn = shards[index] = open_db_connection(device_shard_path(index))
+    if has_app_context():
+        g.setdefault('shard_conns', set()).add(index)
+        trace_sql_profile(conn)
+    return conn
+
+def get_device_connection(conn, license_key):
+    """Connection holding license_key's devices: its shard, or conn (the primary) when unsharded"""
+    return get_device_shard(device_shard_index(license_key)) if DEVICE_SHARDS else conn
+
+def device_shards(conn):
+    """Connections to every device store, for queries across all licenses"""
+    return [get_device_shard(index) for index in range(DEVICE_SHARDS)] if DEVICE_SHARDS else [conn]
+
+def group_by_device_shard(items, license_key_of):
+    """Split items into {shard index: [items]} by the license key of each"""
+    groups = {}
+    for item in items:
+        groups.setdefault(device_shard_index(license_key_of(item)), []).append(item)
+    return groups
+
+def adjust_device_counts(conn, deltas):
+    """Apply {license_key: change} to licenses.devices in the primary after sharded device writes.
     
+    Unsharded, the count triggers already did this inside the device write.
+    """
+    changes = [(delta, license_key) for license_key, delta in deltas.items() if delta]
+    if not DEVICE_SHARDS or not changes:
+        return
     try:
-        if not license_key:
-            return 0
-            
-        cursor = conn.cursor()
-        
-        # Count unique devices for this license (handle case where table might not exist)
+        conn.executemany('UPDATE licenses SET devices = MAX(COALESCE(devices, 0) + ?, 0) WHERE license_key = ?', changes)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+ROLLUP_MERGE_SQL = '''
+    INSERT INTO device_activity_rollups (license_key, bucket, active_devices) VALUES (?, ?, ?)
+    ON CONFLICT (license_key, bucket) DO UPDATE SET active_devices = active_devices + excluded.active_devices
+'''
+
+def move_activity_rollups(source, target, old_key, new_key):
+    """Merge a renamed license's activity rollups into its new key; the caller commits"""
+    rows = source.execute(
+        'SELECT bucket, active_devices FROM device_activity_rollups WHERE license_key = ?', (old_key,)
+    ).fetchall()
+    source.execute('DELETE FROM device_activity_rollups WHERE license_key = ?', (old_key,))
+    target.executemany(ROLLUP_MERGE_SQL, [(new_key, *row) for row in rows])
+
+def cascade_license_devices(conn, deleted=(), renamed=()):
+    """Carry license deletes and key changes (old, new) over to the device shards.
+    
+    Unsharded, the ON DELETE/ON UPDATE CASCADE foreign key already did this, and the
+    caller moved the activity rollups in the license transaction. Sharded,
+    it runs after the license change is committed; a failure here leaves orphans that
+    reconcile_device_counts() removes.
+    """
+    if not DEVICE_SHARDS:
+        return
+    for license_key in deleted:
+        shard = get_device_connection(conn, license_key)
+        shard.execute('DELETE FROM device_registrations WHERE license_key = ?', (license_key,))
+        shard.commit()
+    for old_key, new_key in renamed:
+        source, target = get_device_connection(conn, old_key), get_device_connection(conn, new_key)
         try:
-            cursor.execute('SELECT COUNT(DISTINCT device_fingerprint) FROM device_registrations WHERE license_key = ?', (license_key,))
-            result = cursor.fetchone()
-            device_count = result[0] if result else 0
-        except sqlite3.OperationalError as e:
-            # Table doesn't exist yet or other DB error, return 0
-            print(f"Database operational error (non-critical): {str(e)}")
-            device_count = 0
-        except Exception as e:
-            print(f"Error counting devices: {str(e)}")
-            device_count = 0
+            if source is target:
+                source.execute('UPDATE device_registrations SET license_key = ? WHERE license_key = ?', (new_key, old_key))
+                move_activity_rollups(source, source, old_key, new_key)
+            else:
+                rows = source.execute(
+                    'SELECT device_fingerprint, registered_at, last_seen FROM device_registrations WHERE license_key = ?',
+                    (old_key,)
+                ).fetchall()
+                target.execute('BEGIN IMMEDIATE')
+                before = target.execute(
+                    'SELECT bucket, active_devices FROM device_activity_rollups WHERE license_key = ?', (new_key,)
+                ).fetchall()
+                target.executemany(DEVICE_UPSERT_SQL, [(new_key, *row) for row in rows])
+                # The insert trigger just counted every moved device again; restore the target's
+                # rollups and merge in the history instead
+                target.execute('DELETE FROM device_activity_rollups WHERE license_key = ?', (new_key,))
+                target.executemany(ROLLUP_MERGE_SQL, [(new_key, *row) for row in before])
+                move_activity_rollups(source, target, old_key, new_key)
+                target.commit()
+                source.execute('DELETE FROM device_registrations WHERE license_key = ?', (old_key,))
+            source.commit()
+        except Exception:
+            source.rollback()
+            target.rollback()
+            raise
+
+# Heartbeat buffer - last_seen refreshes from already-registered devices are kept in
+# memory and written in one batched transaction every HEARTBEAT_FLUSH_INTERVAL seconds
+HEARTBEAT_FLUSH_INTERVAL = float(os.environ.get('HEARTBEAT_FLUSH_INTERVAL', 5))
+KNOWN_DEVICE_TTL = 600  # Seconds before a known device is re-checked against the database
+KNOWN_DEVICE_MAX = 100000
+KNOWN_DEVICE_CHECK = 1.0  # Seconds between checks for devices removed by other workers
+
+class HeartbeatBuffer:
+    """Coalesces device heartbeats per (license_key, device_fingerprint) and flushes them in batches"""
+    
+    def __init__(self, flush_interval):
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending = {}  # (license_key, fingerprint) -> latest last_seen
+        self._known = OrderedDict()  # (license_key, fingerprint) -> expiry (monotonic), LRU order
+        self._removals = {}  # device store index -> (device_removals version, monotonic time checked)
+        self._pid = None
+        self._thread = None
+    
+    def is_known(self, conn, license_key, fingerprint):
+        """True if the device was confirmed in the database recently and nothing was removed since"""
+        self._sync_removals(conn, license_key)
+        key = (license_key, fingerprint)
+        with self._lock:
+            expires = self._known.get(key)
+            if expires is None:
+                return False
+            if expires < time.monotonic():
+                del self._known[key]
+                return False
+            self._known.move_to_end(key)
+            return True
+    
+    def _sync_removals(self, conn, license_key):
+        # A device deleted, pruned or re-keyed by another worker must not stay known here:
+        # its heartbeats would be buffered as UPDATEs matching no row instead of registering
+        # it again. Throttled like the license cache's generation check.
+        store = device_shard_index(license_key)
+        now = time.monotonic()
+        with self._lock:
+            version, checked = self._removals.get(store, (None, 0.0))
+        if now - checked < KNOWN_DEVICE_CHECK:
+            return
+        current = get_change_version(get_device_connection(conn, license_key), 'device_removals')
+        with self._lock:
+            if current != version:
+                for key in [key for key in self._known if device_shard_index(key[0]) == store]:
+                    del self._known[key]
+            self._removals[store] = (current, now)
+    
+    def mark_known(self, license_key, fingerprint):
+        with self._lock:
+            self._known[(license_key, fingerprint)] = time.monotonic() + KNOWN_DEVICE_TTL
+            self._known.move_to_end((license_key, fingerprint))
+            while len(self._known) > KNOWN_DEVICE_MAX:
+                self._known.popitem(last=False)
+    
+    def forget(self, license_key, fingerprint=None):
+        """Drop buffered state for a removed device, or for every device of a license"""
+        with self._lock:
+            for store in (self._known, self._pending):
+                for key in [k for k in store if k[0] == license_key and fingerprint in (None, k[1])]:
+                    del store[key]
+    
+    def touch(self, license_key, fingerprint, last_seen):
+        """Record a heartbeat, to be written on the next flush"""
+        self._ensure_flusher()
+        with self._lock:
+            self._pending[(license_key, fingerprint)] = last_seen
+    
+    def pending_for(self, license_key):
+        """Buffered last_seen values for one license, keyed by fingerprint"""
+        with self._lock:
+            return {fp: seen for (key, fp), seen in self._pending.items() if key == license_key}
+    
+    def flush(self):
+        """Write all buffered heartbeats in a single transaction, returning how many were written"""
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
         
-        # Update device count in licenses table (only if we have a valid connection)
+        conn = get_db_connection()
+        written = 0
+        # One transaction per device shard (a single one when unsharded)
+        for rows in group_by_device_shard([(seen, key, fp) for (key, fp), seen in batch.items()], lambda row: row[1]).values():
+            devices_conn = get_device_connection(conn, rows[0][1])
+            try:
+                devices_conn.executemany(
+                    f"UPDATE device_registrations SET last_seen = ?1, last_seen_epoch = {epoch_sql('?1')} "
+                    'WHERE license_key = ?2 AND device_fingerprint = ?3 AND last_seen < ?1',
+                    rows
+                )
+                devices_conn.commit()
+            except sqlite3.Error as e:
+                devices_conn.rollback()
+                log.warning('Heartbeat flush failed, will retry: %s', e)
+                with self._lock:
+                    # Keep whatever arrived meanwhile, it is newer
+                    for seen, key, fp in rows:
+                        self._pending.setdefault((key, fp), seen)
+                continue
+            written += len(rows)
+        return written
+    
+    def _ensure_flusher(self):
+        # Started lazily so each forked gunicorn worker gets its own thread
+        if self._pid == os.getpid() and self._thread is not None:
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None:
+                return
+            if self._pid != os.getpid():
+                self._pending = {}
+                self._known = OrderedDict()
+                self._removals = {}
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='heartbeat-flusher', daemon=True)
+            self._thread.start()
+    
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                log.warning('Heartbeat flusher error: %s', e)
+
+heartbeat_buffer = HeartbeatBuffer(HEARTBEAT_FLUSH_INTERVAL)
+# Flush whatever is buffered when the worker shuts down
+atexit.register(heartbeat_buffer.flush)
+
+# License status cache - answers "is KEY active?" from memory. Entries expire after
+# LICENSE_CACHE_TTL seconds, mutation endpoints invalidate them in this worker, and
+# other workers notice through the license_status change version within
+# LICENSE_CACHE_GENERATION_CHECK seconds.
+LICENSE_CACHE_SIZE = int(os.environ.get('LICENSE_CACHE_SIZE', 10000))
+LICENSE_CACHE_TTL = float(os.environ.get('LICENSE_CACHE_TTL', 30))
+LICENSE_CACHE_GENERATION_CHECK = float(os.environ.get('LICENSE_CACHE_GENERATION_CHECK', 1.0))
+
+def get_change_version(conn, name):
+    row = conn.execute('SELECT version FROM change_versions WHERE name = ?', (name,)).fetchone()
+    return row[0] if row else 0
+
+def bump_change_version(conn, name):
+    """Bump a change version inside the caller's write transaction"""
+    conn.execute('UPDATE change_versions SET version = version + 1 WHERE name = ?', (name,))
+
+def change_etag(*parts):
+    """Strong ETag for a response fully determined by change versions and request parameters"""
+    return hashlib.sha1(':'.join(str(part) for part in parts).encode()).hexdigest()
+
+def not_modified(etag):
+    """Empty 304 for a request whose If-None-Match already matches"""
+    response = app.response_class(status=304)
+    response.set_etag(etag)
+    return response
+
+class LicenseStatusCache:
+    """Bounded LRU/TTL cache of license status keyed by license_key"""
+    
+    def __init__(self, max_size, ttl, generation_check):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.generation_check = generation_check
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # license_key -> (expires, status or None if not found)
+        self._generation = None
+        self._generation_checked = 0.0
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, conn, license_key):
+        """Return (found, status). status is None for a cached "license not found" """
+        self._sync_generation(conn)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(license_key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(license_key)
+                self.hits += 1
+                return True, entry[1]
+            if entry is not None:
+                del self._entries[license_key]
+            self.misses += 1
+            return False, None
+    
+    def put(self, license_key, status):
+        with self._lock:
+            self._entries[license_key] = (time.monotonic() + self.ttl, status)
+            self._entries.move_to_end(license_key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def update_device_count(self, license_key, device_count):
+        """Write-through for a new device registered by this worker"""
+        with self._lock:
+            entry = self._entries.get(license_key)
+            if entry is not None and entry[1] is not None:
+                self._entries[license_key] = (entry[0], dict(entry[1], devices=device_count))
+    
+    def invalidate(self, *license_keys):
+        with self._lock:
+            for license_key in license_keys:
+                self._entries.pop(license_key, None)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+    
+    def _sync_generation(self, conn):
+        # Throttled so a cache hit normally costs no database access at all
+        now = time.monotonic()
+        if now - self._generation_checked < self.generation_check:
+            return
+        self._generation_checked = now
+        generation = get_change_version(conn, 'license_status')
+        if generation != self._generation:
+            if self._generation is not None:
+                self.clear()
+            self._generation = generation
+
+license_cache = LicenseStatusCache(LICENSE_CACHE_SIZE, LICENSE_CACHE_TTL, LICENSE_CACHE_GENERATION_CHECK)
+
+def _license_cache_samples():
+    stats = license_cache.stats()
+    return [
+        ('license_cache_hits_total', (), stats['hits']),
+        ('license_cache_misses_total', (), stats['misses']),
+        ('license_cache_entries', (), stats['size']),
+    ]
+
+metrics.add_collector(_license_cache_samples)
+
+def lookup_license_status(conn, license_key):
+    """Get {id, is_blocked, devices, stable_since} for a license key through the cache, or None if it does not exist"""
+    found, status = license_cache.get(conn, license_key)
+    if found:
+        return status
+    row = conn.execute(
+        'SELECT id, is_blocked, devices, COALESCE(status_changed_epoch, created_epoch) AS stable_since '
+        'FROM licenses WHERE license_key = ?',
+        (license_key,)
+    ).fetchone()
+    status = {
+        'id': row['id'],
+        'is_blocked': row['is_blocked'],
+        'devices': row['devices'] or 0,
+        'stable_since': row['stable_since']
+    } if row else None
+    license_cache.put(license_key, status)
+    return status
+
+# Check-in scheduling - status and heartbeat responses carry next_check_in (seconds), so
+# the server can stretch and spread client polling without a client release
+CHECK_IN_BASE = float(os.environ.get('CHECK_IN_BASE', 30))
+CHECK_IN_MIN = 15
+CHECK_IN_MAX = float(os.environ.get('CHECK_IN_MAX', 600))
+CHECK_IN_BUSY_REQUESTS = int(os.environ.get('CHECK_IN_BUSY_REQUESTS', 32))  # In-flight requests per worker that count as fully loaded
+CHECK_IN_BUSY_LOCK_WAIT = 0.05  # Average write-lock wait (seconds) that counts as fully loaded
+CHECK_IN_JITTER = 0.2
+
+def next_check_in(license=None):
+    """Seconds until a client should check in again.
+    
+    Long-stable licenses and a loaded server (many in-flight requests or slow write
+    locks) stretch the interval; random jitter keeps clients from polling in waves.
+    """
+    interval = CHECK_IN_BASE
+    if license:
+        stable_for = time.time() - (license.get('stable_since') or time.time())
+        if license['is_blocked'] == 1:
+            interval *= 2  # A connected event stream still delivers an unblock immediately
+        elif stable_for > 7 * 86400:
+            interval *= 4
+        elif stable_for > 86400:
+            interval *= 2
+    interval *= 1 + min(load_monitor.pressure(), 3)
+    interval *= random.uniform(1 - CHECK_IN_JITTER, 1 + CHECK_IN_JITTER)
+    return int(min(max(interval, CHECK_IN_MIN), CHECK_IN_MAX))
+
+# License leases - signed, short-lived tokens stating a device's license state, so a
+# client only has to come back when its lease is about to run out. Verifying one needs
+# only the HMAC secret, never the database. The lease TTL bounds how long a block takes
+# to reach clients that are not connected to the event stream.
+LICENSE_LEASE_TTL = int(os.environ.get('LICENSE_LEASE_TTL', 300))
+LICENSE_LEASE_SECRET = os.environ.get('LICENSE_LEASE_SECRET')
+
+class LicenseLeaseInvalid(Exception):
+    """Raised for a lease with a bad format or signature, or one too old to renew"""
+
+def _b64url(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+def _b64url_decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+class LicenseLeaseSigner:
+    """Issues and verifies '<payload>.<signature>' lease tokens (base64url JSON + HMAC-SHA256)"""
+    
+    def __init__(self, secret=None, ttl=LICENSE_LEASE_TTL):
+        self._secret = secret.encode() if secret else None
+        self.ttl = ttl
+    
+    def _load_secret(self, conn):
+        if self._secret is None:
+            row = conn.execute("SELECT value FROM app_secrets WHERE name = 'license_lease'").fetchone()
+            self._secret = bytes.fromhex(row[0])
+        return self._secret
+    
+    def _sign(self, secret, payload):
+        return _b64url(hmac.new(secret, payload.encode(), hashlib.sha256).digest())
+    
+    def issue(self, conn, license_key, device_fingerprint, blocked):
+        """Signed lease for a device; returns (token, claims)"""
+        now = int(time.time())
+        claims = {'k': license_key, 'd': device_fingerprint, 'b': 1 if blocked else 0, 'iat': now, 'exp': now + self.ttl}
+        payload = _b64url(json.dumps(claims, separators=(',', ':')).encode())
+        return f'{payload}.{self._sign(self._load_secret(conn), payload)}', claims
+    
+    def verify(self, conn, token, grace=0):
+        """Claims of a correctly signed lease that expired no more than grace seconds ago"""
+        # compare_digest() only takes ASCII strings
+        if not isinstance(token, str) or not token.isascii():
+            raise LicenseLeaseInvalid('Invalid lease')
+        payload, _, signature = token.partition('.')
+        if not payload or not hmac.compare_digest(signature, self._sign(self._load_secret(conn), payload)):
+            raise LicenseLeaseInvalid('Invalid lease')
         try:
-            cursor.execute('UPDATE licenses SET devices = ? WHERE license_key = ?', (device_count, license_key))
+            claims = json.loads(_b64url_decode(payload))
+        except ValueError:
+            raise LicenseLeaseInvalid('Invalid lease')
+        if not (
+            isinstance(claims, dict)
+            and isinstance(claims.get('k'), str) and isinstance(claims.get('d'), str)
+            and claims.get('b') in (0, 1)
+            and all(isinstance(claims.get(name), int) for name in ('iat', 'exp'))
+        ):
+            raise LicenseLeaseInvalid('Invalid lease')
+        if claims['exp'] + grace < time.time():
+            raise LicenseLeaseInvalid('Lease expired')
+        return claims
+
+license_leases = LicenseLeaseSigner(LICENSE_LEASE_SECRET)
+
+# License events - mutation endpoints record status changes in license_events inside
+# their transaction; each worker tails the table and pushes them to its SSE subscribers
+LICENSE_EVENTS_KEEP = 10000  # Most recent events kept in the table
+EVENTS_POLL_INTERVAL = float(os.environ.get('EVENTS_POLL_INTERVAL', 0.5))
+EVENTS_STREAM_TIMEOUT = int(os.environ.get('EVENTS_STREAM_TIMEOUT', 300))
+EVENTS_KEEPALIVE = 25
+EVENTS_MAX_STREAMS = int(os.environ.get('EVENTS_MAX_STREAMS', 48))
+EVENTS_RETRY_AFTER = int(os.environ.get('EVENTS_RETRY_AFTER', 600))  # Seconds a refused client should stay on leases/polling
+
+def record_license_change(conn, license_key, event):
+    """Record a status-affecting license change inside the caller's write transaction"""
+    record_license_changes(conn, [(license_key, event)])
+
+def record_license_changes(conn, changes):
+    """Record many (license_key, event) changes inside the caller's write transaction"""
+    if not changes:
+        return
+    bump_change_version(conn, 'license_status')
+    created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    conn.executemany(
+        'INSERT INTO license_events (license_key, event, created_at) VALUES (?, ?, ?)',
+        [(license_key, event, created_at) for license_key, event in changes]
+    )
+    # Subscribers only need recent events, so keep the table bounded
+    last_id = conn.execute('SELECT MAX(id) FROM license_events').fetchone()[0]
+    conn.execute('DELETE FROM license_events WHERE id <= ?', (last_id - LICENSE_EVENTS_KEEP,))
+
+class LicenseEventHub:
+    """In-process pub/sub for license events, fed by tailing license_events"""
+    
+    def __init__(self, poll_interval, max_streams):
+        self.poll_interval = poll_interval
+        self.max_streams = max_streams
+        self._lock = threading.Lock()
+        self._subscribers = {}  # license_key -> set of queues
+        self._last_id = None
+        self._pid = None
+        self._thread = None
+    
+    def subscribe(self, license_key):
+        """Register a stream for a license key, or return None when the worker is at capacity"""
+        self._ensure_tailer()
+        with self._lock:
+            if sum(len(queues) for queues in self._subscribers.values()) >= self.max_streams:
+                return None
+            subscriber = queue.Queue()
+            self._subscribers.setdefault(license_key, set()).add(subscriber)
+            return subscriber
+    
+    def unsubscribe(self, license_key, subscriber):
+        with self._lock:
+            queues = self._subscribers.get(license_key)
+            if queues is not None:
+                queues.discard(subscriber)
+                if not queues:
+                    del self._subscribers[license_key]
+    
+    def stream_count(self):
+        with self._lock:
+            return sum(len(queues) for queues in self._subscribers.values())
+    
+    def poll(self):
+        """Deliver events recorded since the last poll to local subscribers"""
+        conn = get_db_connection()
+        rows = conn.execute(
+            'SELECT id, license_key, event FROM license_events WHERE id > ? ORDER BY id LIMIT 1000',
+            (self._last_id,)
+        ).fetchall()
+        for row in rows:
+            with self._lock:
+                queues = list(self._subscribers.get(row['license_key'], ()))
+            for subscriber in queues:
+                subscriber.put(row['event'])
+            self._last_id = row['id']
+        return len(rows)
+    
+    def _ensure_tailer(self):
+        # Started lazily so each forked gunicorn worker tails on its own thread
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None:
+                return
+            self._pid = os.getpid()
+            self._subscribers = {}
+            # Start from the current end, before the first subscriber reads any status
+            self._last_id = get_db_connection().execute(
+                'SELECT COALESCE(MAX(id), 0) FROM license_events'
+            ).fetchone()[0]
+            self._thread = threading.Thread(target=self._run, name='license-events', daemon=True)
+            self._thread.start()
+    
+    def _run(self):
+        while True:
+            try:
+                self.poll()
+            except Exception as e:
+                log.warning('License event poll failed: %s', e)
+            time.sleep(self.poll_interval)
+
+event_hub = LicenseEventHub(EVENTS_POLL_INTERVAL, EVENTS_MAX_STREAMS)
+metrics.add_collector(lambda: [('license_event_streams', (), event_hub.stream_count())])
+
+# License key allocation - keys are drawn from a secret pseudorandom permutation of all
+# 26^6 keys, indexed by a counter in key_allocator. Reserving a counter range is one
+# atomic UPDATE, so no two reservations (in any worker) can return the same key.
+LICENSE_KEY_HALF = 26 ** 3  # The permutation is a Feistel network over two 3-letter halves
+LICENSE_KEYSPACE = LICENSE_KEY_HALF ** 2
+LICENSE_KEY_ROUNDS = 4
+LICENSE_KEY_SECRET = os.environ.get('LICENSE_KEY_SECRET')
+
+class LicenseKeysExhausted(Exception):
+    """Raised when every key in the keyspace has been handed out"""
+
+class LicenseKeyAllocator:
+    """Hands out unused license keys from a keyed permutation of the 6-letter keyspace"""
+    
+    def __init__(self, secret=None):
+        self._secret = secret.encode() if secret else None
+    
+    def _load_secret(self, conn):
+        if self._secret is None:
+            row = conn.execute("SELECT value FROM app_secrets WHERE name = 'license_key_permutation'").fetchone()
+            self._secret = bytes.fromhex(row[0])
+        return self._secret
+    
+    def key_for_index(self, secret, index):
+        """Map a counter index to its license key (a bijection on [0, 26^6))"""
+        left, right = divmod(index, LICENSE_KEY_HALF)
+        for round_number in range(LICENSE_KEY_ROUNDS):
+            digest = hmac.new(secret, f'{round_number}:{right}'.encode(), hashlib.sha256).digest()
+            left, right = right, (left + int.from_bytes(digest[:8], 'big')) % LICENSE_KEY_HALF
+        value = left * LICENSE_KEY_HALF + right
+        letters = []
+        for _ in range(6):
+            value, digit = divmod(value, 26)
+            letters.append(string.ascii_uppercase[digit])
+        return ''.join(letters)
+    
+    def _reserve_indexes(self, conn, count):
+        in_transaction = conn.in_transaction
+        # Only advances when the whole range fits, so a failed reservation consumes nothing
+        row = conn.execute(
+            'UPDATE key_allocator SET next_index = next_index + ?1 '
+            'WHERE id = 1 AND next_index + ?1 <= ?2 RETURNING next_index',
+            (count, LICENSE_KEYSPACE)
+        ).fetchone()
+        if not in_transaction:
             conn.commit()
-        except Exception as e:
-            print(f"Warning: Could not update device count in licenses table: {str(e)}")
-            # Don't fail - just log warning
-        
-        cursor.close()
-        
-        if should_close and conn:
-            conn.close()
+        if row is None:
+            raise LicenseKeysExhausted('All license keys have been allocated')
+        end = row[0]
+        return range(end - count, end)
+    
+    def reserve(self, conn, count=1, exclude=()):
+        """Reserve count unused license keys.
         
-        return device_count
-    except Exception as e:
-        print(f"Error updating device count: {str(e)}")
-        if should_close and conn:
-            try:
-                conn.close()
-            except:
-                pass
-        return 0  # Return 0 on error
+        Runs inside the caller's transaction if one is open, otherwise commits the
+        reservation itself. Keys that already exist (entered by hand or issued before
+        the allocator) or are in exclude are skipped.
+        """
+        secret = self._load_secret(conn)
+        keys = []
+        while len(keys) < count:
+            candidates = [self.key_for_index(secret, index) for index in self._reserve_indexes(conn, count - len(keys))]
+            candidates = [key for key in candidates if key not in exclude]
+            used = {row[0] for row in select_in_chunks(
+                conn, 'SELECT license_key FROM licenses WHERE license_key IN ({placeholders})', candidates
+            )}
+            keys.extend(key for key in candidates if key not in used)
+        return keys
 
-def get_db_connection():
-    """Get database connection with error handling"""
-    try:
-        # Ensure database is initialized
-        init_db()
-        conn = sqlite3.connect(DATABASE, timeout=10.0)
-        conn.row_factory = sqlite3.Row
-        return conn
-    except Exception as e:
-        print(f"Critical: Database connection error: {str(e)}")
-        import traceback
-        print(traceback.format_exc())
-        # Try to reconnect once
-        try:
-            # Ensure directory exists
-            db_dir = os.path.dirname(DATABASE)
-            if db_dir and not os.path.exists(db_dir):
-                os.makedirs(db_dir, exist_ok=True)
-            conn = sqlite3.connect(DATABASE, timeout=10.0)
-            conn.row_factory = sqlite3.Row
-            return conn
-        except Exception as retry_error:
-            print(f"Critical: Database reconnection failed: {str(retry_error)}")
-            raise
+license_key_allocator = LicenseKeyAllocator(LICENSE_KEY_SECRET)
 
-def generate_license_key():
-    """Generate a 6-character alphabet-only license key"""
-    letters = string.ascii_uppercase
-    return ''.join(random.choice(letters) for _ in range(6))
+def select_in_chunks(conn, sql, values, chunk_size=500, params=()):
+    """Run a SELECT whose IN ({placeholders}) list is filled from values, chunked under SQLite's parameter limit.
+    
+    params are bound before each chunk, for placeholders that come ahead of the IN list.
+    """
+    for start in range(0, len(values), chunk_size):
+        chunk = list(values[start:start + chunk_size])
+        yield from conn.execute(sql.format(placeholders=', '.join('?' * len(chunk))), list(params) + chunk)
 
 def validate_license_key(key):
     """Validate license key: must be 6 characters and alphabet only"""
@@ -155,6 +1991,162 @@ def validate_license_key(key):
         return False, "License key must contain only letters (A-Z)"
     return True, None
 
+def parse_retention_days(value):
+    """Validate a per-license device retention: None (use the default) or whole days, 0 = keep forever"""
+    if value is None or value == '':
+        return None, None
+    try:
+        days = int(value)
+    except (ValueError, TypeError):
+        return None, 'retention_days must be a whole number of days'
+    if days < 0:
+        return None, 'retention_days cannot be negative'
+    return days, None
+
+def license_search_match(search):
+    """Build an FTS5 MATCH expression equivalent to LIKE '%search%', or None if LIKE must be used.
+    
+    The trigram index answers a quoted phrase as a case-insensitive substring match on
+    each column, which is what LIKE does - except for terms shorter than a trigram,
+    LIKE wildcards (% and _) and non-ASCII text (LIKE only folds ASCII case).
+    """
+    if not _db_state['fts'] or len(search) < 3 or not search.isascii():
+        return None
+    if '%' in search or '_' in search:
+        return None
+    return '"' + search.replace('"', '""') + '"'
+
+# Listing options for GET /api/licenses
+LICENSE_FIELDS = ('id', 'username', 'amount', 'license_key', 'devices', 'is_blocked', 'created_at', 'retention_days')
+# Columns returned by the API; the epoch columns and status_changed_epoch are internal
+LICENSE_COLUMNS = ', '.join(LICENSE_FIELDS)
+# sort key -> (SQL expression, default direction)
+LICENSE_SORTS = {
+    'id': ('licenses.id', 'desc'),
+    'created_at': ('licenses.created_at', 'desc'),
+    'username': ('licenses.username', 'asc'),
+    'amount': ('licenses.amount', 'desc'),
+    'devices': ('COALESCE(licenses.devices, 0)', 'desc'),
+    'relevance': ('bm25(licenses_fts)', 'asc'),  # Best match first, only for indexed searches
+}
+LICENSE_PAGE_DEFAULT = 50
+LICENSE_PAGE_MAX = 500
+
+def encode_cursor(sort_value, license_id):
+    """Encode a keyset position as an opaque URL-safe cursor"""
+    raw = json.dumps([sort_value, license_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Decode a cursor from encode_cursor(), raising ValueError if it was tampered with"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        sort_value, license_id = json.loads(raw)
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if not isinstance(license_id, int) or isinstance(sort_value, (list, dict)):
+        raise ValueError('Invalid cursor')
+    return sort_value, license_id
+
+def parse_license_list_args(args):
+    """Validate the listing query parameters of GET /api/licenses (raises ValueError)"""
+    options = {'search': args.get('search', '').strip()}
+    
+    sort = args.get('sort', 'id')
+    if sort not in LICENSE_SORTS:
+        raise ValueError(f"Invalid sort. Allowed: {', '.join(LICENSE_SORTS)}")
+    order = args.get('order', LICENSE_SORTS[sort][1]).lower()
+    if order not in ('asc', 'desc'):
+        raise ValueError('Invalid order. Allowed: asc, desc')
+    options['sort'] = sort
+    options['descending'] = order == 'desc'
+    
+    fields = [f.strip() for f in args.get('fields', '').split(',') if f.strip()]
+    unknown = [f for f in fields if f not in LICENSE_FIELDS]
+    if unknown:
+        raise ValueError(f"Invalid fields: {', '.join(unknown)}. Allowed: {', '.join(LICENSE_FIELDS)}")
+    if fields and 'id' not in fields:
+        fields.insert(0, 'id')  # Needed to page and to act on rows
+    options['fields'] = fields or list(LICENSE_FIELDS)
+    
+    # Any paging parameter switches the response to {licenses, next_cursor}
+    options['paginated'] = any(name in args for name in ('limit', 'after_id', 'cursor'))
+    options['limit'] = None
+    options['cursor'] = None
+    options['after_id'] = None
+    if options['paginated']:
+        try:
+            limit = int(args.get('limit', LICENSE_PAGE_DEFAULT))
+        except ValueError:
+            raise ValueError('Invalid limit')
+        options['limit'] = max(1, min(limit, LICENSE_PAGE_MAX))
+        if args.get('cursor'):
+            options['cursor'] = decode_cursor(args['cursor'])
+        elif args.get('after_id'):
+            try:
+                options['after_id'] = int(args['after_id'])
+            except ValueError:
+                raise ValueError('Invalid after_id')
+    return options
+
+def build_license_list_query(conn, options):
+    """Build the keyset-paginated SELECT for GET /api/licenses from parsed options"""
+    search = options['search']
+    sort = options['sort']
+    descending = options['descending']
+    match = license_search_match(search) if search else None
+    if sort == 'relevance' and not match:
+        # Nothing to rank (no search, or a term the index cannot answer)
+        sort, descending = 'id', True
+    sort_expr = LICENSE_SORTS[sort][0]
+    
+    columns = options['fields']
+    params = []
+    if match:
+        from_clause = 'licenses_fts JOIN licenses ON licenses.id = licenses_fts.rowid'
+        conditions = ['licenses_fts MATCH ?']
+        params.append(match)
+    else:
+        from_clause = 'licenses'
+        conditions = []
+        if search:
+            conditions.append('(licenses.username LIKE ? OR licenses.license_key LIKE ?)')
+            params += [f'%{search}%', f'%{search}%']
+    
+    position = options['cursor']
+    if position is None and options['after_id'] is not None:
+        if sort == 'id':
+            position = (options['after_id'], options['after_id'])
+        elif sort == 'relevance':
+            raise ValueError('after_id cannot be used with sort=relevance, use cursor')
+        else:
+            anchor = conn.execute(f'SELECT {sort_expr} FROM licenses WHERE licenses.id = ?',
+                                  (options['after_id'],)).fetchone()
+            if not anchor:
+                raise ValueError('Unknown after_id')
+            position = (anchor[0], options['after_id'])
+    
+    op = '<' if descending else '>'
+    if position is not None:
+        if sort == 'id':
+            conditions.append(f'licenses.id {op} ?')
+            params.append(position[1])
+        else:
+            conditions.append(f'({sort_expr}, licenses.id) {op} (?, ?)')
+            params += [position[0], position[1]]
+    
+    direction = 'DESC' if descending else 'ASC'
+    sql = (f"SELECT {', '.join('licenses.' + c for c in columns)}, {sort_expr} AS sort_value "
+           f"FROM {from_clause}")
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    sql += f' ORDER BY {sort_expr} {direction}, licenses.id {direction}'
+    if options['limit']:
+        # One extra row tells us whether there is a next page
+        sql += ' LIMIT ?'
+        params.append(options['limit'] + 1)
+    return sql, params
+
 @app.route('/api/licenses', methods=['GET', 'OPTIONS'])
 def get_licenses():
     """Handle OPTIONS preflight request"""
@@ -165,92 +2157,51 @@ def get_licenses():
         response.headers.add('Access-Control-Allow-Headers', 'Content-Type, Authorization')
         return response
     
-    """Get all licenses with optional search"""
-    """Get all licenses with optional search"""
+    """Get licenses with optional search, sorting, field projection and keyset pagination"""
     conn = None
     try:
-        search = request.args.get('search', '').strip()
-        
-        # Ensure database is initialized before querying
         try:
-            init_db()
-        except Exception as db_init_error:
-            print(f"Warning: Database init check failed (non-critical): {str(db_init_error)}")
+            options = parse_license_list_args(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         conn = get_db_connection()
         
         try:
-            if search:
-                cursor = conn.execute(
-                    'SELECT * FROM licenses WHERE username LIKE ? OR license_key LIKE ? ORDER BY id DESC',
-                    (f'%{search}%', f'%{search}%')
-                )
-            else:
-                cursor = conn.execute('SELECT * FROM licenses ORDER BY id DESC')
-            
-            rows = cursor.fetchall()
-            licenses = []
+            # Answer revalidations before running the listing query
+            etag = change_etag('licenses', get_change_version(conn, 'licenses'), request.query_string.decode())
+            if request.if_none_match.contains_weak(etag):
+                return not_modified(etag)
             
-            # Convert rows to dicts safely
-            for row in rows:
-                try:
-                    if hasattr(row, 'keys'):
-                        license_dict = dict(row)
-                    else:
-                        # Fallback if row_factory not working
-                        license_dict = {
-                            'id': row[0],
-                            'username': row[1],
-                            'amount': row[2],
-                            'license_key': row[3],
-                            'devices': row[4] if len(row) > 4 else 0,
-                            'is_blocked': row[5] if len(row) > 5 else 0,
-                            'created_at': row[6] if len(row) > 6 else ''
-                        }
-                    licenses.append(license_dict)
-                except Exception as row_error:
-                    print(f"Warning: Error converting row to dict: {str(row_error)}")
-                    continue
+            try:
+                sql, params = build_license_list_query(conn, options)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            cursor = conn.execute(sql, params)
             
-            # Update device count for each license (skip if causes errors)
-            for license in licenses:
-                try:
-                    license_key = license.get('license_key', '')
-                    if not license_key:
-                        license['devices'] = license.get('devices', 0)
-                        continue
-                    
-                    # Try to update device count, but don't fail if it errors
-                    try:
-                        device_count = update_device_count(license_key, conn)
-                        license['devices'] = device_count
-                    except Exception as update_error:
-                        # Keep existing device count or default to 0
-                        print(f"Warning: Could not update device count for {license_key}: {str(update_error)}")
-                        license['devices'] = license.get('devices', 0)
-                except Exception as process_error:
-                    print(f"Warning: Error processing license {license.get('id', 'unknown')}: {str(process_error)}")
-                    license['devices'] = license.get('devices', 0)
+            rows = cursor.fetchall()
+            next_cursor = None
+            if options['limit'] and len(rows) > options['limit']:
+                rows = rows[:options['limit']]
+                next_cursor = encode_cursor(rows[-1]['sort_value'], rows[-1]['id'])
+            licenses = [dict(row) for row in rows]
             
-            if conn:
-                try:
-                    conn.close()
-                except:
-                    pass
+            # Project to the requested fields (drops sort_value)
+            licenses = [{field: license.get(field) for field in options['fields']} for license in licenses]
             
-            response = jsonify(licenses)
+            if options['paginated']:
+                response = jsonify({'licenses': licenses, 'next_cursor': next_cursor})
+            else:
+                response = jsonify(licenses)
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
             response.headers.add('Access-Control-Allow-Origin', '*')
             response.headers.add('Access-Control-Allow-Methods', 'GET, POST, PUT, DELETE, OPTIONS')
             response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
             return response
             
         except sqlite3.Error as db_error:
-            print(f"Database error in get_licenses query: {str(db_error)}")
-            if conn:
-                try:
-                    conn.close()
-                except:
-                    pass
+            log.error('Database error in get_licenses query: %s', db_error)
             # Return empty array on database error
             response = jsonify([])
             response.headers.add('Access-Control-Allow-Origin', '*')
@@ -259,16 +2210,7 @@ def get_licenses():
             return response
             
     except Exception as e:
-        import traceback
-        error_msg = str(e)
-        print(f"Error in get_licenses: {error_msg}")
-        print(traceback.format_exc())
-        
-        if conn:
-            try:
-                conn.close()
-            except:
-                pass
+        log.exception('Error in get_licenses: %s', e)
         
         # Return empty array instead of error to prevent script failure
         # This allows script to continue working even if server has issues
@@ -278,6 +2220,82 @@ def get_licenses():
         response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
         return response
 
+# Change feed - dashboards load the table once, then apply the license_changes written
+# since the last seq they saw. Delete tombstones are pruned after
+# LICENSE_CHANGES_RETENTION_DAYS; a client older than that gets reset and reloads.
+LICENSE_CHANGES_RETENTION_DAYS = int(os.environ.get('LICENSE_CHANGES_RETENTION_DAYS', 7))
+LICENSE_CHANGES_PAGE_MAX = 500
+
+@app.route('/api/changes', methods=['GET'])
+def get_license_changes():
+    """Licenses created, updated or deleted after ?since=<seq>; without since, only the current seq"""
+    try:
+        since = request.args.get('since', '')
+        since = int(since) if since else None
+        limit = max(1, min(int(request.args.get('limit', LICENSE_CHANGES_PAGE_MAX)), LICENSE_CHANGES_PAGE_MAX))
+    except ValueError:
+        return jsonify({'error': 'since and limit must be integers'}), 400
+    
+    conn = get_db_connection()
+    pruned = get_change_version(conn, 'license_changes_pruned')
+    if since is None or since < pruned:
+        latest = conn.execute('SELECT MAX(seq) FROM license_changes').fetchone()[0]
+        return jsonify({
+            'seq': max(latest or 0, pruned),
+            'changes': [],
+            'more': False,
+            'reset': since is not None
+        }), 200
+    
+    # One statement, so the change entries and license rows come from the same snapshot
+    rows = conn.execute(f'''
+        SELECT license_changes.seq, license_changes.license_id, license_changes.op,
+               {', '.join('licenses.' + c for c in LICENSE_FIELDS)}
+        FROM license_changes LEFT JOIN licenses ON licenses.id = license_changes.license_id
+        WHERE license_changes.seq > ?
+        ORDER BY license_changes.seq
+        LIMIT ?
+    ''', (since, limit + 1)).fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    changes = []
+    for row in rows:
+        if row['op'] == 'delete' or row['id'] is None:
+            changes.append({'seq': row['seq'], 'op': 'delete', 'id': row['license_id'], 'license': None})
+        else:
+            license = {field: row[field] for field in LICENSE_FIELDS}
+            changes.append({'seq': row['seq'], 'op': 'upsert', 'id': row['license_id'], 'license': license})
+    return jsonify({
+        'seq': rows[-1]['seq'] if rows else since,
+        'changes': changes,
+        'more': more,
+        'reset': False
+    }), 200
+
+def prune_license_changes(conn, days=LICENSE_CHANGES_RETENTION_DAYS):
+    """Drop change-feed delete tombstones older than the retention window"""
+    cutoff = int(time.time()) - days * 86400
+    horizon = conn.execute(
+        "SELECT MAX(seq) FROM license_changes WHERE op = 'delete' AND changed_epoch < ?", (cutoff,)
+    ).fetchone()[0]
+    if horizon is None:
+        return 0
+    try:
+        removed = conn.execute("DELETE FROM license_changes WHERE op = 'delete' AND seq <= ?", (horizon,)).rowcount
+        conn.execute(
+            "UPDATE change_versions SET version = MAX(version, ?) WHERE name = 'license_changes_pruned'", (horizon,)
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return removed
+
+LICENSE_INSERT_SQL = (
+    'INSERT INTO licenses (username, amount, license_key, devices, is_blocked, created_at, created_epoch) '
+    f"VALUES (?, ?, ?, ?, ?, ?6, {epoch_sql('?6')})"
+)
+
 @app.route('/api/licenses', methods=['POST', 'OPTIONS'])
 def create_license():
     """Handle OPTIONS preflight request"""
@@ -308,73 +2326,49 @@ def create_license():
     
     conn = get_db_connection()
     
-    # Generate or validate license key
-    if not license_key:
-        # Generate a unique license key
-        max_attempts = 100
-        for _ in range(max_attempts):
-            license_key = generate_license_key()
-            existing = conn.execute('SELECT id FROM licenses WHERE license_key = ?', (license_key,)).fetchone()
-            if not existing:
-                break
-        else:
-            conn.close()
-            return jsonify({'error': 'Unable to generate unique license key. Please try again.'}), 500
-    else:
-        # Validate provided license key
+    # Validate a provided license key; an empty or already used one is replaced by an allocated key
+    if license_key:
         is_valid, error_msg = validate_license_key(license_key)
         if not is_valid:
-            conn.close()
             return jsonify({'error': error_msg}), 400
         
-        # Check if license key already exists
         existing = conn.execute('SELECT id FROM licenses WHERE license_key = ?', (license_key,)).fetchone()
         if existing:
-            # Auto-generate a new unique key
-            max_attempts = 100
-            for _ in range(max_attempts):
-                license_key = generate_license_key()
-                existing = conn.execute('SELECT id FROM licenses WHERE license_key = ?', (license_key,)).fetchone()
-                if not existing:
-                    break
-            else:
-                conn.close()
-                return jsonify({'error': 'Unable to generate unique license key. Please try again.'}), 500
+            license_key = ''
+    
+    if not license_key:
+        try:
+            license_key = license_key_allocator.reserve(conn)[0]
+        except LicenseKeysExhausted as e:
+            return jsonify({'error': str(e)}), 500
     
     # Create license
     try:
         created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         cursor = conn.cursor()
         cursor.execute(
-            'INSERT INTO licenses (username, amount, license_key, devices, is_blocked, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+            LICENSE_INSERT_SQL,
             (username, amount, license_key, 0, 0, created_at)
         )
+        record_license_change(conn, license_key, 'created')
         conn.commit()
+        license_cache.invalidate(license_key)  # May hold a cached "not found"
         
         # Get the created license
         license_id = cursor.lastrowid
-        license_data = dict(conn.execute('SELECT * FROM licenses WHERE id = ?', (license_id,)).fetchone())
+        license_data = dict(conn.execute(f'SELECT {LICENSE_COLUMNS} FROM licenses WHERE id = ?', (license_id,)).fetchone())
         cursor.close()
-        conn.close()
         
         response = jsonify(license_data)
         response.headers.add('Access-Control-Allow-Origin', '*')
         return response, 201
     except sqlite3.IntegrityError as e:
-        conn.close()
         response = jsonify({'error': 'License key already exists'})
         response.headers.add('Access-Control-Allow-Origin', '*')
         return response, 400
     except Exception as e:
-        if conn:
-            try:
-                conn.close()
-            except:
-                pass
-        import traceback
         error_msg = str(e)
-        print(f"Error creating license: {error_msg}")
-        print(traceback.format_exc())
+        log.exception('Error creating license: %s', error_msg)
         response = jsonify({'error': f'Server error: {error_msg}'})
         response.headers.add('Access-Control-Allow-Origin', '*')
         response.headers.add('Access-Control-Allow-Methods', 'POST, OPTIONS')
@@ -385,9 +2379,15 @@ def create_license():
 def delete_license(license_id):
     """Delete a license"""
     conn = get_db_connection()
+    existing = conn.execute('SELECT license_key FROM licenses WHERE id = ?', (license_id,)).fetchone()
     conn.execute('DELETE FROM licenses WHERE id = ?', (license_id,))
+    if existing:
+        record_license_change(conn, existing['license_key'], 'deleted')
     conn.commit()
-    conn.close()
+    if existing:
+        cascade_license_devices(conn, deleted=[existing['license_key']])
+        license_cache.invalidate(existing['license_key'])
+        heartbeat_buffer.forget(existing['license_key'])
     
     return jsonify({'message': 'License deleted successfully'}), 200
 
@@ -399,43 +2399,52 @@ def update_license(license_id):
     conn = get_db_connection()
     existing = conn.execute('SELECT * FROM licenses WHERE id = ?', (license_id,)).fetchone()
     if not existing:
-        conn.close()
         return jsonify({'error': 'License not found'}), 404
     
     username = data.get('username', existing['username']).strip()
     amount = data.get('amount', existing['amount'])
     license_key = data.get('license_key', existing['license_key']).strip()
-    devices = data.get('devices', existing['devices'])
     
     try:
         amount = float(amount)
-        devices = int(devices)
     except (ValueError, TypeError):
-        conn.close()
-        return jsonify({'error': 'Invalid amount or devices'}), 400
+        return jsonify({'error': 'Invalid amount'}), 400
+    
+    retention_days = existing['retention_days']
+    if 'retention_days' in data:
+        retention_days, error_msg = parse_retention_days(data['retention_days'])
+        if error_msg:
+            return jsonify({'error': error_msg}), 400
     
     # Validate and check if license key already exists (if changed)
     if license_key != existing['license_key']:
         license_key = license_key.upper()
         is_valid, error_msg = validate_license_key(license_key)
         if not is_valid:
-            conn.close()
             return jsonify({'error': error_msg}), 400
         
         duplicate = conn.execute('SELECT id FROM licenses WHERE license_key = ? AND id != ?', 
                                  (license_key, license_id)).fetchone()
         if duplicate:
-            conn.close()
             return jsonify({'error': 'License key already exists'}), 400
     
+    # devices is derived: the device triggers (or the shard writers) keep it current
     conn.execute(
-        'UPDATE licenses SET username = ?, amount = ?, license_key = ?, devices = ? WHERE id = ?',
-        (username, amount, license_key, devices, license_id)
+        'UPDATE licenses SET username = ?, amount = ?, license_key = ?, retention_days = ? WHERE id = ?',
+        (username, amount, license_key, retention_days, license_id)
     )
+    if license_key != existing['license_key']:
+        # Clients still using the old key have lost their license
+        record_license_change(conn, existing['license_key'], 'deleted')
+        if not DEVICE_SHARDS:
+            move_activity_rollups(conn, conn, existing['license_key'], license_key)
+    record_license_change(conn, license_key, 'updated')
     conn.commit()
+    if license_key != existing['license_key']:
+        cascade_license_devices(conn, renamed=[(existing['license_key'], license_key)])
+    license_cache.invalidate(existing['license_key'], license_key)
     
-    updated_license = dict(conn.execute('SELECT * FROM licenses WHERE id = ?', (license_id,)).fetchone())
-    conn.close()
+    updated_license = dict(conn.execute(f'SELECT {LICENSE_COLUMNS} FROM licenses WHERE id = ?', (license_id,)).fetchone())
     
     return jsonify(updated_license), 200
 
@@ -445,14 +2454,14 @@ def block_license(license_id):
     conn = get_db_connection()
     existing = conn.execute('SELECT * FROM licenses WHERE id = ?', (license_id,)).fetchone()
     if not existing:
-        conn.close()
         return jsonify({'error': 'License not found'}), 404
     
     conn.execute('UPDATE licenses SET is_blocked = 1 WHERE id = ?', (license_id,))
+    record_license_change(conn, existing['license_key'], 'blocked')
     conn.commit()
+    license_cache.invalidate(existing['license_key'])
     
-    updated_license = dict(conn.execute('SELECT * FROM licenses WHERE id = ?', (license_id,)).fetchone())
-    conn.close()
+    updated_license = dict(conn.execute(f'SELECT {LICENSE_COLUMNS} FROM licenses WHERE id = ?', (license_id,)).fetchone())
     
     return jsonify(updated_license), 200
 
@@ -462,34 +2471,387 @@ def unblock_license(license_id):
     conn = get_db_connection()
     existing = conn.execute('SELECT * FROM licenses WHERE id = ?', (license_id,)).fetchone()
     if not existing:
-        conn.close()
         return jsonify({'error': 'License not found'}), 404
     
     conn.execute('UPDATE licenses SET is_blocked = 0 WHERE id = ?', (license_id,))
+    record_license_change(conn, existing['license_key'], 'unblocked')
     conn.commit()
+    license_cache.invalidate(existing['license_key'])
+    
+    updated_license = dict(conn.execute(f'SELECT {LICENSE_COLUMNS} FROM licenses WHERE id = ?', (license_id,)).fetchone())
+    
+    return jsonify(updated_license), 200
+
+@app.route('/api/generate-key', methods=['GET'])
+def generate_key():
+    """Reserve an unused 6-character alphabet-only license key"""
+    conn = get_db_connection()
+    try:
+        license_key = license_key_allocator.reserve(conn)[0]
+    except LicenseKeysExhausted as e:
+        return jsonify({'error': str(e)}), 500
+    return jsonify({'license_key': license_key})
+
+# Bulk license operations - POST /api/licenses/bulk
+LICENSE_BULK_MAX = 10000
+LICENSE_BULK_OPS = ('create', 'update', 'block', 'unblock', 'delete')
+
+def parse_bulk_operation(item):
+    """Validate one bulk operation, returning (operation, error)"""
+    if not isinstance(item, dict):
+        return None, 'Operation must be an object'
+    op = item.get('op')
+    if op not in LICENSE_BULK_OPS:
+        return None, f"op must be one of: {', '.join(LICENSE_BULK_OPS)}"
+    
+    if op == 'create':
+        username = str(item.get('username') or '').strip()
+        if not username:
+            return None, 'Username is required'
+        try:
+            amount = float(item.get('amount', 0))
+        except (ValueError, TypeError):
+            return None, 'Invalid amount'
+        if amount < 0:
+            return None, 'Amount cannot be negative'
+        license_key = str(item.get('license_key') or '').strip().upper()
+        if license_key:
+            is_valid, error_msg = validate_license_key(license_key)
+            if not is_valid:
+                return None, error_msg
+        return {'op': op, 'username': username, 'amount': amount, 'license_key': license_key}, None
+    
+    license_id = item.get('id')
+    if not isinstance(license_id, int) or isinstance(license_id, bool):
+        return None, 'id must be an integer'
+    operation = {'op': op, 'id': license_id}
+    if op == 'update':
+        try:
+            if 'username' in item:
+                operation['username'] = str(item['username']).strip()
+            if 'amount' in item:
+                operation['amount'] = float(item['amount'])
+        except (ValueError, TypeError):
+            return None, 'Invalid amount'
+        if 'retention_days' in item:
+            operation['retention_days'], error_msg = parse_retention_days(item['retention_days'])
+            if error_msg:
+                return None, error_msg
+        if 'license_key' in item:
+            license_key = str(item['license_key'] or '').strip().upper()
+            is_valid, error_msg = validate_license_key(license_key)
+            if not is_valid:
+                return None, error_msg
+            operation['license_key'] = license_key
+    return operation, None
+
+def apply_bulk_operations(conn, operations, atomic):
+    """Apply parsed bulk operations in one write transaction.
+    
+    operations is a list of (index, operation) pairs. Returns (errors, changes, applied):
+    errors maps index -> message for operations that were skipped, changes lists the
+    (license_key, event) pairs recorded and applied lists (index, operation) pairs written.
+    An atomic batch with any error is rolled back and applies nothing.
+    """
+    errors = {}
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        
+        ids = [operation['id'] for _, operation in operations if 'id' in operation]
+        existing = {row['id']: row for row in select_in_chunks(
+            conn, 'SELECT * FROM licenses WHERE id IN ({placeholders})', ids
+        )}
+        seen_ids = set()
+        for index, operation in operations:
+            if 'id' not in operation:
+                continue
+            if operation['id'] in seen_ids:
+                errors[index] = 'License appears more than once in this batch'
+            elif operation['id'] not in existing:
+                errors[index] = 'License not found'
+            seen_ids.add(operation['id'])
+        
+        # Requested keys must be unused; keys being renamed away still count as taken
+        requested = [operation['license_key'] for _, operation in operations if operation.get('license_key')]
+        taken = {row[0] for row in select_in_chunks(
+            conn, 'SELECT license_key FROM licenses WHERE license_key IN ({placeholders})', requested
+        )}
+        needs_key = []
+        for index, operation in operations:
+            if index in errors:
+                continue
+            if operation['op'] == 'create':
+                if not operation['license_key'] or operation['license_key'] in taken:
+                    needs_key.append(operation)  # Auto-generated, as in POST /api/licenses
+                else:
+                    taken.add(operation['license_key'])
+            elif operation['op'] == 'update' and 'license_key' in operation:
+                if operation['license_key'] == existing[operation['id']]['license_key']:
+                    continue
+                if operation['license_key'] in taken:
+                    errors[index] = 'License key already exists'
+                else:
+                    taken.add(operation['license_key'])
+        
+        if atomic and errors:
+            conn.rollback()
+            return errors, [], []
+        
+        for operation, license_key in zip(needs_key, license_key_allocator.reserve(conn, len(needs_key), taken)):
+            operation['license_key'] = license_key
+        
+        applied = [(index, operation) for index, operation in operations if index not in errors]
+        created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        creates, updates, blocks, deletes, changes = [], [], [], [], []
+        deleted_keys, renamed = [], []
+        for _, operation in applied:
+            op = operation['op']
+            if op == 'create':
+                creates.append((operation['username'], operation['amount'], operation['license_key'], 0, 0, created_at))
+                changes.append((operation['license_key'], 'created'))
+                continue
+            
+            current = existing[operation['id']]
+            if op == 'update':
+                license_key = operation.get('license_key', current['license_key'])
+                updates.append((
+                    operation.get('username', current['username']),
+                    operation.get('amount', current['amount']),
+                    license_key,
+                    operation.get('retention_days', current['retention_days']),
+                    operation['id']
+                ))
+                if license_key != current['license_key']:
+                    # Clients still using the old key have lost their license
+                    changes.append((current['license_key'], 'deleted'))
+                    renamed.append((current['license_key'], license_key))
+                changes.append((license_key, 'updated'))
+            elif op == 'delete':
+                deletes.append((operation['id'],))
+                deleted_keys.append(current['license_key'])
+                changes.append((current['license_key'], 'deleted'))
+            else:
+                blocks.append((1 if op == 'block' else 0, operation['id']))
+                changes.append((current['license_key'], op + 'ed'))
+        
+        conn.executemany(LICENSE_INSERT_SQL, creates)
+        conn.executemany(
+            'UPDATE licenses SET username = ?, amount = ?, license_key = ?, retention_days = ? WHERE id = ?',
+            updates
+        )
+        conn.executemany('UPDATE licenses SET is_blocked = ? WHERE id = ?', blocks)
+        conn.executemany('DELETE FROM licenses WHERE id = ?', deletes)
+        if not DEVICE_SHARDS:
+            for old_key, new_key in renamed:
+                move_activity_rollups(conn, conn, old_key, new_key)
+        record_license_changes(conn, changes)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    cascade_license_devices(conn, deleted=deleted_keys, renamed=renamed)
+    return errors, changes, applied
+
+@app.route('/api/licenses/bulk', methods=['POST', 'OPTIONS'])
+def bulk_licenses():
+    """Handle OPTIONS preflight request"""
+    if request.method == 'OPTIONS':
+        response = jsonify({})
+        response.headers.add('Access-Control-Allow-Origin', '*')
+        response.headers.add('Access-Control-Allow-Methods', 'POST, OPTIONS')
+        response.headers.add('Access-Control-Allow-Headers', 'Content-Type, Authorization')
+        return response
+    
+    """Apply many create/update/block/unblock/delete operations in one transaction"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Request body must be a JSON object'}), 400
+    
+    items = data.get('operations')
+    atomic = bool(data.get('atomic', False))
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'operations must be a non-empty list'}), 400
+    if len(items) > LICENSE_BULK_MAX:
+        return jsonify({'error': f'At most {LICENSE_BULK_MAX} operations per request'}), 400
+    
+    operations, errors = [], {}
+    for index, item in enumerate(items):
+        operation, error_msg = parse_bulk_operation(item)
+        if error_msg:
+            errors[index] = error_msg
+        else:
+            operations.append((index, operation))
+    
+    applied = []
+    if operations and not (atomic and errors):
+        conn = get_db_connection()
+        try:
+            lookup_errors, changes, applied = apply_bulk_operations(conn, operations, atomic)
+        except LicenseKeysExhausted as e:
+            return jsonify({'error': str(e)}), 500
+        except Exception as e:
+            log.exception('Error applying bulk license operations: %s', e)
+            return jsonify({'error': f'Database error: {str(e)}'}), 500
+        errors.update(lookup_errors)
+        
+        license_cache.invalidate(*{license_key for license_key, _ in changes})
+        for license_key, event in changes:
+            if event == 'deleted':
+                heartbeat_buffer.forget(license_key)
+        
+        # Return the stored rows so callers see generated keys
+        ids = [operation['id'] for _, operation in applied if operation['op'] not in ('create', 'delete')]
+        keys = [operation['license_key'] for _, operation in applied if operation['op'] == 'create']
+        by_id = {row['id']: dict(row) for row in select_in_chunks(
+            conn, f'SELECT {LICENSE_COLUMNS} FROM licenses WHERE id IN ({{placeholders}})', ids
+        )}
+        by_key = {row['license_key']: dict(row) for row in select_in_chunks(
+            conn, f'SELECT {LICENSE_COLUMNS} FROM licenses WHERE license_key IN ({{placeholders}})', keys
+        )}
+    
+    results = [{'index': index, 'op': item.get('op') if isinstance(item, dict) else None} for index, item in enumerate(items)]
+    for index, error_msg in errors.items():
+        results[index].update(status='error', error=error_msg)
+    for index, operation in applied:
+        results[index]['status'] = 'ok'
+        if operation['op'] == 'create':
+            results[index]['license'] = by_key.get(operation['license_key'])
+        elif operation['op'] == 'delete':
+            results[index]['id'] = operation['id']
+        else:
+            results[index]['license'] = by_id.get(operation['id'])
     
-    updated_license = dict(conn.execute('SELECT * FROM licenses WHERE id = ?', (license_id,)).fetchone())
-    conn.close()
+    if atomic and errors:
+        for result in results:
+            result.setdefault('status', 'skipped')
+        return jsonify({
+            'error': f'{len(errors)} operation(s) failed; nothing was applied',
+            'applied': 0,
+            'failed': len(errors),
+            'results': results
+        }), 400
     
-    return jsonify(updated_license), 200
+    return jsonify({
+        'applied': len(applied),
+        'failed': len(errors),
+        'results': results
+    }), 200
 
-@app.route('/api/generate-key', methods=['GET'])
-def generate_key():
-    """Generate a random 6-character alphabet-only license key"""
-    conn = get_db_connection()
-    max_attempts = 100
+# Registration upsert: one statement both inserts a new device and refreshes a known one
+DEVICE_UPSERT_SQL = f'''
+    INSERT INTO device_registrations (license_key, device_fingerprint, registered_at, last_seen, registered_epoch, last_seen_epoch)
+    VALUES (?1, ?2, ?3, ?4, {epoch_sql('?3')}, {epoch_sql('?4')})
+    ON CONFLICT (license_key, device_fingerprint)
+    DO UPDATE SET last_seen = excluded.last_seen, last_seen_epoch = excluded.last_seen_epoch
+    WHERE excluded.last_seen > last_seen
+'''
+DEVICE_BATCH_MAX = 1000
+
+class LicenseUnavailable(Exception):
+    """Raised inside a registration transaction when the license is missing or blocked"""
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+def _lock_license_for_registration(conn, license_key):
+    # BEGIN IMMEDIATE takes the write lock first, so the license check, the upsert
+    # and the count read all see one consistent state
+    conn.execute('BEGIN IMMEDIATE')
+    license = conn.execute('SELECT is_blocked, devices FROM licenses WHERE license_key = ?', (license_key,)).fetchone()
+    if not license:
+        raise LicenseUnavailable('License key not found', 404)
+    if license['is_blocked'] == 1:
+        raise LicenseUnavailable('License is blocked', 403)
+    return license['devices'] or 0
+
+def _register_in_shard(conn, license_key, device_fingerprints, now):
+    # Sharded registration: check the license in the primary, upsert in the shard under
+    # the shard's write lock only, then count the new devices in the primary
+    license = conn.execute('SELECT is_blocked FROM licenses WHERE license_key = ?', (license_key,)).fetchone()
+    if not license:
+        raise LicenseUnavailable('License key not found', 404)
+    if license['is_blocked'] == 1:
+        raise LicenseUnavailable('License is blocked', 403)
+    shard = get_device_connection(conn, license_key)
+    try:
+        shard.execute('BEGIN IMMEDIATE')
+        existing = {row[0] for row in select_in_chunks(
+            shard, 'SELECT device_fingerprint FROM device_registrations '
+            'WHERE license_key = ? AND device_fingerprint IN ({placeholders})',
+            device_fingerprints, params=(license_key,)
+        )}
+        shard.executemany(DEVICE_UPSERT_SQL, [(license_key, fp, now, now) for fp in device_fingerprints])
+        shard.commit()
+    except Exception:
+        shard.rollback()
+        raise
+    new_fingerprints = {fp for fp in device_fingerprints if fp not in existing}
+    adjust_device_counts(conn, {license_key: len(new_fingerprints)})
+    return get_device_count(license_key, conn), new_fingerprints
+
+def register_device_fingerprint(conn, license_key, device_fingerprint, now):
+    """Insert or refresh one device in a single transaction, returning (device_count, is_new)"""
+    if DEVICE_SHARDS:
+        device_count, new_fingerprints = _register_in_shard(conn, license_key, [device_fingerprint], now)
+        return device_count, bool(new_fingerprints)
+    try:
+        count_before = _lock_license_for_registration(conn, license_key)
+        conn.execute(DEVICE_UPSERT_SQL, (license_key, device_fingerprint, now, now))
+        # The insert trigger bumps the count only when the device is new
+        device_count = get_device_count(license_key, conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return device_count, device_count > count_before
+
+def register_device_fingerprints(conn, license_key, device_fingerprints, now):
+    """Insert or refresh many devices in a single transaction, returning (device_count, new fingerprints)"""
+    if DEVICE_SHARDS:
+        return _register_in_shard(conn, license_key, device_fingerprints, now)
+    try:
+        _lock_license_for_registration(conn, license_key)
+        existing = {row[0] for row in select_in_chunks(
+            conn, 'SELECT device_fingerprint FROM device_registrations '
+            'WHERE license_key = ? AND device_fingerprint IN ({placeholders})',
+            device_fingerprints, params=(license_key,)
+        )}
+        conn.executemany(DEVICE_UPSERT_SQL, [(license_key, fp, now, now) for fp in device_fingerprints])
+        device_count = get_device_count(license_key, conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return device_count, {fp for fp in device_fingerprints if fp not in existing}
+
+def is_device_registered(conn, license_key, device_fingerprint):
+    """True if the device has a device_registrations row; only those get leases"""
+    row = get_device_connection(conn, license_key).execute(
+        'SELECT 1 FROM device_registrations WHERE license_key = ? AND device_fingerprint = ?',
+        (license_key, device_fingerprint)
+    ).fetchone()
+    return row is not None
+
+def check_in_device(conn, license_key, device_fingerprint, now):
+    """Record that a device is running; returns (license status, device_count, is_new).
     
-    for _ in range(max_attempts):
-        license_key = generate_license_key()
-        existing = conn.execute('SELECT id FROM licenses WHERE license_key = ?', (license_key,)).fetchone()
-        if not existing:
-            conn.close()
-            return jsonify({'license_key': license_key})
+    Raises LicenseUnavailable if the license is missing or blocked.
+    """
+    if heartbeat_buffer.is_known(conn, license_key, device_fingerprint):
+        # Known device: only last_seen changes, so buffer it instead of writing now
+        license = lookup_license_status(conn, license_key)
+        if not license:
+            raise LicenseUnavailable('License key not found', 404)
+        if license['is_blocked'] == 1:
+            raise LicenseUnavailable('License is blocked', 403)
+        heartbeat_buffer.touch(license_key, device_fingerprint, now)
+        return license, license['devices'] or 0, False
     
-    conn.close()
-    # If we can't find a unique key, return one anyway (very unlikely)
-    license_key = generate_license_key()
-    return jsonify({'license_key': license_key})
+    device_count, is_new = register_device_fingerprint(conn, license_key, device_fingerprint, now)
+    heartbeat_buffer.mark_known(license_key, device_fingerprint)
+    if is_new:
+        license_cache.update_device_count(license_key, device_count)
+    return lookup_license_status(conn, license_key), device_count, is_new
 
 @app.route('/api/devices/register', methods=['POST', 'OPTIONS'])
 def register_device():
@@ -519,80 +2881,269 @@ def register_device():
         return jsonify({'error': error_msg}), 400
     
     conn = get_db_connection()
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     
-    # Check if license exists and is not blocked
     try:
-        license = conn.execute('SELECT id, is_blocked FROM licenses WHERE license_key = ?', (license_key,)).fetchone()
-        if not license:
-            conn.close()
-            return jsonify({'error': 'License key not found'}), 404
-        
-        # Convert Row to dict if needed
-        if hasattr(license, 'keys'):
-            license_dict = dict(license)
-        else:
-            license_dict = {'id': license[0], 'is_blocked': license[1]}
+        license, device_count, is_new = check_in_device(conn, license_key, device_fingerprint, now)
+        lease, _ = license_leases.issue(conn, license_key, device_fingerprint, blocked=False)
+        check_in = next_check_in(license)
+        response = jsonify({
+            'success': True,
+            'message': 'Device registered successfully',
+            'device_count': device_count,
+            'is_new': is_new,
+            'lease': lease,
+            'next_check_in': check_in
+        })
+        response.headers['X-Next-Check-In'] = str(check_in)
+        return response, 200
         
-        if license_dict.get('is_blocked') == 1:
-            conn.close()
-            return jsonify({'error': 'License is blocked'}), 403
+    except LicenseUnavailable as e:
+        return jsonify({'error': str(e)}), e.status_code
     except Exception as e:
-        conn.close()
-        print(f"Error checking license: {str(e)}")
-        return jsonify({'error': 'Database error checking license'}), 500
-        return jsonify({'error': 'License is blocked'}), 403
+        log.exception('Error registering device: %s', e)
+        return jsonify({'error': f'Database error: {str(e)}'}), 500
+
+@app.route('/api/devices/register/batch', methods=['POST', 'OPTIONS'])
+def register_devices_batch():
+    """Handle OPTIONS preflight request"""
+    if request.method == 'OPTIONS':
+        response = jsonify({})
+        response.headers.add('Access-Control-Allow-Origin', '*')
+        response.headers.add('Access-Control-Allow-Methods', 'POST, OPTIONS')
+        response.headers.add('Access-Control-Allow-Headers', 'Content-Type, Authorization')
+        return response
+    
+    """Register many devices for one license key in a single transaction"""
+    data = request.json or {}
+    
+    license_key = data.get('license_key', '').strip().upper()
+    fingerprints = data.get('device_fingerprints')
+    
+    is_valid, error_msg = validate_license_key(license_key)
+    if not is_valid:
+        return jsonify({'error': error_msg}), 400
+    
+    if not isinstance(fingerprints, list) or not fingerprints:
+        return jsonify({'error': 'device_fingerprints must be a non-empty list'}), 400
+    if len(fingerprints) > DEVICE_BATCH_MAX:
+        return jsonify({'error': f'At most {DEVICE_BATCH_MAX} device fingerprints per request'}), 400
+    if not all(isinstance(fp, str) and fp.strip() for fp in fingerprints):
+        return jsonify({'error': 'Device fingerprints must be non-empty strings'}), 400
+    
+    # Keep request order, drop duplicates
+    fingerprints = list(dict.fromkeys(fp.strip() for fp in fingerprints))
     
-    # Register or update device
+    conn = get_db_connection()
     now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     try:
-        cursor = conn.cursor()
-        
-        # Check if device already exists
-        existing = cursor.execute(
-            'SELECT id FROM device_registrations WHERE license_key = ? AND device_fingerprint = ?',
-            (license_key, device_fingerprint)
-        ).fetchone()
-        
-        if existing:
-            # Update last_seen
-            cursor.execute(
-                'UPDATE device_registrations SET last_seen = ? WHERE license_key = ? AND device_fingerprint = ?',
-                (now, license_key, device_fingerprint)
-            )
+        device_count, new_fingerprints = register_device_fingerprints(conn, license_key, fingerprints, now)
+    except LicenseUnavailable as e:
+        return jsonify({'error': str(e)}), e.status_code
+    except Exception as e:
+        log.exception('Error registering devices: %s', e)
+        return jsonify({'error': f'Database error: {str(e)}'}), 500
+    
+    for fp in fingerprints:
+        heartbeat_buffer.mark_known(license_key, fp)
+    if new_fingerprints:
+        license_cache.update_device_count(license_key, device_count)
+    
+    return jsonify({
+        'success': True,
+        'device_count': device_count,
+        'devices': [{'device_fingerprint': fp, 'is_new': fp in new_fingerprints} for fp in fingerprints]
+    }), 200
+
+@app.route('/api/licenses/<license_key>/status', methods=['GET'])
+def get_license_status(license_key):
+    """Get the status of a single license key (used by client polling)"""
+    license_key = license_key.strip().upper()
+    
+    is_valid, error_msg = validate_license_key(license_key)
+    if not is_valid:
+        return jsonify({'error': error_msg}), 400
+    
+    conn = get_db_connection()
+    # Served from memory on a cache hit, otherwise a single UNIQUE index lookup
+    license = lookup_license_status(conn, license_key)
+    
+    if not license:
+        return jsonify({'error': 'License key not found'}), 404
+    
+    is_blocked = license['is_blocked'] == 1
+    status = {
+        'license_key': license_key,
+        'active': not is_blocked,
+        'blocked': is_blocked,
+        'device_count': license['devices'] or 0
+    }
+    
+    # Clients send the ETag back as If-None-Match and get an empty 304 while nothing changed.
+    # The ETag covers the status only, so the per-response check-in hint does not defeat it;
+    # it is weak because the bodies it stands for differ in next_check_in.
+    etag = hashlib.sha1(json.dumps(status, sort_keys=True).encode()).hexdigest()
+    check_in = next_check_in(license)
+    response = jsonify(dict(status, next_check_in=check_in))
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Next-Check-In'] = str(check_in)  # Also sent with 304s
+    device_fingerprint = request.args.get('device', '').strip()
+    if device_fingerprint and is_device_registered(conn, license_key, device_fingerprint):
+        lease, _ = license_leases.issue(conn, license_key, device_fingerprint, is_blocked)
+        response.headers['X-License-Lease'] = lease
+    return response.make_conditional(request)
+
+@app.route('/api/leases/renew', methods=['POST', 'OPTIONS'])
+def renew_license_lease():
+    """Exchange a lease that is about to expire for a fresh one.
+    
+    Also counts as a device heartbeat. The license state comes from the status cache;
+    the only SQLite read is the check that the device is still registered, so a
+    removed device cannot renew its way back in.
+    """
+    if request.method == 'OPTIONS':
+        return jsonify({})
+    
+    data = request.get_json(silent=True)
+    conn = get_db_connection()
+    try:
+        claims = license_leases.verify(conn, data.get('lease') if isinstance(data, dict) else None, grace=license_leases.ttl)
+    except LicenseLeaseInvalid as e:
+        return jsonify({'error': str(e)}), 401
+    
+    license_key, device_fingerprint = claims['k'], claims['d']
+    try:
+        license = lookup_license_status(conn, license_key)
+        if not license:
+            return jsonify({'error': 'License key not found'}), 404
+        if not is_device_registered(conn, license_key, device_fingerprint):
+            heartbeat_buffer.forget(license_key, device_fingerprint)
+            return jsonify({'error': 'Device is not registered'}), 404
+        if license['is_blocked'] == 1:
+            device_count = license['devices'] or 0
         else:
-            # Insert new device
-            cursor.execute(
-                'INSERT INTO device_registrations (license_key, device_fingerprint, registered_at, last_seen) VALUES (?, ?, ?, ?)',
-                (license_key, device_fingerprint, now, now)
-            )
-        
-        conn.commit()
-        cursor.close()
-        
-        # Update device count
-        device_count = update_device_count(license_key)
-        
-        conn.close()
-        
-        return jsonify({
-            'success': True,
-            'message': 'Device registered successfully',
-            'device_count': device_count
-        }), 200
-        
+            now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            license, device_count, _ = check_in_device(conn, license_key, device_fingerprint, now)
+    except LicenseUnavailable as e:
+        if e.status_code != 403:
+            return jsonify({'error': str(e)}), e.status_code
+        license = lookup_license_status(conn, license_key)  # Blocked in the meantime
+        device_count = license['devices'] or 0
     except Exception as e:
-        conn.close()
-        import traceback
-        print(f"Error registering device: {str(e)}")
-        print(traceback.format_exc())
+        log.exception('Error renewing lease: %s', e)
         return jsonify({'error': f'Database error: {str(e)}'}), 500
+    
+    is_blocked = license['is_blocked'] == 1
+    token, _ = license_leases.issue(conn, license_key, device_fingerprint, is_blocked)
+    check_in = next_check_in(license)
+    response = jsonify({
+        'license_key': license_key,
+        'active': not is_blocked,
+        'blocked': is_blocked,
+        'device_count': device_count,
+        'lease': token,
+        'next_check_in': check_in
+    })
+    response.headers['X-Next-Check-In'] = str(check_in)
+    return response
+
+@app.route('/api/leases/verify', methods=['POST'])
+def verify_license_lease():
+    """Check a lease's signature and expiry without touching the database"""
+    data = request.get_json(silent=True)
+    try:
+        claims = license_leases.verify(get_db_connection(), data.get('lease') if isinstance(data, dict) else None)
+    except LicenseLeaseInvalid as e:
+        return jsonify({'valid': False, 'error': str(e)}), 401
+    return jsonify({
+        'valid': True,
+        'license_key': claims['k'],
+        'device_fingerprint': claims['d'],
+        'active': claims['b'] == 0,
+        'blocked': claims['b'] == 1,
+        'expires': claims['exp']
+    })
+
+def format_sse(event, data):
+    """Format one Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def license_event_status(license_key, event):
+    """Status payload pushed to clients for a license event"""
+    if event == 'deleted':
+        return {'license_key': license_key, 'event': event, 'active': False, 'blocked': False, 'deleted': True}
+    if event in ('blocked', 'unblocked'):
+        blocked = event == 'blocked'
+        return {'license_key': license_key, 'event': event, 'active': not blocked, 'blocked': blocked}
+    # created/updated - the client re-checks the status endpoint
+    return {'license_key': license_key, 'event': event}
+
+@app.route('/api/licenses/<license_key>/events', methods=['GET'])
+def license_events_stream(license_key):
+    """Stream status changes for a license key as Server-Sent Events"""
+    license_key = license_key.strip().upper()
+    
+    is_valid, error_msg = validate_license_key(license_key)
+    if not is_valid:
+        return jsonify({'error': error_msg}), 400
+    
+    # Subscribe before reading the status so no change can fall in between
+    subscriber = event_hub.subscribe(license_key)
+    if subscriber is None:
+        # Each stream holds a worker thread. Refused clients keep using leases/polling;
+        # the jitter spreads out those that come back
+        response = jsonify({'error': 'Too many event streams, use polling'})
+        response.headers['Retry-After'] = str(int(EVENTS_RETRY_AFTER * random.uniform(1, 1.5)))
+        return response, 503
+    
+    conn = get_db_connection()
+    license = conn.execute('SELECT is_blocked FROM licenses WHERE license_key = ?', (license_key,)).fetchone()
+    if not license:
+        event_hub.unsubscribe(license_key, subscriber)
+        return jsonify({'error': 'License key not found'}), 404
+    
+    is_blocked = license['is_blocked'] == 1
+    initial = {'license_key': license_key, 'event': 'status', 'active': not is_blocked, 'blocked': is_blocked}
+    
+    def stream():
+        try:
+            # Stagger reconnects so clients don't come back in one wave
+            yield f"retry: {random.randint(2000, 10000)}\n\n"
+            yield format_sse('status', initial)
+            # Streams are closed periodically (EventSource reconnects) so threads get recycled
+            deadline = time.monotonic() + EVENTS_STREAM_TIMEOUT
+            while time.monotonic() < deadline:
+                try:
+                    event = subscriber.get(timeout=EVENTS_KEEPALIVE)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                yield format_sse('status', license_event_status(license_key, event))
+                if event == 'deleted':
+                    break
+        finally:
+            event_hub.unsubscribe(license_key, subscriber)
+    
+    response = Response(stream(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Don't let proxies buffer the stream
+    return response
 
 @app.route('/api/licenses/<license_key>/devices', methods=['GET'])
 def get_license_devices(license_key):
     """Get all devices for a license key"""
     license_key = license_key.upper()
     
-    conn = get_db_connection()
+    conn = get_device_connection(get_db_connection(), license_key)
+    
+    # Heartbeats that have not been flushed yet are part of the response, so they are part of the ETag
+    pending = heartbeat_buffer.pending_for(license_key)
+    etag = change_etag('devices', license_key, get_change_version(conn, 'device_registrations'),
+                       json.dumps(sorted(pending.items())))
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
+    
     devices = conn.execute('''
         SELECT device_fingerprint, registered_at, last_seen 
         FROM device_registrations 
@@ -601,27 +3152,810 @@ def get_license_devices(license_key):
     ''', (license_key,)).fetchall()
     
     device_list = [dict(row) for row in devices]
-    conn.close()
     
-    return jsonify(device_list), 200
+    # Include heartbeats that have not been flushed yet
+    if pending:
+        for device in device_list:
+            seen = pending.get(device['device_fingerprint'])
+            if seen and seen > device['last_seen']:
+                device['last_seen'] = seen
+        device_list.sort(key=lambda device: device['last_seen'], reverse=True)
+    
+    response = jsonify(device_list)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response, 200
+
+@app.route('/api/licenses/<license_key>/devices/<path:device_fingerprint>', methods=['DELETE'])
+def delete_license_device(license_key, device_fingerprint):
+    """Remove a registered device from a license"""
+    license_key = license_key.upper()
+    
+    conn = get_db_connection()
+    devices_conn = get_device_connection(conn, license_key)
+    cursor = devices_conn.execute(
+        'DELETE FROM device_registrations WHERE license_key = ? AND device_fingerprint = ?',
+        (license_key, device_fingerprint)
+    )
+    devices_conn.commit()
+    heartbeat_buffer.forget(license_key, device_fingerprint)
+    if cursor.rowcount == 0:
+        return jsonify({'error': 'Device not found'}), 404
+    adjust_device_counts(conn, {license_key: -1})
+    # Cached device counts are stale now, here and in the other workers
+    bump_change_version(conn, 'license_status')
+    conn.commit()
+    license_cache.invalidate(license_key)
+    
+    return jsonify({
+        'message': 'Device removed successfully',
+        'device_count': get_device_count(license_key, conn)
+    }), 200
+
+# Device retention - devices not seen for longer than their license's retention window
+# are deleted (or archived) in small batches; the count triggers keep licenses.devices right
+DEVICE_RETENTION_DAYS = int(os.environ.get('DEVICE_RETENTION_DAYS', 90))  # 0 keeps devices forever
+DEVICE_PRUNE_ARCHIVE = os.environ.get('DEVICE_PRUNE_ARCHIVE', '').lower() in ('1', 'true', 'yes')
+DEVICE_PRUNE_INTERVAL = float(os.environ.get('DEVICE_PRUNE_INTERVAL', 0))  # Seconds; 0 disables the scheduler
+DEVICE_PRUNE_BATCH = 500  # Rows per write transaction
+DEVICE_PRUNE_PAUSE = 0.05  # Seconds between batches so other writers get the lock
+ACTIVITY_ROLLUP_RETENTION_DAYS = int(os.environ.get('ACTIVITY_ROLLUP_RETENTION_DAYS', 400))
+MAINTENANCE_LEASE_TTL = 900
+INCREMENTAL_VACUUM_PAGES = 2000
+
+def acquire_lease(conn, name, owner, ttl=MAINTENANCE_LEASE_TTL):
+    """Take or renew a named lease, returning True if owner holds it afterwards"""
+    now = time.time()
+    conn.execute('''
+        INSERT INTO maintenance_leases (name, owner, expires_at) VALUES (?, ?, ?)
+        ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+        WHERE maintenance_leases.owner = excluded.owner OR maintenance_leases.expires_at < ?
+    ''', (name, owner, now + ttl, now))
+    conn.commit()
+    row = conn.execute('SELECT owner FROM maintenance_leases WHERE name = ?', (name,)).fetchone()
+    return row is not None and row['owner'] == owner
+
+def release_lease(conn, name, owner):
+    conn.execute('DELETE FROM maintenance_leases WHERE name = ? AND owner = ?', (name, owner))
+    conn.commit()
+
+def prune_stale_devices(conn, default_days=DEVICE_RETENTION_DAYS, archive=DEVICE_PRUNE_ARCHIVE,
+                        batch_size=DEVICE_PRUNE_BATCH, pause=DEVICE_PRUNE_PAUSE, dry_run=False, on_batch=None):
+    """Delete (or archive) devices older than their license's retention window.
+    
+    Walks each device store's device_registrations oldest-first by last_seen and removes
+    each batch in its own short write transaction. A device is only removed if its
+    last_seen has not changed since it was read, so a device that checks in meanwhile
+    is kept. Returns counts of scanned and removed rows.
+    """
+    now = datetime.now()
+    # Per-license overrides; every other license uses default_days
+    overrides = dict(conn.execute(
+        'SELECT license_key, retention_days FROM licenses WHERE retention_days IS NOT NULL'
+    ).fetchall())
+    shortest = min((days for days in [default_days, *overrides.values()] if days > 0), default=None)
+    stats = {'scanned': 0, 'removed': 0, 'archived': 0, 'batches': 0}
+    if shortest is None:
+        return stats
+    # No device seen after this can be stale under any policy
+    scan_cutoff = (now - timedelta(days=shortest)).strftime('%Y-%m-%d %H:%M:%S')
+    archived_at = now.strftime('%Y-%m-%d %H:%M:%S')
+    
+    for devices_conn in device_shards(conn):
+        after = ('', 0)
+        while True:
+            rows = devices_conn.execute('''
+                SELECT id, license_key, last_seen FROM device_registrations
+                WHERE last_seen < ? AND (last_seen, id) > (?, ?)
+                ORDER BY last_seen, id
+                LIMIT ?
+            ''', (scan_cutoff, after[0], after[1], batch_size)).fetchall()
+            if not rows:
+                break
+            after = (rows[-1]['last_seen'], rows[-1]['id'])
+            stats['scanned'] += len(rows)
+            
+            stale = []
+            for row in rows:
+                days = overrides.get(row['license_key'], default_days)
+                if days > 0 and row['last_seen'] < (now - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S'):
+                    stale.append((row['id'], row['last_seen']))
+            if not stale or dry_run:
+                stats['removed'] += len(stale)
+                continue
+            
+            try:
+                devices_conn.execute('BEGIN IMMEDIATE')
+                if archive:
+                    stats['archived'] += devices_conn.executemany('''
+                        INSERT OR REPLACE INTO device_registrations_archive
+                            (id, license_key, device_fingerprint, registered_at, last_seen,
+                             registered_epoch, last_seen_epoch, archived_at)
+                        SELECT id, license_key, device_fingerprint, registered_at, last_seen,
+                               registered_epoch, last_seen_epoch, ?
+                        FROM device_registrations WHERE id = ? AND last_seen = ?
+                    ''', [(archived_at, device_id, last_seen) for device_id, last_seen in stale]).rowcount
+                removed_keys = [
+                    row[0] for device_id, last_seen in stale for row in devices_conn.execute(
+                        'DELETE FROM device_registrations WHERE id = ? AND last_seen = ? RETURNING license_key',
+                        (device_id, last_seen)
+                    ).fetchall()
+                ]
+                devices_conn.commit()
+            except Exception:
+                devices_conn.rollback()
+                raise
+            stats['removed'] += len(removed_keys)
+            deltas = {}
+            for license_key in removed_keys:
+                deltas[license_key] = deltas.get(license_key, 0) - 1
+            adjust_device_counts(conn, deltas)
+            stats['batches'] += 1
+            if on_batch:
+                on_batch()
+            time.sleep(pause)
+    
+    if stats['removed'] and not dry_run:
+        # Cached device counts are stale now
+        bump_change_version(conn, 'license_status')
+        conn.commit()
+    return stats
+
+def prune_activity_rollups(conn, days=ACTIVITY_ROLLUP_RETENTION_DAYS):
+    """Drop activity rollup buckets older than the rollup retention window"""
+    cutoff = int(time.time()) - days * 86400
+    removed = 0
+    for devices_conn in device_shards(conn):
+        removed += devices_conn.execute('DELETE FROM device_activity_rollups WHERE bucket < ?', (cutoff,)).rowcount
+        devices_conn.commit()
+    return removed
+
+def compact_database(conn):
+    """Return free pages to the OS (if incremental auto-vacuum is on) and refresh planner statistics"""
+    freed = 0
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:  # INCREMENTAL
+        before = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        conn.execute(f'PRAGMA incremental_vacuum({INCREMENTAL_VACUUM_PAGES})').fetchall()
+        freed = before - conn.execute('PRAGMA freelist_count').fetchone()[0]
+    conn.execute('PRAGMA optimize')
+    return freed
+
+def run_device_maintenance(conn, **prune_options):
+    """Prune stale devices and compact the database under the 'device-retention' lease.
+    
+    Returns the prune statistics, or None if another process holds the lease.
+    """
+    owner = f'{os.uname().nodename}:{os.getpid()}:{secrets.token_hex(4)}'
+    if not acquire_lease(conn, 'device-retention', owner):
+        return None
+    try:
+        stats = prune_stale_devices(conn, on_batch=lambda: acquire_lease(conn, 'device-retention', owner), **prune_options)
+        if not prune_options.get('dry_run'):
+            stats['rollups_removed'] = prune_activity_rollups(conn)
+            stats['changes_removed'] = prune_license_changes(conn)
+            stats['vacuumed_pages'] = sum(
+                compact_database(db) for db in [conn] + (device_shards(conn) if DEVICE_SHARDS else [])
+            )
+    finally:
+        release_lease(conn, 'device-retention', owner)
+    return stats
+
+class MaintenanceScheduler:
+    """Runs run_device_maintenance every interval seconds in a background thread of each worker"""
+    
+    def __init__(self, interval):
+        self.interval = interval
+        self._pid = None
+    
+    def ensure_started(self):
+        # Started lazily in each worker process; the lease keeps runs from overlapping
+        if self.interval <= 0 or self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        threading.Thread(target=self._run, name='device-maintenance', daemon=True).start()
+    
+    def _run(self):
+        conn = None
+        while True:
+            # Jitter so workers started together do not all race for the lease
+            time.sleep(self.interval * random.uniform(0.9, 1.1))
+            try:
+                conn = conn or open_db_connection()
+                stats = run_device_maintenance(conn)
+                if stats and stats['removed']:
+                    log.info('Device retention: removed %d stale device(s)', stats['removed'])
+            except Exception as e:
+                log.warning('Device maintenance failed: %s', e)
+                if conn is not None:
+                    conn.close()
+                    conn = None
+
+maintenance_scheduler = MaintenanceScheduler(DEVICE_PRUNE_INTERVAL)
+
+@app.route('/api/admin/prune-devices', methods=['POST'])
+def prune_devices():
+    """Run device retention now (?dry_run=1 only counts)"""
+    conn = get_db_connection()
+    dry_run = request.args.get('dry_run', '').lower() in ('1', 'true', 'yes')
+    stats = run_device_maintenance(conn, dry_run=dry_run)
+    if stats is None:
+        return jsonify({'error': 'Device maintenance is already running'}), 409
+    return jsonify(dict(stats, dry_run=dry_run)), 200
+
+# Analytics - served from the hourly device_activity_rollups, never from device_registrations
+ANALYTICS_MAX_BUCKETS = 24 * 90
+
+@app.route('/api/analytics/active-devices', methods=['GET'])
+def active_devices_series():
+    """Active devices per hour for one license (?license_key=) or all licenses (?from=&to= epoch seconds)"""
+    now = int(time.time())
+    try:
+        end = int(request.args.get('to', now))
+        start = int(request.args.get('from', end - 24 * 3600))
+    except ValueError:
+        return jsonify({'error': 'from and to must be epoch seconds'}), 400
+    
+    first_bucket = start // ACTIVITY_BUCKET_SECONDS * ACTIVITY_BUCKET_SECONDS
+    last_bucket = end // ACTIVITY_BUCKET_SECONDS * ACTIVITY_BUCKET_SECONDS
+    if last_bucket < first_bucket:
+        return jsonify({'error': 'from must not be after to'}), 400
+    if (last_bucket - first_bucket) // ACTIVITY_BUCKET_SECONDS + 1 > ANALYTICS_MAX_BUCKETS:
+        return jsonify({'error': f'At most {ANALYTICS_MAX_BUCKETS} hourly buckets per request'}), 400
+    
+    conn = get_db_connection()
+    license_key = request.args.get('license_key', '').strip().upper()
+    if license_key:
+        is_valid, error_msg = validate_license_key(license_key)
+        if not is_valid:
+            return jsonify({'error': error_msg}), 400
+        counts = dict(get_device_connection(conn, license_key).execute(
+            'SELECT bucket, active_devices FROM device_activity_rollups '
+            'WHERE license_key = ? AND bucket BETWEEN ? AND ?',
+            (license_key, first_bucket, last_bucket)
+        ).fetchall())
+    else:
+        counts = {}
+        for devices_conn in device_shards(conn):
+            for bucket, active_devices in devices_conn.execute(
+                'SELECT bucket, SUM(active_devices) FROM device_activity_rollups '
+                'WHERE bucket BETWEEN ? AND ? GROUP BY bucket',
+                (first_bucket, last_bucket)
+            ):
+                counts[bucket] = counts.get(bucket, 0) + active_devices
+    
+    return jsonify({
+        'license_key': license_key or None,
+        'bucket_seconds': ACTIVITY_BUCKET_SECONDS,
+        'from': first_bucket,
+        'to': last_bucket,
+        'series': [
+            {'bucket': bucket, 'active_devices': counts.get(bucket, 0)}
+            for bucket in range(first_bucket, last_bucket + 1, ACTIVITY_BUCKET_SECONDS)
+        ]
+    }), 200
+
+@app.route('/api/admin/reconcile', methods=['POST'])
+def reconcile_devices():
+    """Recompute all device counts from device_registrations"""
+    conn = get_db_connection()
+    corrected = reconcile_device_counts(conn)
+    return jsonify({'message': 'Device counts reconciled', 'corrected': corrected}), 200
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus metrics summed across all worker processes"""
+    return Response(metrics.collect(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/admin/cache-stats', methods=['GET'])
+def cache_stats():
+    """License status cache counters for this worker process"""
+    return jsonify(dict(license_cache.stats(), pid=os.getpid())), 200
+
+# Streaming export/import - rows are read and written in chunks so memory stays flat
+# regardless of table size
+EXPORT_TABLES = {
+    'licenses': ('licenses', ('id', 'username', 'amount', 'license_key', 'devices', 'is_blocked', 'created_at', 'retention_days')),
+    'devices': ('device_registrations', ('id', 'license_key', 'device_fingerprint', 'registered_at', 'last_seen')),
+}
+EXPORT_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+EXPORT_FETCH_ROWS = 1000
+IMPORT_CHUNK_ROWS = 1000  # Rows per import transaction
+IMPORT_ERRORS_MAX = 100  # Row errors listed in the import response
+
+def export_rows(kind, fmt, compress):
+    """Yield an export of one table as CSV or NDJSON chunks, optionally gzip-compressed"""
+    table, columns = EXPORT_TABLES[kind]
+    compressor = zlib.compressobj(wbits=31) if compress else None  # wbits=31 writes a gzip container
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == 'csv' else None
+    if writer:
+        writer.writerow(columns)
+    # Devices are read shard by shard when sharded (ids are then only unique per shard)
+    for path in (device_database_paths() if kind == 'devices' else [DATABASE]):
+        # The response outlives the request's pooled connections, so the cursor gets its own
+        conn = open_db_connection(path)
+        try:
+            cursor = conn.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY id")
+            while True:
+                rows = cursor.fetchmany(EXPORT_FETCH_ROWS)
+                if not rows:
+                    break
+                for row in rows:
+                    if writer:
+                        writer.writerow(tuple(row))
+                    else:
+                        buffer.write(json.dumps(dict(row)) + '\n')
+                data = buffer.getvalue().encode('utf-8')
+                buffer.seek(0)
+                buffer.truncate()
+                yield compressor.compress(data) if compressor else data
+        finally:
+            conn.close()
+    data = buffer.getvalue().encode('utf-8')
+    yield compressor.compress(data) + compressor.flush() if compressor else data
+
+def read_import_rows(stream, fmt):
+    """Yield (line_number, row dict or None, error) from an uploaded CSV or NDJSON stream"""
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row, None
+        return
+    for line_number, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield line_number, None, 'Invalid JSON'
+            continue
+        if not isinstance(row, dict):
+            yield line_number, None, 'Row must be a JSON object'
+            continue
+        yield line_number, row, None
+
+def parse_import_timestamp(value, default):
+    """Validate an imported 'YYYY-MM-DD HH:MM:SS' timestamp (empty means default), returning (text, error)"""
+    if value in (None, ''):
+        return default, None
+    try:
+        return datetime.strptime(str(value).strip(), '%Y-%m-%d %H:%M:%S').strftime('%Y-%m-%d %H:%M:%S'), None
+    except ValueError:
+        return None, f'Invalid timestamp {str(value)[:40]!r}, expected YYYY-MM-DD HH:MM:SS'
+
+def parse_import_license(row, now):
+    """Validate an imported license row, returning (parameters, error)"""
+    license_key = str(row.get('license_key') or '').strip().upper()
+    is_valid, error_msg = validate_license_key(license_key)
+    if not is_valid:
+        return None, error_msg
+    username = str(row.get('username') or '').strip()
+    if not username:
+        return None, 'Username is required'
+    try:
+        amount = float(row.get('amount') or 0)
+        is_blocked = int(row.get('is_blocked') or 0)
+    except (ValueError, TypeError):
+        return None, 'Invalid amount or is_blocked'
+    if amount < 0:
+        return None, 'Amount cannot be negative'
+    retention_days, error_msg = parse_retention_days(row.get('retention_days'))
+    if error_msg:
+        return None, error_msg
+    created_at, error_msg = parse_import_timestamp(row.get('created_at'), now)
+    if error_msg:
+        return None, f'created_at: {error_msg}'
+    # devices is not imported: the device count triggers rebuild it as devices are imported
+    return (username, amount, license_key, 1 if is_blocked else 0, created_at, retention_days), None
+
+def parse_import_device(row, now):
+    """Validate an imported device row, returning (parameters, error)"""
+    license_key = str(row.get('license_key') or '').strip().upper()
+    is_valid, error_msg = validate_license_key(license_key)
+    if not is_valid:
+        return None, error_msg
+    device_fingerprint = str(row.get('device_fingerprint') or '').strip()
+    if not device_fingerprint:
+        return None, 'Device fingerprint is required'
+    registered_at, error_msg = parse_import_timestamp(row.get('registered_at'), now)
+    if error_msg:
+        return None, f'registered_at: {error_msg}'
+    last_seen, error_msg = parse_import_timestamp(row.get('last_seen'), registered_at)
+    if error_msg:
+        return None, f'last_seen: {error_msg}'
+    return (license_key, device_fingerprint, registered_at, last_seen, license_key), None
+
+# kind -> (row parser, insert statement, position of license_key in the parameters)
+IMPORT_SQL = {
+    'licenses': (
+        parse_import_license,
+        'INSERT INTO licenses (username, amount, license_key, devices, is_blocked, created_at, retention_days, created_epoch) '
+        f"VALUES (?1, ?2, ?3, 0, ?4, ?5, ?6, {epoch_sql('?5')}) ON CONFLICT (license_key) DO NOTHING",
+        2
+    ),
+    # Devices whose license does not exist are skipped rather than failing the chunk on the foreign key
+    'devices': (
+        parse_import_device,
+        'INSERT INTO device_registrations '
+        '(license_key, device_fingerprint, registered_at, last_seen, registered_epoch, last_seen_epoch) '
+        f"SELECT ?1, ?2, ?3, ?4, {epoch_sql('?3')}, {epoch_sql('?4')} "
+        'WHERE EXISTS (SELECT 1 FROM licenses WHERE license_key = ?5) '
+        'ON CONFLICT (license_key, device_fingerprint) DO NOTHING',
+        0
+    ),
+}
+
+def import_chunk(conn, sql, params, key_index):
+    """Insert one chunk of import rows in its own transaction, returning the number inserted"""
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        inserted = conn.executemany(sql, params).rowcount
+        # New licenses and device counts must not be served from stale status caches
+        bump_change_version(conn, 'license_status')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    license_cache.invalidate(*{param[key_index] for param in params})
+    return inserted
+
+def import_device_chunk(conn, params):
+    """Sharded import_chunk for devices: skip unknown licenses, insert per shard, recount in the primary"""
+    known = {row[0] for row in select_in_chunks(
+        conn, 'SELECT license_key FROM licenses WHERE license_key IN ({placeholders})',
+        list({param[0] for param in params})
+    )}
+    inserted = 0
+    for index, rows in group_by_device_shard([param for param in params if param[0] in known], lambda row: row[0]).items():
+        shard = get_device_shard(index)
+        try:
+            shard.execute('BEGIN IMMEDIATE')
+            inserted += shard.executemany(
+                'INSERT INTO device_registrations '
+                '(license_key, device_fingerprint, registered_at, last_seen, registered_epoch, last_seen_epoch) '
+                f"VALUES (?1, ?2, ?3, ?4, {epoch_sql('?3')}, {epoch_sql('?4')}) "
+                'ON CONFLICT (license_key, device_fingerprint) DO NOTHING',
+                [row[:4] for row in rows]
+            ).rowcount
+            counts = list(select_in_chunks(
+                shard,
+                'SELECT COUNT(*), license_key FROM device_registrations WHERE license_key IN ({placeholders}) GROUP BY license_key',
+                list({row[0] for row in rows})
+            ))
+            shard.commit()
+        except Exception:
+            shard.rollback()
+            raise
+        conn.executemany('UPDATE licenses SET devices = ? WHERE license_key = ?', [tuple(row) for row in counts])
+        bump_change_version(conn, 'license_status')
+        conn.commit()
+        license_cache.invalidate(*{row[0] for row in rows})
+    return inserted
+
+@app.route('/api/export/<kind>', methods=['GET'])
+def export_data(kind):
+    """Stream all licenses or device registrations as CSV or NDJSON (?format=csv|ndjson&gzip=1)"""
+    if kind not in EXPORT_TABLES:
+        return jsonify({'error': f"Unknown export '{kind}'. Use: {', '.join(EXPORT_TABLES)}"}), 404
+    fmt = request.args.get('format', 'csv').lower()
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f"format must be one of: {', '.join(EXPORT_FORMATS)}"}), 400
+    compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+    
+    if kind == 'devices':
+        heartbeat_buffer.flush()  # Export current last_seen values
+    
+    filename = f"{kind}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{fmt}" + ('.gz' if compress else '')
+    response = Response(
+        export_rows(kind, fmt, compress),
+        mimetype='application/gzip' if compress else EXPORT_FORMATS[fmt]
+    )
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/api/import/<kind>', methods=['POST'])
+def import_data(kind):
+    """Stream CSV or NDJSON rows into licenses or device registrations in chunked transactions"""
+    if kind not in IMPORT_SQL:
+        return jsonify({'error': f"Unknown import '{kind}'. Use: {', '.join(IMPORT_SQL)}"}), 404
+    fmt = request.args.get('format', 'csv').lower()
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f"format must be one of: {', '.join(EXPORT_FORMATS)}"}), 400
+    
+    stream = request.stream
+    if request.headers.get('Content-Encoding', '').lower() == 'gzip' or request.args.get('gzip', '').lower() in ('1', 'true', 'yes'):
+        stream = gzip.GzipFile(fileobj=stream, mode='rb')
+    
+    parse_row, sql, key_index = IMPORT_SQL[kind]
+    conn = get_db_connection()
+    if kind == 'devices' and DEVICE_SHARDS:
+        insert_chunk = lambda chunk: import_device_chunk(conn, chunk)
+    else:
+        insert_chunk = lambda chunk: import_chunk(conn, sql, chunk, key_index)
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    rows, inserted, error_count, errors = 0, 0, 0, []
+    chunk = []
+    try:
+        for line_number, row, error_msg in read_import_rows(stream, fmt):
+            rows += 1
+            if not error_msg:
+                params, error_msg = parse_row(row, now)
+            if error_msg:
+                error_count += 1
+                if len(errors) < IMPORT_ERRORS_MAX:
+                    errors.append({'line': line_number, 'error': error_msg})
+                continue
+            chunk.append(params)
+            if len(chunk) >= IMPORT_CHUNK_ROWS:
+                inserted += insert_chunk(chunk)
+                chunk = []
+        if chunk:
+            inserted += insert_chunk(chunk)
+    except (UnicodeDecodeError, OSError, EOFError, csv.Error) as e:
+        return jsonify({
+            'error': f'Could not read upload: {str(e)}',
+            'imported': inserted,
+            'rows': rows
+        }), 400
+    except Exception as e:
+        log.exception('Error importing %s: %s', kind, e)
+        return jsonify({'error': f'Database error: {str(e)}', 'imported': inserted, 'rows': rows}), 500
+    
+    return jsonify({
+        'rows': rows,
+        'imported': inserted,
+        'skipped': rows - error_count - inserted,  # Already present (or, for devices, license missing)
+        'failed': error_count,
+        'errors': errors
+    }), 200
+
+def rebalance_devices(conn, batch_size=DEVICE_PRUNE_BATCH):
+    """Move every device into the store it belongs to under the current DEVICE_SHARDS.
+    
+    Reads the primary database and every existing shard file, so it also undoes
+    sharding (DEVICE_SHARDS=0) or changes the shard count. Devices of deleted licenses
+    are dropped; archived devices stay where they are. Run it with the server stopped,
+    then reconcile device counts. Returns the number of devices moved.
+    """
+    known = {row[0] for row in conn.execute('SELECT license_key FROM licenses')}
+    base, ext = os.path.splitext(DATABASE)
+    sources = [DATABASE] + sorted(glob.glob(f'{glob.escape(base)}.devices-*{ext or ".db"}'))
+    targets = device_database_paths()
+    connections = {DATABASE: conn}
+    
+    def connect(path):
+        if path not in connections:
+            connections[path] = open_db_connection(path)
+        return connections[path]
+    
+    def target_of(license_key):
+        return targets[device_shard_index(license_key)] if DEVICE_SHARDS else DATABASE
+    
+    moved = 0
+    try:
+        for source_path in sources:
+            source = connect(source_path)
+            after = 0
+            while True:
+                rows = source.execute(
+                    'SELECT id, license_key, device_fingerprint, registered_at, last_seen '
+                    'FROM device_registrations WHERE id > ? ORDER BY id LIMIT ?',
+                    (after, batch_size)
+                ).fetchall()
+                if not rows:
+                    break
+                after = rows[-1]['id']
+                misplaced = [row for row in rows if target_of(row['license_key']) != source_path]
+                if not misplaced:
+                    continue
+                groups = {}
+                for row in misplaced:
+                    if row['license_key'] in known:
+                        groups.setdefault(target_of(row['license_key']), []).append(tuple(row)[1:])
+                for target_path, devices in groups.items():
+                    target = connect(target_path)
+                    target.executemany(DEVICE_UPSERT_SQL, devices)
+                    target.commit()
+                    moved += len(devices)
+                source.executemany('DELETE FROM device_registrations WHERE id = ?', [(row['id'],) for row in misplaced])
+                source.commit()
+            
+            # Activity history moves with the devices. The insert trigger has already counted
+            # each moved device in its latest bucket, so keep the larger of the two counts.
+            rollups = [
+                tuple(row) for row in source.execute(
+                    'SELECT license_key, bucket, active_devices FROM device_activity_rollups'
+                ) if target_of(row[0]) != source_path
+            ]
+            for target_path in {target_of(row[0]) for row in rollups}:
+                target = connect(target_path)
+                target.executemany('''
+                    INSERT INTO device_activity_rollups (license_key, bucket, active_devices) VALUES (?, ?, ?)
+                    ON CONFLICT (license_key, bucket) DO UPDATE
+                    SET active_devices = MAX(active_devices, excluded.active_devices)
+                ''', [row for row in rollups if target_of(row[0]) == target_path and row[0] in known])
+                target.commit()
+            source.executemany(
+                'DELETE FROM device_activity_rollups WHERE license_key = ? AND bucket = ?',
+                [row[:2] for row in rollups]
+            )
+            source.commit()
+    finally:
+        for path, other in connections.items():
+            if path != DATABASE:
+                other.close()
+    return moved
+
+@app.cli.command('reconcile')
+def reconcile_command():
+    """Recompute all device counts (flask --app server reconcile)"""
+    init_db()
+    conn = open_db_connection()
+    try:
+        corrected = reconcile_device_counts(conn)
+    finally:
+        conn.close()
+    print(f"Device counts reconciled, {corrected} license(s) corrected")
+
+@app.cli.command('rebalance-devices')
+def rebalance_devices_command():
+    """Move devices into their shards after changing DEVICE_SHARDS (flask --app server rebalance-devices)"""
+    init_db()
+    conn = open_db_connection()
+    try:
+        moved = rebalance_devices(conn)
+        corrected = reconcile_device_counts(conn)
+    finally:
+        conn.close()
+    layout = f'{DEVICE_SHARDS} device shard(s)' if DEVICE_SHARDS else 'the primary database'
+    print(f"Moved {moved} device(s) into {layout}, {corrected} license count(s) corrected")
+
+@app.cli.command('prune-devices')
+@click.option('--days', type=int, default=DEVICE_RETENTION_DAYS, show_default=True,
+              help='Retention for licenses without their own retention_days (0 = keep forever)')
+@click.option('--archive/--no-archive', default=DEVICE_PRUNE_ARCHIVE, help='Copy pruned devices to device_registrations_archive')
+@click.option('--batch-size', type=int, default=DEVICE_PRUNE_BATCH, show_default=True)
+@click.option('--dry-run', is_flag=True, help='Only count stale devices')
+@click.option('--enable-incremental-vacuum', is_flag=True,
+              help='Switch the database to incremental auto-vacuum (runs a full VACUUM once; stop the server first)')
+def prune_devices_command(days, archive, batch_size, dry_run, enable_incremental_vacuum):
+    """Delete or archive devices not seen within the retention window (flask --app server prune-devices)"""
+    init_db()
+    conn = open_db_connection()
+    try:
+        if enable_incremental_vacuum:
+            conn.isolation_level = None  # VACUUM cannot run inside a transaction
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.execute('VACUUM')
+            conn.isolation_level = ''
+            print("Incremental auto-vacuum enabled")
+        stats = run_device_maintenance(conn, default_days=days, archive=archive, batch_size=batch_size, dry_run=dry_run)
+    finally:
+        conn.close()
+    if stats is None:
+        print("Device maintenance is already running in another process")
+        return
+    verb = 'would remove' if dry_run else ('archived and removed' if archive else 'removed')
+    print(f"Scanned {stats['scanned']} device(s), {verb} {stats['removed']}"
+          + (f", freed {stats['vacuumed_pages']} page(s)" if 'vacuumed_pages' in stats else ''))
+
+# Static assets - frontend CSS/JS are loaded once, content-hashed and precompressed, and
+# served from /assets/<name>.<hash>.<ext> with immutable caching. The HTML pages are
+# rewritten to point at the hashed names and revalidated on every load.
+FRONTEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'frontend')
+ASSET_EXTENSIONS = ('.css', '.js')
+ASSET_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+JSON_GZIP_MIN_BYTES = int(os.environ.get('JSON_GZIP_MIN_BYTES', 1024))
+JSON_GZIP_LEVEL = 5  # Compression is per response, so favour speed over ratio
+
+try:
+    import brotli  # Optional: pip install brotli to also serve br-encoded assets
+except ImportError:
+    brotli = None
+
+class Asset:
+    """One file held in memory with its precompressed encodings"""
+    
+    def __init__(self, body, mimetype):
+        self.mimetype = mimetype
+        self.digest = hashlib.sha256(body).hexdigest()
+        self.encodings = {'identity': body, 'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            self.encodings['br'] = brotli.compress(body)
+    
+    def response(self, cache_control):
+        """Best encoding the client accepts, with an ETag for revalidation"""
+        accepted = request.accept_encodings
+        encoding = next((name for name in ('br', 'gzip') if name in self.encodings and accepted[name]), 'identity')
+        response = app.response_class(self.encodings[encoding], mimetype=self.mimetype)
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = cache_control
+        response.set_etag(f'{self.digest[:32]}-{encoding}')
+        return response.make_conditional(request)
+
+class AssetBundle:
+    """Hashed CSS/JS assets and the HTML pages that reference them"""
+    
+    REFERENCE = re.compile(r'(href|src)="([^"/:?#]+)"')
+    
+    def __init__(self, directory):
+        self.directory = directory
+        self.assets = {}  # hashed name -> Asset
+        self.urls = {}    # original file name -> /assets/<hashed name>
+        self.pages = {}   # page file name -> Asset
+    
+    def load(self):
+        assets, urls, pages = {}, {}, {}
+        names = sorted(os.listdir(self.directory))
+        for name in names:
+            stem, ext = os.path.splitext(name)
+            if ext not in ASSET_EXTENSIONS:
+                continue
+            with open(os.path.join(self.directory, name), 'rb') as f:
+                asset = Asset(f.read(), 'text/css' if ext == '.css' else 'text/javascript')
+            hashed = f'{stem}.{asset.digest[:12]}{ext}'
+            assets[hashed] = asset
+            urls[name] = f'/assets/{hashed}'
+        for name in names:
+            if name.endswith('.html'):
+                with open(os.path.join(self.directory, name), encoding='utf-8') as f:
+                    html = self.REFERENCE.sub(
+                        lambda m: f'{m.group(1)}="{urls.get(m.group(2), m.group(2))}"', f.read()
+                    )
+                pages[name] = Asset(html.encode('utf-8'), 'text/html')
+        self.assets, self.urls, self.pages = assets, urls, pages
+        log.info('Loaded %d frontend asset(s) (%s)', len(assets), 'gzip + brotli' if brotli else 'gzip')
+
+asset_bundle = AssetBundle(FRONTEND_DIR)
+asset_bundle.load()
+
+@app.route('/assets/<name>')
+def serve_asset(name):
+    """Serve a content-hashed frontend asset; its URL changes whenever the file does"""
+    asset = asset_bundle.assets.get(name)
+    if asset is None:
+        return jsonify({'error': 'Asset not found'}), 404
+    return asset.response(ASSET_CACHE_CONTROL)
+
+@app.after_request
+def compress_json_response(response):
+    """Gzip large JSON responses for clients that accept it"""
+    if (response.status_code != 200 or response.mimetype != 'application/json'
+            or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or not request.accept_encodings['gzip']):
+        return response
+    body = response.get_data()
+    if len(body) < JSON_GZIP_MIN_BYTES:
+        return response
+    response.set_data(gzip.compress(body, compresslevel=JSON_GZIP_LEVEL))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)  # Same content, different bytes
+    return response
 
 @app.route('/')
 def index():
     """Serve the main HTML file"""
-    return send_from_directory('frontend', 'index.html')
+    return asset_bundle.pages['index.html'].response('no-cache')
 
 @app.route('/login')
 def login():
     """Serve the login page"""
-    return send_from_directory('frontend', 'login.html')
+    return asset_bundle.pages['login.html'].response('no-cache')
 
 # Initialize database on import (for Render.com deployment)
 try:
     init_db()
-    print("✓ Database initialized successfully")
+    log.info('Database initialized successfully')
 except Exception as e:
-    print(f"⚠ Warning: Database initialization error: {str(e)}")
-    print("Server will continue, database will be initialized on first request")
+    log.warning('Database initialization error, will retry on first request: %s', e)
 
 if __name__ == '__main__':
     print("=" * 50)
@@ -634,6 +3968,8 @@ if __name__ == '__main__':
     print("API available at: http://localhost:5000/api")
     print("=" * 50)
     
+    metrics.clear()
+    
     # Run server
     app.run(debug=True, port=port, host=host)
 
@@ -0,0 +1,34 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def make_server(monkeypatch, tmp_path):
+    """Import a fresh server module on a temporary database.
+
+    server.py reads its settings from the environment at import time (and initializes
+    the database on import), so each configuration gets its own copy of the module.
+    """
+    def load(**env):
+        monkeypatch.setenv('DATABASE_PATH', str(tmp_path / 'licenses.db'))
+        monkeypatch.setenv('METRICS_DIR', str(tmp_path / 'metrics'))
+        monkeypatch.setenv('LOG_LEVEL', 'ERROR')
+        for name, value in env.items():
+            monkeypatch.setenv(name, str(value))
+        sys.modules.pop('server', None)
+        return importlib.import_module('server')
+
+    yield load
+    sys.modules.pop('server', None)
+
+@pytest.fixture
+def server(make_server):
+    return make_server()
+
+@pytest.fixture
+def client(server):
+    return server.app.test_client()
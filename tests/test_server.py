@@ -0,0 +1,412 @@
+import io
+import json
+import sqlite3
+from itertools import product
+
+import pytest
+
+BASELINE_SCHEMA = '''
+    CREATE TABLE licenses (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL,
+        amount REAL NOT NULL,
+        license_key TEXT UNIQUE NOT NULL,
+        devices INTEGER DEFAULT 0,
+        is_blocked INTEGER DEFAULT 0,
+        created_at TEXT NOT NULL
+    );
+    CREATE TABLE device_registrations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        license_key TEXT NOT NULL,
+        device_fingerprint TEXT NOT NULL,
+        registered_at TEXT NOT NULL,
+        last_seen TEXT NOT NULL,
+        UNIQUE(license_key, device_fingerprint)
+    );
+'''
+
+def create_license(client, username='alice'):
+    response = client.post('/api/licenses', json={'username': username, 'amount': 10})
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()
+
+def register(client, license_key, fingerprint):
+    response = client.post('/api/devices/register', json={'license_key': license_key, 'device_fingerprint': fingerprint})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+def device_count(client, license_key):
+    return client.get(f'/api/licenses/{license_key}/status').get_json()['device_count']
+
+def rollup_total(path, license_key):
+    with sqlite3.connect(path) as conn:
+        return conn.execute(
+            'SELECT COALESCE(SUM(active_devices), 0) FROM device_activity_rollups WHERE license_key = ?', (license_key,)
+        ).fetchone()[0]
+
+def devices_path(server, license_key):
+    return server.device_shard_path(server.device_shard_index(license_key)) if server.DEVICE_SHARDS else server.DATABASE
+
+def key_on_other_shard(server, license_key):
+    """An unused key whose devices live in a different shard than license_key's"""
+    return next(
+        key for key in (''.join(letters) for letters in product('QRSTUVWXYZ', repeat=6))
+        if server.device_shard_index(key) != server.device_shard_index(license_key)
+    )
+
+def test_license_status_and_revalidation(client):
+    assert client.get('/api/licenses/ABC/status').status_code == 400
+    assert client.get('/api/licenses/NOSUCH/status').status_code == 404
+    license_key = create_license(client)['license_key']
+
+    response = client.get(f'/api/licenses/{license_key.lower()}/status')
+    assert response.status_code == 200
+    body = response.get_json()
+    assert (body['license_key'], body['active'], body['blocked'], body['device_count']) == (license_key, True, False, 0)
+    assert response.headers['X-Next-Check-In'] == str(body['next_check_in'])
+    etag = response.headers['ETag']
+    assert etag.startswith('W/')
+
+    response = client.get(f'/api/licenses/{license_key}/status', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert 'X-Next-Check-In' in response.headers
+
+    register(client, license_key, 'laptop')
+    response = client.get(f'/api/licenses/{license_key}/status', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.get_json()['device_count'] == 1
+
+def test_upgrades_baseline_database(make_server, tmp_path):
+    with sqlite3.connect(tmp_path / 'licenses.db') as conn:
+        conn.executescript(BASELINE_SCHEMA)
+        conn.execute("INSERT INTO licenses (username, amount, license_key, devices, created_at) "
+                     "VALUES ('alice', 5, 'ABCDEF', 7, '2025-01-02 03:04:05')")
+        conn.executemany(
+            "INSERT INTO device_registrations (license_key, device_fingerprint, registered_at, last_seen) "
+            "VALUES (?, ?, '2025-01-02 03:04:05', '2025-01-03 00:00:00')",
+            [('ABCDEF', 'one'), ('ABCDEF', 'two'), ('GONEXX', 'orphan')]
+        )
+    server = make_server()
+
+    with sqlite3.connect(tmp_path / 'licenses.db') as conn:
+        versions = [row[0] for row in conn.execute('SELECT version FROM schema_version ORDER BY version')]
+        assert versions == [version for version, _, _ in server.SCHEMA_MIGRATIONS]
+        # Orphans of deleted licenses are dropped by the foreign key rebuild
+        assert conn.execute('SELECT COUNT(*) FROM device_registrations').fetchone()[0] == 2
+        assert conn.execute("SELECT created_epoch FROM licenses WHERE license_key = 'ABCDEF'").fetchone()[0] is not None
+
+    client = server.app.test_client()
+    assert device_count(client, 'ABCDEF') == 2  # Recounted, not the stale 7
+    register(client, 'ABCDEF', 'three')
+    assert device_count(client, 'ABCDEF') == 3
+
+@pytest.mark.parametrize('term', ['ali', 'ALICE', 'smith', 'o "q', 'xyz', 'al'])
+def test_search_matches_like(server, client, tmp_path, term):
+    for username in ('Alice Smith', 'alicia', 'MALICE', 'Bob "Quote" Jr', 'zed'):
+        create_license(client, username)
+    assert server._db_state['fts']
+
+    found = sorted(row['id'] for row in client.get('/api/licenses', query_string={'search': term}).get_json())
+    with sqlite3.connect(tmp_path / 'licenses.db') as conn:
+        expected = sorted(row[0] for row in conn.execute(
+            'SELECT id FROM licenses WHERE username LIKE ? OR license_key LIKE ?', (f'%{term}%', f'%{term}%')
+        ))
+    assert found == expected
+
+def test_keyset_pagination(client):
+    for index in range(7):
+        create_license(client, f'user{index}')
+    everything = [row['id'] for row in client.get('/api/licenses', query_string={'sort': 'username', 'order': 'asc'}).get_json()]
+
+    seen, cursor = [], None
+    while True:
+        query = {'sort': 'username', 'order': 'asc', 'limit': 3, 'fields': 'username'}
+        if cursor:
+            query['cursor'] = cursor
+        body = client.get('/api/licenses', query_string=query).get_json()
+        assert all(sorted(row) == ['id', 'username'] for row in body['licenses'])
+        seen += [row['id'] for row in body['licenses']]
+        cursor = body['next_cursor']
+        if not cursor:
+            break
+    assert seen == everything
+
+@pytest.mark.parametrize('query', [{'cursor': 'not-a-cursor'}, {'limit': 'x'}, {'sort': 'password'}, {'fields': 'secret'}])
+def test_license_list_rejects_bad_parameters(client, query):
+    response = client.get('/api/licenses', query_string=query)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+def test_device_counts_follow_register_and_delete(client):
+    license_key = create_license(client)['license_key']
+    register(client, license_key, 'laptop')
+    register(client, license_key, 'phone')
+    assert register(client, license_key, 'laptop')['device_count'] == 2  # Heartbeat, not a new device
+
+    assert client.delete(f'/api/licenses/{license_key}/devices/phone').status_code == 200
+    assert device_count(client, license_key) == 1
+    assert [d['device_fingerprint'] for d in client.get(f'/api/licenses/{license_key}/devices').get_json()] == ['laptop']
+    assert client.delete(f'/api/licenses/{license_key}/devices/phone').status_code == 404
+
+def test_license_updates_ignore_devices(client):
+    license = create_license(client)
+    for fingerprint in ('a', 'b', 'c'):
+        register(client, license['license_key'], fingerprint)
+
+    response = client.put(f"/api/licenses/{license['id']}", json={'username': 'renamed', 'devices': 0})
+    assert response.status_code == 200
+    assert response.get_json()['devices'] == 3
+    client.delete(f"/api/licenses/{license['license_key']}/devices/a")
+    assert device_count(client, license['license_key']) == 2
+
+    response = client.post('/api/licenses/bulk', json={'operations': [{'op': 'update', 'id': license['id'], 'devices': 50}]})
+    assert response.get_json()['results'][0]['license']['devices'] == 2
+    assert device_count(client, license['license_key']) == 2
+
+@pytest.mark.parametrize('shards', [0, 2])
+def test_device_removed_elsewhere_registers_again(make_server, monkeypatch, shards):
+    server = make_server(DEVICE_SHARDS=shards)
+    monkeypatch.setattr(server, 'KNOWN_DEVICE_CHECK', 0)
+    client = server.app.test_client()
+    license_key = create_license(client)['license_key']
+    register(client, license_key, 'laptop')
+    register(client, license_key, 'laptop')  # Now known: only buffered
+
+    # Removed by another worker, whose removal this worker's buffer never heard about
+    assert client.delete(f'/api/licenses/{license_key}/devices/laptop').status_code == 200
+    server.heartbeat_buffer.mark_known(license_key, 'laptop')
+
+    assert register(client, license_key, 'laptop')['device_count'] == 1
+    assert [d['device_fingerprint'] for d in client.get(f'/api/licenses/{license_key}/devices').get_json()] == ['laptop']
+
+@pytest.mark.parametrize('shards', [0, 2])
+def test_batch_registration_reports_new_devices(make_server, shards):
+    client = make_server(DEVICE_SHARDS=shards).app.test_client()
+    license_key = create_license(client)['license_key']
+    register(client, license_key, 'fp-3')
+    fingerprints = [f'fp-{index}' for index in range(700)]  # More than one IN (...) chunk
+
+    response = client.post('/api/devices/register/batch', json={'license_key': license_key, 'device_fingerprints': fingerprints})
+    body = response.get_json()
+    assert response.status_code == 200
+    assert body['device_count'] == 700
+    assert [device['device_fingerprint'] for device in body['devices'] if not device['is_new']] == ['fp-3']
+    assert register(client, license_key, 'fp-699')['device_count'] == 700
+    assert device_count(client, license_key) == 700
+
+def test_status_cache_follows_writes_from_other_workers(make_server, tmp_path):
+    server = make_server(LICENSE_CACHE_GENERATION_CHECK=0)
+    client = server.app.test_client()
+    license_key = create_license(client)['license_key']
+    assert client.get(f'/api/licenses/{license_key}/status').get_json()['blocked'] is False
+
+    # Another worker's write: served from this worker's cache until the generation row moves
+    with sqlite3.connect(tmp_path / 'licenses.db') as conn:
+        conn.execute('UPDATE licenses SET is_blocked = 1 WHERE license_key = ?', (license_key,))
+    assert client.get(f'/api/licenses/{license_key}/status').get_json()['blocked'] is False
+    with sqlite3.connect(tmp_path / 'licenses.db') as conn:
+        conn.execute("UPDATE change_versions SET version = version + 1 WHERE name = 'license_status'")
+    assert client.get(f'/api/licenses/{license_key}/status').get_json()['blocked'] is True
+
+def test_license_list_revalidation(client):
+    create_license(client)
+    response = client.get('/api/licenses')
+    etag = response.headers['ETag']
+    assert client.get('/api/licenses', headers={'If-None-Match': etag}).status_code == 304
+    # The query string is part of the ETag
+    assert client.get('/api/licenses?sort=username', headers={'If-None-Match': etag}).status_code == 200
+
+    create_license(client, 'bob')
+    response = client.get('/api/licenses', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert len(response.get_json()) == 2
+
+def test_device_list_revalidation(client):
+    license_key = create_license(client)['license_key']
+    register(client, license_key, 'laptop')
+    etag = client.get(f'/api/licenses/{license_key}/devices').headers['ETag']
+    assert client.get(f'/api/licenses/{license_key}/devices', headers={'If-None-Match': etag}).status_code == 304
+
+    register(client, license_key, 'laptop')  # Buffered heartbeat, not yet in the table
+    assert client.get(f'/api/licenses/{license_key}/devices', headers={'If-None-Match': etag}).status_code == 200
+
+def sse_messages(response):
+    """(event, data) for each message of a streamed response, skipping comments and retry hints"""
+    for chunk in response.response:
+        text = chunk.decode() if isinstance(chunk, bytes) else chunk
+        if text.startswith('event: '):
+            event_line, data_line = text.strip().split('\n')
+            yield event_line[len('event: '):], json.loads(data_line[len('data: '):])
+
+def test_event_stream_pushes_status_changes(make_server):
+    server = make_server(EVENTS_POLL_INTERVAL=0.05)
+    client = server.app.test_client()
+    license = create_license(client)
+    license_key = license['license_key']
+
+    response = client.get(f'/api/licenses/{license_key}/events', buffered=False)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    messages = sse_messages(response)
+    assert next(messages) == ('status', {'license_key': license_key, 'event': 'status', 'active': True, 'blocked': False})
+
+    client.post(f"/api/licenses/{license['id']}/block")
+    assert next(messages) == ('status', {'license_key': license_key, 'event': 'blocked', 'active': False, 'blocked': True})
+    client.delete(f"/api/licenses/{license['id']}")
+    assert next(messages)[1]['deleted'] is True
+    assert next(messages, None) is None  # The stream ends with the license
+    response.close()
+
+def test_event_stream_refusal_carries_retry_after(make_server):
+    client = make_server(EVENTS_MAX_STREAMS=0).app.test_client()
+    license_key = create_license(client)['license_key']
+    response = client.get(f'/api/licenses/{license_key}/events')
+    assert response.status_code == 503
+    assert 600 <= int(response.headers['Retry-After']) <= 900
+
+def license_keys(client):
+    return sorted(row['license_key'] for row in client.get('/api/licenses').get_json())
+
+@pytest.mark.parametrize('body', [[1], 'operations', 5, {'operations': []}, {'operations': {'op': 'create'}}])
+def test_bulk_rejects_malformed_body(client, body):
+    response = client.post('/api/licenses/bulk', json=body)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+def test_bulk_reports_each_operation(client):
+    license = create_license(client)
+    response = client.post('/api/licenses/bulk', json={'operations': [
+        {'op': 'create', 'username': 'bob', 'amount': 1},
+        {'op': 'update', 'id': 999999, 'username': 'ghost'},
+        {'op': 'block', 'id': license['id']},
+        {'op': 'frobnicate'},
+    ]})
+    body = response.get_json()
+    assert response.status_code == 200
+    assert (body['applied'], body['failed']) == (2, 2)
+    assert [result['status'] for result in body['results']] == ['ok', 'error', 'ok', 'error']
+    assert body['results'][0]['license']['username'] == 'bob'
+    assert body['results'][2]['license']['is_blocked'] == 1
+    assert client.get(f"/api/licenses/{license['license_key']}/status").get_json()['blocked'] is True
+
+def test_atomic_bulk_applies_nothing_on_error(client):
+    license = create_license(client)
+    before = license_keys(client)
+    response = client.post('/api/licenses/bulk', json={'atomic': True, 'operations': [
+        {'op': 'create', 'username': 'bob', 'amount': 1},
+        {'op': 'block', 'id': license['id']},
+        {'op': 'delete', 'id': 999999},  # Only found missing inside the transaction
+    ]})
+    body = response.get_json()
+    assert response.status_code == 400
+    assert body['applied'] == 0
+    assert [result['status'] for result in body['results']] == ['skipped', 'skipped', 'error']
+    assert license_keys(client) == before
+    assert client.get(f"/api/licenses/{license['license_key']}/status").get_json()['blocked'] is False
+
+def test_import_reports_bad_timestamps_per_line(client):
+    upload = (
+        'license_key,username,amount,created_at\n'
+        'AAAAAA,alice,1,2025-01-02 03:04:05\n'
+        'BBBBBB,bob,1,yesterday\n'
+    )
+    response = client.post('/api/import/licenses', data=io.BytesIO(upload.encode()))
+    body = response.get_json()
+    assert response.status_code == 200
+    assert (body['imported'], body['failed']) == (1, 1)
+    assert body['errors'][0]['line'] == 3
+    assert body['errors'][0]['error'].startswith('created_at: ')
+
+def test_key_allocator_does_not_advance_when_exhausted(server, client, tmp_path):
+    with sqlite3.connect(tmp_path / 'licenses.db') as conn:
+        conn.execute('UPDATE key_allocator SET next_index = ?', (server.LICENSE_KEYSPACE,))
+    assert client.post('/api/licenses', json={'username': 'alice', 'amount': 1}).status_code == 500
+    with sqlite3.connect(tmp_path / 'licenses.db') as conn:
+        assert conn.execute('SELECT next_index FROM key_allocator').fetchone()[0] == server.LICENSE_KEYSPACE
+
+@pytest.mark.parametrize('shards', [0, 2])
+def test_rename_moves_activity_rollups(make_server, shards):
+    server = make_server(DEVICE_SHARDS=shards)
+    client = server.app.test_client()
+    license = create_license(client)
+    old_key = license['license_key']
+    for fingerprint in ('a', 'b', 'c'):
+        register(client, old_key, fingerprint)
+    assert rollup_total(devices_path(server, old_key), old_key) == 3
+
+    new_key = key_on_other_shard(server, old_key) if shards else 'QQQQQQ'
+    assert client.put(f"/api/licenses/{license['id']}", json={'license_key': new_key}).status_code == 200
+    # The history moves with the devices and is not counted again when they are inserted
+    assert rollup_total(devices_path(server, new_key), new_key) == 3
+    assert rollup_total(devices_path(server, old_key), old_key) == 0
+
+def test_write_responses_omit_internal_columns(server, client):
+    license = create_license(client)
+    assert sorted(license) == sorted(server.LICENSE_FIELDS)
+    for response in (
+        client.put(f"/api/licenses/{license['id']}", json={'username': 'bob'}),
+        client.post(f"/api/licenses/{license['id']}/block"),
+        client.post(f"/api/licenses/{license['id']}/unblock"),
+    ):
+        assert sorted(response.get_json()) == sorted(server.LICENSE_FIELDS)
+
+def test_lease_of_removed_device_cannot_be_renewed(client):
+    license_key = create_license(client)['license_key']
+    assert 'X-License-Lease' not in client.get(f'/api/licenses/{license_key}/status?device=laptop').headers
+    lease = register(client, license_key, 'laptop')['lease']
+    assert client.post('/api/leases/renew', json={'lease': lease}).status_code == 200
+
+    client.delete(f'/api/licenses/{license_key}/devices/laptop')
+    assert client.post('/api/leases/renew', json={'lease': lease}).status_code == 404
+    assert device_count(client, license_key) == 0
+
+@pytest.mark.parametrize('body', [{'lease': 123}, {'lease': ['a.b']}, {'lease': 'é.x'}, {'lease': None}, [1], 'lease'])
+def test_malformed_leases_are_rejected(server, client, body):
+    assert client.post('/api/leases/renew', json=body).status_code == 401
+    assert client.post('/api/leases/verify', json=body).status_code == 401
+
+def test_lease_with_unexpected_claims_is_rejected(server, client):
+    with server.app.app_context():
+        secret = server.license_leases._load_secret(server.get_db_connection())
+    for claims in ([1, 2], {'k': 'ABCDEF'}, {'k': 'ABCDEF', 'd': 'x', 'b': 0, 'iat': 0, 'exp': '9999999999'}):
+        payload = server._b64url(json.dumps(claims).encode())
+        token = f'{payload}.{server.license_leases._sign(secret, payload)}'
+        assert client.post('/api/leases/verify', json={'lease': token}).status_code == 401
+
+def test_sharded_rename_moves_devices(make_server):
+    server = make_server(DEVICE_SHARDS=2)
+    client = server.app.test_client()
+    license = create_license(client)
+    old_key = license['license_key']
+    for fingerprint in ('a', 'b', 'c'):
+        register(client, old_key, fingerprint)
+
+    new_key = key_on_other_shard(server, old_key)
+    assert client.put(f"/api/licenses/{license['id']}", json={'license_key': new_key}).status_code == 200
+    assert device_count(client, new_key) == 3
+    assert client.get(f'/api/licenses/{old_key}/status').status_code == 404
+    assert sorted(d['device_fingerprint'] for d in client.get(f'/api/licenses/{new_key}/devices').get_json()) == ['a', 'b', 'c']
+    with sqlite3.connect(devices_path(server, old_key)) as conn:
+        assert conn.execute('SELECT COUNT(*) FROM device_registrations').fetchone()[0] == 0
+
+def test_change_feed(client):
+    assert client.get('/api/changes?since=x').status_code == 400
+    start = client.get('/api/changes').get_json()
+    assert (start['changes'], start['reset']) == ([], False)
+
+    kept = create_license(client)
+    dropped = create_license(client, 'bob')
+    client.post(f"/api/licenses/{kept['id']}/block")
+    client.delete(f"/api/licenses/{dropped['id']}")
+
+    body = client.get('/api/changes', query_string={'since': start['seq']}).get_json()
+    # One entry per license, with its latest state
+    assert [(change['id'], change['op']) for change in body['changes']] == [(kept['id'], 'upsert'), (dropped['id'], 'delete')]
+    assert body['changes'][0]['license']['is_blocked'] == 1
+    assert sorted(body['changes'][0]['license']) == sorted(kept)
+    assert body['seq'] == body['changes'][-1]['seq'] and body['more'] is False
+
+    page = client.get('/api/changes', query_string={'since': start['seq'], 'limit': 1}).get_json()
+    assert (len(page['changes']), page['more']) == (1, True)
+    assert client.get('/api/changes', query_string={'since': body['seq']}).get_json()['changes'] == []